@@ -1,27 +1,32 @@
-import pandas as pd
 import os
 import logging
-from bert_score import score
+from typing import List, Optional
+from bert_score import score, BERTScorer
 import torch
+from profiling import profiled
+from jsonl_io import read_jsonl, write_artifact, artifact_exists, artifact_path
+from sharded import run_sharded, default_shard_size
 
 logging.basicConfig(level=logging.INFO)
 
+@profiled
 def add_bertscores(
     model_name: str,
     file_path: str,
     version_name: str,
-    lang: str = 'en'
+    lang: str = 'en',
+    shard_size: Optional[int] = default_shard_size
 ):
     # Verify that the file exists
-    if not os.path.exists(file_path):
+    if not artifact_exists(file_path):
         raise FileNotFoundError(f"The file {file_path} does not exist.")
 
     # Read JSONL file
     try:
-        with open(file_path, 'r') as f:
-            if os.stat(file_path).st_size == 0:
-                raise ValueError("The input file is empty.")
-            df = pd.read_json(f, lines=True)
+        if os.stat(artifact_path(file_path)).st_size == 0:
+            raise ValueError("The input file is empty.")
+        # Sharded, only the first row is read here
+        df = read_jsonl(file_path, nrows=1 if shard_size is not None else None)
     except ValueError as e:
         logging.error(f"Error reading JSON file: {e}")
         return
@@ -32,13 +37,16 @@ def add_bertscores(
     output_file = os.path.join(input_dir, output_filename)
 
     # Check if the output file already exists
-    if os.path.exists(output_file):
+    if artifact_exists(output_file):
         logging.info(f"File {output_file} already exists. Skipping.")
         return
 
     logging.info(f"Processing file: {file_path}")
     logging.info(f"Output file will be: {output_file}")
 
+    if shard_size is not None:
+        return _add_bertscores_sharded(model_name, file_path, output_file, lang, shard_size)
+
     # Prepare data for BERTScore
     refs = df['joined_english_sentences'].tolist()
     cands = df[f'{model_name}_translation'].tolist()
@@ -52,13 +60,83 @@ def add_bertscores(
     df[f'{model_name}_bertscore'] = F1.tolist()
 
     if not df.empty:
-        df.to_json(output_file, orient='records', lines=True)
+        write_artifact(output_file, df)
         logging.info(f"Results saved to {output_file}")
     else:
         logging.warning("No data to save.")
 
     return output_file
 
+def _add_bertscores_sharded(model_name, file_path, output_file, lang, shard_size):
+    """add_bertscores shard by shard; the scoring model is loaded once for all shards."""
+    device = 'cuda' if torch.cuda.is_available() else 'cpu'
+    scorer = BERTScorer(lang=lang, device=device)
+
+    def score_shard(df):
+        _, _, F1 = scorer.score(df[f'{model_name}_translation'].tolist(), df['joined_english_sentences'].tolist(), verbose=True)
+        df[f'{model_name}_bertscore'] = F1.tolist()
+        return df
+
+    written = run_sharded(file_path, output_file, score_shard, shard_size)
+    if written is not None:
+        logging.info(f"Results saved to {output_file}")
+    return output_file
+
+@profiled
+def add_bertscores_batch(
+    model_names: List[str],
+    file_paths: List[str],
+    version_name: str,
+    lang: str = 'en',
+    shard_size: Optional[int] = default_shard_size
+) -> List[str]:
+    """
+    add_bertscores for several models' translation files with a single BERTScore pass:
+    the scoring model is loaded once and all candidates are scored in one call.
+    Sharded, the files are scored one at a time, so that only a shard is in memory.
+    """
+    if shard_size is not None:
+        output_files = []
+        for model_name, file_path in zip(model_names, file_paths):
+            add_bertscores(model_name, file_path, version_name, lang, shard_size)
+            input_dir, input_filename = os.path.split(file_path)
+            output_files.append(os.path.join(input_dir, f"{version_name}_{input_filename}"))
+        return output_files
+    pending = []
+    output_files = []
+    for model_name, file_path in zip(model_names, file_paths):
+        if not artifact_exists(file_path):
+            raise FileNotFoundError(f"The file {file_path} does not exist.")
+        input_dir, input_filename = os.path.split(file_path)
+        output_file = os.path.join(input_dir, f"{version_name}_{input_filename}")
+        output_files.append(output_file)
+        if artifact_exists(output_file):
+            logging.info(f"File {output_file} already exists. Skipping.")
+            continue
+        df = read_jsonl(file_path)
+        if df.empty:
+            logging.warning(f"No data in {file_path}.")
+            continue
+        pending.append((model_name, df, output_file))
+
+    if not pending:
+        return output_files
+
+    refs = [ref for _, df, _ in pending for ref in df['joined_english_sentences'].tolist()]
+    cands = [cand for model_name, df, _ in pending for cand in df[f'{model_name}_translation'].tolist()]
+    device = 'cuda' if torch.cuda.is_available() else 'cpu'
+    logging.info(f"Computing BERTScore for {len(pending)} models, {len(cands)} translations")
+    _, _, F1 = score(cands, refs, lang=lang, verbose=True, device=device)
+    F1 = F1.tolist()
+
+    start = 0
+    for model_name, df, output_file in pending:
+        df[f'{model_name}_bertscore'] = F1[start:start + len(df)]
+        start += len(df)
+        write_artifact(output_file, df)
+        logging.info(f"Results saved to {output_file}")
+    return output_files
+
 def main():
     model_name = "sonnet_3_point_5"
     file_path = "./Data/Output/translations/big_c_conversations_test_sonnet_3_point_5.jsonl"
@@ -1,10 +1,14 @@
-import pandas as pd
 import asyncio
 import os
 import re
 import logging
 from typing import Optional
 from dotenv import load_dotenv
+from verdict_log import append_verdict
+from call_stats import timed_call
+from profiling import profiled
+from jsonl_io import read_jsonl, write_artifact, artifact_exists, artifact_path
+from sharded import run_sharded_async, default_shard_size
 load_dotenv()
 
 logging.basicConfig(level=logging.INFO)
@@ -20,21 +24,23 @@ def get_llm_service_function(model_name: str):
     except (ImportError, AttributeError) as e:
         raise ImportError(f"LLM service function for model '{model_name}' not found") from e
 
+@profiled
 async def get_judgments(
     judgments_file_path: str,
     judgment_model: str,
-    version_name: str
+    version_name: str,
+    shard_size: Optional[int] = default_shard_size
 ):
     # Verify that the file exists
-    if not os.path.exists(judgments_file_path):
+    if not artifact_exists(judgments_file_path):
         raise FileNotFoundError(f"The file {judgments_file_path} does not exist.")
 
     # Read JSONL file
     try:
-        with open(judgments_file_path, 'r') as f:
-            if os.stat(judgments_file_path).st_size == 0:
-                raise ValueError("The input file is empty.")
-            df = pd.read_json(f, lines=True)
+        if os.stat(artifact_path(judgments_file_path)).st_size == 0:
+            raise ValueError("The input file is empty.")
+        # Sharded, only the first row is read here, for the model names
+        df = read_jsonl(judgments_file_path, nrows=1 if shard_size is not None else None)
     except ValueError as e:
         logging.error(f"Error reading JSON file: {e}")
         return
@@ -48,36 +54,47 @@ async def get_judgments(
 
     output_file = f"./Data/Output/consistency_judgments/{version_name}_big_c_test_{v1_model}_vs_{v2_model}.jsonl"
     # check if the file exists
-    if os.path.exists(output_file):
+    if artifact_exists(output_file):
         logging.info(f"File {output_file} already exists. Skipping.")
         return
     logging.info(f"Output file: {output_file}")
 
-    for index, row in df.iterrows():
-        try:
-            logging.info(f"Processing row {index}")
-            response = await llm_service_function(row['full_consistency_judgment_prompt'])
-            response = int(response)
-            logging.info(f"Received response for row {index}: {response}")
+    async def judge_rows(df):
+        for index, row in df.iterrows():
             try:
-                winner = ''
-                if response == 1:
-                    winner = v1_model
-                elif response == 2:
-                    winner = v2_model
-                elif response == 3:
-                    winner = 'tie'
+                logging.info(f"Processing row {index}")
+                with timed_call(judgment_model):
+                    response = await llm_service_function(row['full_consistency_judgment_prompt'])
+                response = int(response)
+                logging.info(f"Received response for row {index}: {response}")
+                try:
+                    winner = ''
+                    if response == 1:
+                        winner = v1_model
+                    elif response == 2:
+                        winner = v2_model
+                    elif response == 3:
+                        winner = 'tie'
+                    else:
+                        winner = 'unknown'
+                except ValueError as e:
+                    logging.error(f"Error converting response to int for row {index}: {e}")
+                    df.at[index, f'{judgment_model}_consistency_judgment'] = response
                 else:
-                    winner = 'unknown'
-                df.at[index, f'{judgment_model}_consistency_judgment'] = winner
-            except ValueError as e:
-                logging.error(f"Error converting response to int for row {index}: {e}")
-                df.at[index, f'{judgment_model}_consistency_judgment'] = response
-        except Exception as e:
-            logging.error(f"Error processing row {index}: {e}")
+                    df.at[index, f'{judgment_model}_consistency_judgment'] = winner
+                    # Publish the verdict for the live leaderboard
+                    append_verdict('consistency_battles', row['id'], v1_model, v2_model, winner)
+            except Exception as e:
+                logging.error(f"Error processing row {index}: {e}")
+        return df
+
+    if shard_size is not None:
+        await run_sharded_async(judgments_file_path, output_file, judge_rows, shard_size)
+        return
+    await judge_rows(df)
 
     if not df.empty:
-        df.to_json(output_file, orient='records', lines=True)
+        write_artifact(output_file, df)
         logging.info(f"Results saved to {output_file}")
     else:
         logging.warning("No data to save.")
@@ -1,10 +1,15 @@
-import pandas as pd
 import asyncio
 import os
 import re
 import logging
 from typing import Optional
+from concurrent.futures import ThreadPoolExecutor
 from dotenv import load_dotenv
+from verdict_log import append_verdict
+from call_stats import timed_call
+from profiling import profiled
+from jsonl_io import read_jsonl, write_artifact, artifact_exists, artifact_path
+from sharded import run_sharded_async, default_shard_size
 load_dotenv()
 
 logging.basicConfig(level=logging.INFO)
@@ -20,21 +25,86 @@ def get_llm_service_function(model_name: str):
     except (ImportError, AttributeError) as e:
         raise ImportError(f"LLM service function for model '{model_name}' not found") from e
 
+def judgment_winner(response: int, v1_model: str, v2_model: str) -> str:
+    """Map the judge's answer (1, 2 or 3 for a tie) to the winning model."""
+    if response == 1:
+        return v1_model
+    elif response == 2:
+        return v2_model
+    elif response == 3:
+        return 'tie'
+    return 'unknown'
+
+class JudgmentQueue:
+    """
+    One global queue of judgment calls with a fixed pool of workers. Judgment files
+    that are judged at the same time submit their rows here, so the total number of
+    calls in flight to the judgment model stays at max_concurrency. The response
+    functions wrap blocking clients, so each call runs in a thread of the queue's own
+    pool, with its own event loop, as in translation_sweep.call_llm_service.
+    """
+
+    def __init__(self, judgment_model: str, max_concurrency: int = 8):
+        self.judgment_model = judgment_model
+        self.max_concurrency = max_concurrency
+        self.llm_service_function = get_llm_service_function(judgment_model)
+        self._queue = None
+        self._workers = []
+        self._executor = None
+
+    def _call(self, prompt: str):
+        with timed_call(self.judgment_model):
+            return asyncio.run(self.llm_service_function(prompt))
+
+    async def _worker(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            prompt, future = await self._queue.get()
+            try:
+                response = await loop.run_in_executor(self._executor, self._call, prompt)
+                future.set_result(response)
+            except Exception as e:
+                future.set_exception(e)
+            finally:
+                self._queue.task_done()
+
+    async def judge(self, prompt: str):
+        if self._queue is None:
+            self._queue = asyncio.Queue()
+            self._executor = ThreadPoolExecutor(max_workers=self.max_concurrency)
+            self._workers = [asyncio.create_task(self._worker()) for _ in range(self.max_concurrency)]
+        future = asyncio.get_running_loop().create_future()
+        await self._queue.put((prompt, future))
+        return await future
+
+    async def close(self):
+        for worker in self._workers:
+            worker.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        if self._executor is not None:
+            self._executor.shutdown(wait=False)
+        self._queue = None
+        self._workers = []
+        self._executor = None
+
+@profiled
 async def add_judgments(
     judgments_file_path: str,
     judgment_model: str,
-    version_name: str
+    version_name: str,
+    judgment_queue: Optional[JudgmentQueue] = None,
+    shard_size: Optional[int] = default_shard_size
 ):
     # Verify that the file exists
-    if not os.path.exists(judgments_file_path):
+    if not artifact_exists(judgments_file_path):
         raise FileNotFoundError(f"The file {judgments_file_path} does not exist.")
 
     # Read JSONL file
     try:
-        with open(judgments_file_path, 'r') as f:
-            if os.stat(judgments_file_path).st_size == 0:
-                raise ValueError("The input file is empty.")
-            df = pd.read_json(f, lines=True)
+        if os.stat(artifact_path(judgments_file_path)).st_size == 0:
+            raise ValueError("The input file is empty.")
+        # Sharded, only the first row is read here, for the model names
+        df = read_jsonl(judgments_file_path, nrows=1 if shard_size is not None else None)
     except ValueError as e:
         logging.error(f"Error reading JSON file: {e}")
         return
@@ -48,36 +118,49 @@ async def add_judgments(
 
     output_file = f"./Data/Output/judgments/{version_name}_big_c_test_{v1_model}_vs_{v2_model}.jsonl"
     # check if the file exists
-    if os.path.exists(output_file):
+    if artifact_exists(output_file):
         logging.info(f"File {output_file} already exists. Skipping.")
         return
     logging.info(f"Output file: {output_file}")
 
-    for index, row in df.iterrows():
-        try:
-            logging.info(f"Processing row {index}")
-            response = await llm_service_function(row['full_judgment_prompt'])
-            response = int(response)
-            logging.info(f"Received response for row {index}: {response}")
+    async def judge_rows(df):
+        async def judge_row(index, row):
             try:
-                winner = ''
-                if response == 1:
-                    winner = v1_model
-                elif response == 2:
-                    winner = v2_model
-                elif response == 3:
-                    winner = 'tie'
+                logging.info(f"Processing row {index}")
+                if judgment_queue is None:
+                    with timed_call(judgment_model):
+                        response = await llm_service_function(row['full_judgment_prompt'])
+                else:
+                    response = await judgment_queue.judge(row['full_judgment_prompt'])
+                response = int(response)
+                logging.info(f"Received response for row {index}: {response}")
+                try:
+                    winner = judgment_winner(response, v1_model, v2_model)
+                except ValueError as e:
+                    logging.error(f"Error converting response to int for row {index}: {e}")
+                    df.at[index, f'{judgment_model}_judgment'] = response
                 else:
-                    winner = 'unknown'
-                df.at[index, f'{judgment_model}_judgment'] = winner
-            except ValueError as e:
-                logging.error(f"Error converting response to int for row {index}: {e}")
-                df.at[index, f'{judgment_model}_judgment'] = response
-        except Exception as e:
-            logging.error(f"Error processing row {index}: {e}")
+                    df.at[index, f'{judgment_model}_judgment'] = winner
+                    # Publish the verdict for the live leaderboard
+                    append_verdict('judgment_battles', row['id'], v1_model, v2_model, winner)
+            except Exception as e:
+                logging.error(f"Error processing row {index}: {e}")
+
+        if judgment_queue is None:
+            for index, row in df.iterrows():
+                await judge_row(index, row)
+        else:
+            # All rows go to the shared queue at once; its workers bound the concurrency
+            await asyncio.gather(*(judge_row(index, row) for index, row in df.iterrows()))
+        return df
+
+    if shard_size is not None:
+        await run_sharded_async(judgments_file_path, output_file, judge_rows, shard_size)
+        return
+    await judge_rows(df)
 
     if not df.empty:
-        df.to_json(output_file, orient='records', lines=True)
+        write_artifact(output_file, df)
         logging.info(f"Results saved to {output_file}")
     else:
         logging.warning("No data to save.")
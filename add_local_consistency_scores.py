@@ -0,0 +1,117 @@
+import os
+import logging
+import numpy as np
+import pandas as pd
+import torch
+from profiling import profiled
+from jsonl_io import read_jsonl, write_artifact, artifact_exists, list_artifacts
+
+logging.basicConfig(level=logging.INFO)
+
+high_temp_translations_folder = "./Data/Output/translations_high_temp"
+consistency_scores_folder = "./Data/Output/consistency_scores"
+
+CONSISTENCY_METRICS = ['embedding', 'bertscore']
+
+
+def load_high_temp_pair(model_name: str) -> pd.DataFrame:
+    """Load a model's _t1 and _t2 samples merged on 'id'."""
+    t1_path = os.path.join(high_temp_translations_folder, f"big_c_conversations_test_{model_name}_t1.jsonl")
+    t2_path = os.path.join(high_temp_translations_folder, f"big_c_conversations_test_{model_name}_t2.jsonl")
+    for path in [t1_path, t2_path]:
+        if not artifact_exists(path):
+            raise FileNotFoundError(f"The file {path} does not exist.")
+
+    t1_column = f"{model_name}_translation_t1"
+    t2_column = f"{model_name}_translation_t2"
+    df_t1 = read_jsonl(t1_path, ['id', t1_column])
+    df_t2 = read_jsonl(t2_path, ['id', t2_column])
+    # The translation scripts append rows, so keep the latest sample per id
+    df_t1 = df_t1.drop_duplicates(subset='id', keep='last')
+    df_t2 = df_t2.drop_duplicates(subset='id', keep='last')
+    df = df_t1.merge(df_t2, on='id', how='inner')
+    return df.dropna(subset=[t1_column, t2_column])
+
+
+def compute_agreement(samples_1, samples_2, metric: str = 'embedding', embedder=None):
+    """Score how close each pair of samples is; higher means more consistent."""
+    if metric == 'embedding':
+        embeddings = embedder.embed_documents_sync(list(samples_1) + list(samples_2))
+        embeddings_1 = embeddings[:len(samples_1)]
+        embeddings_2 = embeddings[len(samples_1):]
+        # LocalEmbeddingBackend returns normalized vectors
+        return np.sum(embeddings_1 * embeddings_2, axis=1).tolist()
+    elif metric == 'bertscore':
+        from bert_score import score
+        device = 'cuda' if torch.cuda.is_available() else 'cpu'
+        _, _, F1 = score(list(samples_1), list(samples_2), lang='en', verbose=True, device=device)
+        return F1.tolist()
+    raise ValueError(f"Unknown consistency metric '{metric}'. Expected one of {CONSISTENCY_METRICS}.")
+
+
+@profiled
+def add_local_consistency_scores(
+    model_name: str,
+    version_name: str = "v1",
+    metric: str = 'embedding',
+    embedder=None
+):
+    """
+    Write a per-id consistency score for one model, computed from the agreement
+    between its own two high-temperature samples. Each metric has its own file,
+    named after the embedding model or 'bertscore'. Returns the output file path.
+    """
+    if metric not in CONSISTENCY_METRICS:
+        raise ValueError(f"Unknown consistency metric '{metric}'. Expected one of {CONSISTENCY_METRICS}.")
+    if metric == 'embedding' and embedder is None:
+        from local_embeddings import LocalEmbeddingBackend
+        embedder = LocalEmbeddingBackend()
+    metric_name = embedder.name if metric == 'embedding' else metric
+
+    os.makedirs(consistency_scores_folder, exist_ok=True)
+    output_file = os.path.join(
+        consistency_scores_folder,
+        f"{version_name}_{metric_name}_big_c_conversations_test_{model_name}.jsonl"
+    )
+    if artifact_exists(output_file):
+        logging.info(f"File {output_file} already exists. Skipping.")
+        return output_file
+
+    df = load_high_temp_pair(model_name)
+    logging.info(f"Scoring consistency for {model_name} on {len(df)} conversations with {metric_name}")
+
+    df[f"{model_name}_{metric_name}_consistency"] = compute_agreement(
+        df[f"{model_name}_translation_t1"].tolist(),
+        df[f"{model_name}_translation_t2"].tolist(),
+        metric=metric,
+        embedder=embedder
+    )
+
+    if not df.empty:
+        write_artifact(output_file, df)
+        logging.info(f"Results saved to {output_file}")
+    else:
+        logging.warning("No data to save.")
+
+    return output_file
+
+
+def get_high_temp_models():
+    models = set()
+    for _, model_name in list_artifacts(high_temp_translations_folder, "big_c_conversations_test_", "_t1"):
+        t2_filename = f"big_c_conversations_test_{model_name}_t2.jsonl"
+        if artifact_exists(os.path.join(high_temp_translations_folder, t2_filename)):
+            models.add(model_name)
+    return sorted(models)
+
+
+def main():
+    # One pass per model; compile_prepared_files.py turns the scores into battles for every pair
+    from local_embeddings import LocalEmbeddingBackend
+    embedder = LocalEmbeddingBackend()
+    for model_name in get_high_temp_models():
+        add_local_consistency_scores(model_name, version_name="v1", metric='embedding', embedder=embedder)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,61 +1,133 @@
 import os
 import re
 import asyncio
-from get_regular_translations import get_regular_translations
+from functools import partial
+from itertools import combinations
+from translation_sweep import sweep_regular_translations
 # import the new model service
 from llm_services.get_google_translate_response import get_google_translate_response
 from llm_services.get_gemini_response import get_gemini_response
-from add_bertscores import add_bertscores
-from add_similarity_scores import add_similarity_scores
+from add_bertscores import add_bertscores_batch
+from add_similarity_scores import add_similarity_scores_batch
 from prepare_judgment_file import prepare_judgment_file
-from add_judgments import add_judgments
+from add_judgments import add_judgments, JudgmentQueue
+from pipeline import Pipeline
+from profiling import profiled
+from jsonl_io import read_jsonl, write_artifact, list_artifacts
 translations_folder = "./Data/Output/translations"
+judgments_folder = "./Data/Output/judgments"
+source_file_path = "./Data/Static/big_c_conversations_test.jsonl"
 
-new_llm_service = get_gemini_response
+# Models to onboard; they are translated concurrently and judged against the existing
+# models and against each other
+new_llm_services = [get_gemini_response]
 
-async def main():
-    output_file = await get_regular_translations(new_llm_service)
-    print(output_file) 
-    bertscores_version_name = "v2"
-    output_file = add_bertscores(
-        model_name=new_llm_service.__name__,
-        file_path=output_file,
-        version_name=bertscores_version_name
+# Version prefixes of each stage's output files
+bertscores_version_name = "v2"
+similarity_scores_version_name = "a"
+scores_version_name = similarity_scores_version_name + "_" + bertscores_version_name
+judgment_version_name = "v3"
+judgment_model = "gpt_4o"
+embedding_model = "text-embedding-ada-002"
+# Judgment calls in flight at once, across all judgment files
+judgment_concurrency = 8
+
+
+def translation_file_path(model_name: str, version_name: str = None) -> str:
+    file_name = f"big_c_conversations_test_{model_name}.jsonl"
+    if version_name is not None:
+        file_name = f"{version_name}_{file_name}"
+    return os.path.join(translations_folder, file_name)
+
+
+@profiled
+def merge_score_files(base_file_path: str, other_file_path: str, output_file_path: str):
+    """Add the columns of other_file_path that base_file_path lacks, matched by id."""
+    base_df = read_jsonl(base_file_path)
+    other_df = read_jsonl(other_file_path)
+    new_columns = [col for col in other_df.columns if col not in base_df.columns]
+    merged_df = base_df.merge(other_df[['id'] + new_columns], on='id', how='left')
+    write_artifact(output_file_path, merged_df)
+
+
+def existing_models(new_model_names):
+    """Models that already have a scored translation file, other than the new ones."""
+    models = set()
+    prefix = f"{scores_version_name}_big_c_conversations_test_"
+    for _, other_model in list_artifacts(translations_folder, prefix):
+        if other_model not in new_model_names:
+            models.add(other_model)
+    return sorted(models)
+
+
+def build_pipeline(llm_services, judgment_queue: JudgmentQueue) -> Pipeline:
+    model_names = [llm_service.__name__ for llm_service in llm_services]
+    translations = [translation_file_path(model_name) for model_name in model_names]
+    bertscores = [translation_file_path(model_name, bertscores_version_name) for model_name in model_names]
+    similarity_scores = [translation_file_path(model_name, similarity_scores_version_name) for model_name in model_names]
+
+    pipeline = Pipeline()
+    # Each provider translates in its own stage, with its own concurrency from
+    # translation_sweep.provider_concurrency, so the providers run concurrently
+    for llm_service, model_name, translation_file in zip(llm_services, model_names, translations):
+        pipeline.add_stage(
+            f"translations_{model_name}", partial(sweep_regular_translations, [llm_service]),
+            inputs=[source_file_path], outputs=[translation_file], params={'model': model_name},
+            resumable=True
+        )
+    # One BERTScore pass and one embedding pass over all new models; both read the
+    # translations, so they run concurrently
+    pipeline.add_stage(
+        "bertscores", partial(add_bertscores_batch, model_names, translations, bertscores_version_name),
+        inputs=translations, outputs=bertscores, params={'models': model_names}
     )
-    print(output_file)
-    similarity_scores_version_name = "a"
-    add_similarity_scores(
-        file_path=output_file,
-        version_name=similarity_scores_version_name,
-        embedding_model='text-embedding-ada-002'
+    pipeline.add_stage(
+        "similarity_scores", partial(
+            add_similarity_scores_batch, translations,
+            version_name=similarity_scores_version_name, embedding_model=embedding_model
+        ),
+        inputs=translations, outputs=similarity_scores, params={'embedding_model': embedding_model}
     )
+    for model_name, bertscore_file, similarity_file in zip(model_names, bertscores, similarity_scores):
+        pipeline.add_stage(
+            f"merge_scores_{model_name}",
+            partial(merge_score_files, bertscore_file, similarity_file, translation_file_path(model_name, scores_version_name)),
+            inputs=[bertscore_file, similarity_file], outputs=[translation_file_path(model_name, scores_version_name)]
+        )
 
-    existing_models = set()
-    input_version_name = similarity_scores_version_name + "_" + bertscores_version_name
-    for filename in os.listdir(translations_folder):
-        if filename.endswith(".jsonl") and filename.startswith(input_version_name):
-            model_name = filename.replace(f"{input_version_name}_big_c_conversations_test_", "").replace(".jsonl", "")
-            if model_name != new_llm_service.__name__:
-                existing_models.add(model_name)
-    existing_models = list(existing_models)
-    print(existing_models)
-
-    output_files = []
-    for model in existing_models:
-        output_files.append(prepare_judgment_file(
-            v1_model=new_llm_service.__name__,
-            v2_model=model,
-            input_version_name=input_version_name
-        ))
-
-    print(output_files)
-    for file in output_files:
-        await add_judgments(
-            judgments_file_path=file,
-            judgment_model='gpt_4o',
-            version_name='v3'
+    # Every new model against every existing model, and the new models against each other
+    pairs = [(model_name, other_model) for model_name in model_names for other_model in existing_models(model_names)]
+    pairs += list(combinations(model_names, 2))
+    for model_name, other_model in pairs:
+        judgment_file = os.path.join(judgments_folder, f"big_c_test_{model_name}_vs_{other_model}.jsonl")
+        judged_file = os.path.join(judgments_folder, f"{judgment_version_name}_big_c_test_{model_name}_vs_{other_model}.jsonl")
+        pipeline.add_stage(
+            f"prepare_judgment_{model_name}_vs_{other_model}", partial(
+                prepare_judgment_file, v1_model=model_name, v2_model=other_model, input_version_name=scores_version_name
+            ),
+            inputs=[translation_file_path(model_name, scores_version_name), translation_file_path(other_model, scores_version_name)],
+            outputs=[judgment_file]
         )
+        # The judgment stages share one queue, which bounds the calls to the judgment model
+        pipeline.add_stage(
+            f"judgments_{model_name}_vs_{other_model}", partial(
+                add_judgments, judgments_file_path=judgment_file, judgment_model=judgment_model,
+                version_name=judgment_version_name, judgment_queue=judgment_queue
+            ),
+            inputs=[judgment_file], outputs=[judged_file], params={'judgment_model': judgment_model}
+        )
+    return pipeline
+
+
+async def main():
+    # Only stages whose inputs or parameters changed since their last run are executed
+    judgment_queue = JudgmentQueue(judgment_model, max_concurrency=judgment_concurrency)
+    pipeline = build_pipeline(new_llm_services, judgment_queue)
+    try:
+        await pipeline.run()
+    finally:
+        await judgment_queue.close()
 
 
 if __name__ == "__main__":
-    asyncio.run(main())
\ No newline at end of file
+    asyncio.run(main())
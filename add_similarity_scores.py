@@ -1,31 +1,61 @@
-import pandas as pd
 import os
+import asyncio
 import logging
-import openai
 import numpy as np
-from typing import Optional
-from langchain.embeddings.openai import OpenAIEmbeddings
+from typing import List, Optional
+from embedding_client import AsyncEmbeddingClient
+from profiling import profiled
+from jsonl_io import read_jsonl, write_artifact, artifact_exists, artifact_path
+from sharded import run_sharded_async, default_shard_size
 
 logging.basicConfig(level=logging.INFO)
 
+EMBEDDING_BACKENDS = ['openai', 'local']
 
-def add_similarity_scores(
+
+def get_embedding_backend(
+    embedding_backend: str,
+    embedding_model: Optional[str] = None,
+    max_concurrency: int = 8
+):
+    """
+    Return an embedder exposing `async embed_documents(texts)` and the `name` of its model.
+    'openai' calls the embeddings API, 'local' runs a sentence-transformers model on the CPU.
+    Without embedding_model each backend uses its own default model.
+    """
+    if embedding_backend == 'openai':
+        return AsyncEmbeddingClient(
+            model=embedding_model or 'text-embedding-ada-002',
+            max_concurrency=max_concurrency
+        )
+    elif embedding_backend == 'local':
+        # Imported lazily so the OpenAI path does not need torch
+        from local_embeddings import LocalEmbeddingBackend, DEFAULT_LOCAL_EMBEDDING_MODEL
+        return LocalEmbeddingBackend(model=embedding_model or DEFAULT_LOCAL_EMBEDDING_MODEL)
+    raise ValueError(f"Unknown embedding backend '{embedding_backend}'. Expected one of {EMBEDDING_BACKENDS}.")
+
+
+@profiled
+async def add_similarity_scores(
     file_path: str,
     version_name: str,
-    embedding_model: str = 'text-embedding-ada-002',
+    embedding_model: Optional[str] = None,
     translation_column: Optional[str] = None,
-    lang: str = 'en'
+    lang: str = 'en',
+    max_concurrency: int = 8,
+    embedding_backend: str = 'openai',
+    shard_size: Optional[int] = default_shard_size
 ):
     # Verify that the file exists
-    if not os.path.exists(file_path):
+    if not artifact_exists(file_path):
         raise FileNotFoundError(f"The file {file_path} does not exist.")
 
     # Read JSONL file
     try:
-        with open(file_path, 'r', encoding='utf-8') as f:
-            if os.stat(file_path).st_size == 0:
-                raise ValueError("The input file is empty.")
-            df = pd.read_json(f, lines=True)
+        if os.stat(artifact_path(file_path)).st_size == 0:
+            raise ValueError("The input file is empty.")
+        # Sharded, only the first row is read here, for the columns
+        df = read_jsonl(file_path, nrows=1 if shard_size is not None else None)
     except ValueError as e:
         logging.error(f"Error reading JSON file: {e}")
         return
@@ -36,21 +66,13 @@ def add_similarity_scores(
     output_file = os.path.join(input_dir, output_filename)
 
     # Check if the output file already exists
-    if os.path.exists(output_file):
+    if artifact_exists(output_file):
         logging.info(f"File {output_file} already exists. Skipping.")
         return
 
     logging.info(f"Processing file: {file_path}")
     logging.info(f"Output file will be: {output_file}")
 
-    # Set your OpenAI API key
-    openai.api_key = os.getenv("OPENAI_API_KEY")
-    if not openai.api_key:
-        raise ValueError("OpenAI API key is not set in the environment variable 'OPENAI_API_KEY'.")
-
-    # Prepare data
-    refs = df['joined_english_sentences'].tolist()
-
     # Detect translation column if not provided
     if translation_column is None:
         translation_columns = [col for col in df.columns if col.endswith("_translation")]
@@ -62,41 +84,118 @@ def add_similarity_scores(
             translation_column = translation_columns[0]
             logging.info(f"Using translation column: {translation_column}")
 
-    cands = df[translation_column].tolist()
-
-    # Initialize embeddings
-    embed = OpenAIEmbeddings(
-        model=embedding_model,
-        openai_api_key=openai.api_key
-    )
-
-    # Compute embeddings
-    logging.info("Computing embeddings for references...")
-    refs_embeddings = embed.embed_documents(refs)
-    logging.info("Computing embeddings for translations...")
-    cands_embeddings = embed.embed_documents(cands)
-
-    # Compute similarity scores
-    similarity_scores = []
-    for i in range(len(refs_embeddings)):
-        v1 = np.array(refs_embeddings[i])
-        v2 = np.array(cands_embeddings[i])
-        similarity = np.dot(v1, v2) / (np.linalg.norm(v1) * np.linalg.norm(v2))
-        similarity_scores.append(similarity)
-
-    # Add similarity score to DataFrame
-    # Extract the translation model name from translation_column
-    # e.g., if translation_column is 'aya_8b_translation', translation_model_name is 'aya_8b'
-    translation_model_name = translation_column.replace('_translation', '')
-    similarity_column_name = f"{translation_model_name}_{embedding_model}_similarity"
-    df[similarity_column_name] = similarity_scores
- 
+    # Initialize embeddings; without embedding_model the backend uses its default model
+    embed = get_embedding_backend(embedding_backend, embedding_model, max_concurrency)
+    embedding_model = embed.name
+
+    async def score_rows(df):
+        # Prepare data
+        refs = df['joined_english_sentences'].tolist()
+        cands = df[translation_column].tolist()
+
+        # Compute embeddings for references and translations in one concurrent pass
+        logging.info("Computing embeddings for references and translations...")
+        embeddings = np.array(await embed.embed_documents(refs + cands))
+        refs_embeddings = embeddings[:len(refs)]
+        cands_embeddings = embeddings[len(refs):]
+
+        # Compute similarity scores
+        similarity_scores = (
+            np.sum(refs_embeddings * cands_embeddings, axis=1)
+            / (np.linalg.norm(refs_embeddings, axis=1) * np.linalg.norm(cands_embeddings, axis=1))
+        ).tolist()
+
+        # Add similarity score to DataFrame
+        # Extract the translation model name from translation_column
+        # e.g., if translation_column is 'aya_8b_translation', translation_model_name is 'aya_8b'
+        translation_model_name = translation_column.replace('_translation', '')
+        similarity_column_name = f"{translation_model_name}_{embedding_model}_similarity"
+        df[similarity_column_name] = similarity_scores
+        return df
+
+    if shard_size is not None:
+        written = await run_sharded_async(file_path, output_file, score_rows, shard_size)
+        if written is not None:
+            logging.info(f"Results saved to {output_file}")
+        return output_file
+    await score_rows(df)
+
     if not df.empty:
-        df.to_json(output_file, orient='records', lines=True, force_ascii=False)
+        write_artifact(output_file, df)
         logging.info(f"Results saved to {output_file}")
     else:
         logging.warning("No data to save.")
 
+    return output_file
+
+@profiled
+async def add_similarity_scores_batch(
+    file_paths: List[str],
+    version_name: str,
+    embedding_model: Optional[str] = None,
+    max_concurrency: int = 8,
+    embedding_backend: str = 'openai',
+    shard_size: Optional[int] = default_shard_size
+) -> List[str]:
+    """
+    add_similarity_scores for several models' translation files in one embedding pass.
+    Each distinct text is embedded once, so the references shared by all files are
+    embedded a single time. Sharded, the files are scored one at a time instead, so
+    that only a shard is in memory.
+    """
+    if shard_size is not None:
+        output_files = []
+        for file_path in file_paths:
+            await add_similarity_scores(
+                file_path, version_name, embedding_model,
+                max_concurrency=max_concurrency, embedding_backend=embedding_backend, shard_size=shard_size
+            )
+            input_dir, input_filename = os.path.split(file_path)
+            output_files.append(os.path.join(input_dir, f"{version_name}_{input_filename}"))
+        return output_files
+    pending = []
+    output_files = []
+    for file_path in file_paths:
+        if not artifact_exists(file_path):
+            raise FileNotFoundError(f"The file {file_path} does not exist.")
+        input_dir, input_filename = os.path.split(file_path)
+        output_file = os.path.join(input_dir, f"{version_name}_{input_filename}")
+        output_files.append(output_file)
+        if artifact_exists(output_file):
+            logging.info(f"File {output_file} already exists. Skipping.")
+            continue
+        df = read_jsonl(file_path)
+        if df.empty:
+            logging.warning(f"No data in {file_path}.")
+            continue
+        translation_columns = [col for col in df.columns if col.endswith("_translation")]
+        if len(translation_columns) != 1:
+            raise ValueError(f"Expected one translation column in {file_path}, found {translation_columns}.")
+        pending.append((df, translation_columns[0], output_file))
+
+    if not pending:
+        return output_files
+
+    texts = {}
+    for df, translation_column, _ in pending:
+        for text in df['joined_english_sentences'].tolist() + df[translation_column].tolist():
+            texts.setdefault(text, len(texts))
+
+    embed = get_embedding_backend(embedding_backend, embedding_model, max_concurrency)
+    embedding_model = embed.name
+    logging.info(f"Computing embeddings for {len(texts)} distinct texts from {len(pending)} files...")
+    embeddings = np.array(await embed.embed_documents(list(texts)))
+    embeddings /= np.linalg.norm(embeddings, axis=1, keepdims=True)
+
+    for df, translation_column, output_file in pending:
+        refs_embeddings = embeddings[[texts[text] for text in df['joined_english_sentences']]]
+        cands_embeddings = embeddings[[texts[text] for text in df[translation_column]]]
+        translation_model_name = translation_column.replace('_translation', '')
+        df[f"{translation_model_name}_{embedding_model}_similarity"] = np.sum(refs_embeddings * cands_embeddings, axis=1).tolist()
+        write_artifact(output_file, df)
+        logging.info(f"Results saved to {output_file}")
+    return output_files
+
 def main():
     file_path = "./Data/Output/translations/v2_big_c_conversations_test_sonnet_3_point_5.jsonl"
     version_name = "a"
@@ -104,7 +203,7 @@ def main():
     # Optionally specify translation column
     translation_column = None  # or set to the specific column name, e.g., 'aya_8b_translation'
 
-    add_similarity_scores(file_path, version_name, embedding_model, translation_column)
+    asyncio.run(add_similarity_scores(file_path, version_name, embedding_model, translation_column))
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,339 @@
+import os
+import logging
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, List, Optional
+import numpy as np
+from results_store import ResultsStore
+from battle_store import BattleStore, TIE, MODEL_1_WINS, MODEL_2_WINS
+from metric_battles import build_score_matrix, pairwise_outcomes, pair_battle_outcomes
+from jsonl_io import dumps, iter_jsonl, artifact_path, list_artifacts
+
+logging.basicConfig(level=logging.INFO)
+
+
+class JudgmentScorer:
+    """
+    Battles decided per record by a judge's verdict stored in pairwise files
+    named {file_prefix}{model_1}_vs_{model_2}.jsonl.
+    """
+
+    def __init__(self, battle_type: str, folder: str, file_prefix: str, winner_field: str):
+        self.battle_type = battle_type
+        self.folder = folder
+        self.file_prefix = file_prefix
+        self.winner_field = winner_field
+
+    def files(self):
+        if not os.path.isdir(self.folder):
+            return
+        for file_path, model_pair in list_artifacts(self.folder, self.file_prefix):
+            model_1, model_2 = model_pair.split("_vs_", 1)
+            yield file_path, model_1, model_2
+
+    def outcome(self, record: dict, model_1: str, model_2: str) -> int:
+        winner = record.get(self.winner_field)
+        if winner == model_1:
+            return MODEL_1_WINS
+        elif winner == model_2:
+            return MODEL_2_WINS
+        # tie or invalid winner
+        return TIE
+
+
+class MetricScorer:
+    """Battles decided by comparing the per-id scores of every pair of models."""
+
+    def __init__(self, battle_type: str, score_key: str, higher_is_better: bool = True):
+        self.battle_type = battle_type
+        self.score_key = score_key
+        self.higher_is_better = higher_is_better
+
+
+class ScoreSource:
+    """
+    Per-model files {file_prefix}{model}.jsonl holding per-id scores.
+    `fields` maps a score key to its column, with '{model}' filled in per model.
+    """
+
+    def __init__(self, folder: str, file_prefix: str, fields: Dict[str, str]):
+        self.folder = folder
+        self.file_prefix = file_prefix
+        self.fields = fields
+
+    def file_path(self, model_name: str) -> str:
+        return os.path.join(self.folder, f"{self.file_prefix}{model_name}.jsonl")
+
+    def extract(self, record: dict, model_name: str) -> dict:
+        return {
+            score_key: record.get(field.format(model=model_name))
+            for score_key, field in self.fields.items()
+        }
+
+
+# Per-file parsers. They are module level so they can run in worker processes, and
+# return compact partial aggregates rather than the parsed records.
+
+def process_translation_file(file_path: str, model_name: str, fields_to_keep: List[str], score_fields: Dict[str, str]) -> dict:
+    """Per-id scores of one translation file; 'data' holds the records kept for the prepared file."""
+    fields_to_keep = [field.format(model=model_name) for field in fields_to_keep]
+    data_dict = {}
+    scores = {}
+    for record in iter_jsonl(file_path):
+        scores[str(record['id'])] = {
+            score_key: record.get(field.format(model=model_name))
+            for score_key, field in score_fields.items()
+        }
+        if all(field in record for field in fields_to_keep):
+            data_dict[record['id']] = record
+    return {'model': model_name, 'scores': scores, 'data': data_dict}
+
+
+def process_score_file(file_path: str, model_name: str, source: ScoreSource) -> dict:
+    scores = {}
+    columns = ['id'] + [field.format(model=model_name) for field in source.fields.values()]
+    for record in iter_jsonl(file_path, columns):
+        scores[str(record['id'])] = source.extract(record, model_name)
+    return {'model': model_name, 'scores': scores}
+
+
+def process_judgment_file(file_path: str, model_1: str, model_2: str, scorer: JudgmentScorer) -> dict:
+    battles = [
+        [str(record['id']), scorer.outcome(record, model_1, model_2)]
+        for record in iter_jsonl(file_path, ['id', scorer.winner_field])
+    ]
+    return {'model_1': model_1, 'model_2': model_2, 'battles': battles}
+
+
+class BattleAggregator:
+    """
+    Compiles battles from translation, score and judgment files, reading each file once.
+
+    Translation files give the models, the records of the prepared per-model files and
+    their scores in the same pass. Every battle type is a registered scorer:
+    JudgmentScorer counts a verdict per record of a pairwise file, MetricScorer compares
+    scores of every model pair. Battles are collected as integer-encoded column chunks
+    and assembled into a BattleStore, from which battle_totals is derived.
+    """
+
+    def __init__(
+        self,
+        translations_folder: str,
+        translation_file_prefix: str,
+        fields_to_keep: List[str],
+        prepared_files_folder: str,
+        results_store_path: Optional[str] = None
+    ):
+        self.translations_folder = translations_folder
+        self.prepared_files_folder = prepared_files_folder
+        self.results_store_path = results_store_path
+        self.translation_file_prefix = translation_file_prefix
+        self.fields_to_keep = fields_to_keep
+        self.scorers = []
+        self.score_sources: List[ScoreSource] = []
+        self.translation_score_fields: Dict[str, str] = {}
+
+        self.models: List[str] = []
+        self.prepared_data: Dict[str, dict] = {}  # model_name -> {id -> record}
+        self.model_scores: Dict[str, Dict[str, dict]] = {}  # model_name -> {id_str -> {score_key: score}}
+        self._battle_chunks: List[tuple] = []  # (battle_type, ids, model_1, model_2, outcome) arrays
+        self.battles: BattleStore = None
+        self._executor: Optional[ProcessPoolExecutor] = None
+
+    @property
+    def battle_types(self) -> List[str]:
+        return [scorer.battle_type for scorer in self.scorers]
+
+    @property
+    def judgment_scorers(self) -> List[JudgmentScorer]:
+        return [scorer for scorer in self.scorers if isinstance(scorer, JudgmentScorer)]
+
+    @property
+    def metric_scorers(self) -> List[MetricScorer]:
+        return [scorer for scorer in self.scorers if isinstance(scorer, MetricScorer)]
+
+    def register_translation_scores(self, fields: Dict[str, str]):
+        """Scores read from the translation files themselves, e.g. {'bert_score': '{model}_bertscore'}."""
+        self.translation_score_fields.update(fields)
+
+    def register_score_source(self, source: ScoreSource):
+        self.score_sources.append(source)
+
+    def register_scorer(self, scorer):
+        if not isinstance(scorer, (JudgmentScorer, MetricScorer)):
+            raise TypeError(f"Unsupported scorer type: {type(scorer).__name__}")
+        if scorer.battle_type in self.battle_types:
+            raise ValueError(f"Battle type '{scorer.battle_type}' is already registered.")
+        self.scorers.append(scorer)
+
+    def _add_battles(self, battle_type: str, ids, model_1, model_2, outcomes):
+        """Queue a chunk of battles of one type; model arguments are indices into self.models."""
+        ids = np.asarray(ids, dtype=np.int64)
+        self._battle_chunks.append((
+            np.full(len(ids), self.battle_types.index(battle_type)),
+            ids,
+            np.broadcast_to(model_1, ids.shape),
+            np.broadcast_to(model_2, ids.shape),
+            np.asarray(outcomes)
+        ))
+
+    def build_battle_store(self) -> BattleStore:
+        if self._battle_chunks:
+            columns = [np.concatenate(column) for column in zip(*self._battle_chunks)]
+        else:
+            columns = [np.empty(0, dtype=np.int64)] * len(BattleStore.columns)
+        self.battles = BattleStore.from_battles(self.models, self.battle_types, *columns)
+        return self.battles
+
+    def _translation_files(self):
+        yield from list_artifacts(self.translations_folder, self.translation_file_prefix)
+
+    def _load_partials(self, manifest, tasks: List[tuple]) -> List[tuple]:
+        """
+        Partial aggregates for tasks of (file_path, config_key, process, args, force), in order.
+
+        Unchanged files are served from the manifest; the others are parsed, in the
+        process pool when run() was given more than one worker. Returns (partial, data)
+        pairs, where data is the 'data' a parser returned for a file read in this run
+        (not persisted in the manifest) or None.
+        """
+        results = [None] * len(tasks)
+        stale = []
+        for k, (file_path, config_key, process, args, force) in enumerate(tasks):
+            if manifest is not None and not force and manifest.is_fresh(file_path, config_key):
+                results[k] = (manifest.load_partial(file_path), None)
+            else:
+                logging.info(f"Reading {file_path}")
+                stale.append(k)
+        if self._executor is not None and len(stale) > 1:
+            futures = [(k, self._executor.submit(tasks[k][2], tasks[k][0], *tasks[k][3])) for k in stale]
+            parsed = [(k, future.result()) for k, future in futures]
+        else:
+            parsed = [(k, tasks[k][2](tasks[k][0], *tasks[k][3])) for k in stale]
+        for k, partial in parsed:
+            data = partial.pop('data', None)
+            if manifest is not None:
+                manifest.store_partial(tasks[k][0], tasks[k][1], partial)
+            results[k] = (partial, data)
+        return results
+
+    def read_translation_files(self, manifest=None):
+        config_key = f"translation|{self.fields_to_keep}|{sorted(self.translation_score_fields.items())}"
+        stored_models = set()
+        if self.results_store_path is not None and os.path.exists(self.results_store_path):
+            with ResultsStore(self.results_store_path) as store:
+                stored_models = set(store.models())
+        tasks = []
+        for file_path, model_name in self._translation_files():
+            # The prepared outputs are only written when their translation file is read
+            prepared_outputs_missing = not os.path.exists(self.prepared_file_path(model_name)) or (
+                self.results_store_path is not None and model_name not in stored_models
+            )
+            tasks.append((
+                file_path, config_key, process_translation_file,
+                (model_name, self.fields_to_keep, self.translation_score_fields), prepared_outputs_missing
+            ))
+        for partial, data in self._load_partials(manifest, tasks):
+            model_name = partial['model']
+            self.models.append(model_name)
+            self.model_scores[model_name] = partial['scores']
+            if data is not None:
+                self.prepared_data[model_name] = data
+
+    def read_score_sources(self, manifest=None):
+        tasks = []
+        for source in self.score_sources:
+            config_key = f"scores|{sorted(source.fields.items())}"
+            for model_name in self.models:
+                # The manifest keys and stats the file actually read
+                file_path = artifact_path(source.file_path(model_name))
+                if os.path.exists(file_path):
+                    tasks.append((file_path, config_key, process_score_file, (model_name, source), False))
+        for partial, _ in self._load_partials(manifest, tasks):
+            model_scores = self.model_scores[partial['model']]
+            for id_str, scores in partial['scores'].items():
+                if id_str in model_scores:
+                    model_scores[id_str].update(scores)
+
+    def read_judgment_files(self, manifest=None):
+        tasks = []
+        for scorer in self.judgment_scorers:
+            config_key = f"judgment|{scorer.battle_type}|{scorer.winner_field}"
+            for file_path, model_1, model_2 in scorer.files():
+                for model in [model_1, model_2]:
+                    if model not in self.models:
+                        logging.warning(f"{os.path.basename(file_path)}: model '{model}' has no translation file.")
+                        self.models.append(model)
+                tasks.append((file_path, config_key, process_judgment_file, (model_1, model_2, scorer), False))
+        for (partial, _), task in zip(self._load_partials(manifest, tasks), tasks):
+            scorer = task[3][2]
+            ids = [int(id_str) for id_str, _ in partial['battles']]
+            outcomes = [outcome for _, outcome in partial['battles']]
+            self._add_battles(
+                scorer.battle_type, ids,
+                self.models.index(partial['model_1']), self.models.index(partial['model_2']), outcomes
+            )
+
+    def build_metric_battles(self):
+        all_ids = sorted({id_str for scores in self.model_scores.values() for id_str in scores}, key=int)
+        id_values = np.array([int(id_str) for id_str in all_ids], dtype=np.int64)
+        for scorer in self.metric_scorers:
+            scores = build_score_matrix(self.model_scores, self.models, all_ids, scorer.score_key)
+            wins, ties = pairwise_outcomes(scores, higher_is_better=scorer.higher_is_better)
+            id_indices, model_1, model_2, outcomes = pair_battle_outcomes(wins, ties)
+            self._add_battles(scorer.battle_type, id_values[id_indices], model_1, model_2, outcomes)
+
+    def run(self, manifest=None, max_workers: int = 1):
+        """
+        Compile everything. With a CompileManifest, files that did not change since the
+        last run are not read again; their stored partial aggregates are merged instead.
+        With max_workers > 1 the files that must be read are parsed in a process pool.
+        Metric battles are always rebuilt from the merged scores, which is cheap.
+        """
+        if max_workers > 1:
+            self._executor = ProcessPoolExecutor(max_workers=max_workers)
+        try:
+            self.read_translation_files(manifest)
+            self.read_score_sources(manifest)
+            self.read_judgment_files(manifest)
+        finally:
+            if self._executor is not None:
+                self._executor.shutdown()
+                self._executor = None
+        self.build_metric_battles()
+        self.build_battle_store()
+        if manifest is not None:
+            manifest.save()
+        return self
+
+    def prepared_file_path(self, model_name: str) -> str:
+        return os.path.join(self.prepared_files_folder, f"{model_name}.json")
+
+    def write_prepared_files(self):
+        """Write {model}.json for every model whose translation file was read in this run."""
+        os.makedirs(self.prepared_files_folder, exist_ok=True)
+        for model_name, data_dict in self.prepared_data.items():
+            model_package = {
+                "model_name": model_name,
+                "data": data_dict
+            }
+            with open(self.prepared_file_path(model_name), 'wb') as f:
+                f.write(dumps(model_package, indent=False))
+
+    def write_results_store(self):
+        """
+        Update the indexed results store: records of the models whose translation file
+        was read in this run, and the merged scores of every model. Models without a
+        translation file any more are removed from it.
+        """
+        with ResultsStore(self.results_store_path) as store:
+            for model_name, data_dict in self.prepared_data.items():
+                store.write_model(model_name, data_dict)
+            store.write_scores(self.model_scores)
+            store.retain_models(self.model_scores)
+
+    def write_battle_store(self, file_path: str):
+        self.battles.save(file_path)
+
+    def write_battle_totals(self, file_path: str):
+        with open(file_path, 'wb') as f:
+            f.write(dumps(self.battles.battle_totals(), indent=True))
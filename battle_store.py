@@ -0,0 +1,154 @@
+from typing import List, Tuple
+import numpy as np
+
+# Outcome codes, relative to (model_1, model_2)
+TIE, MODEL_1_WINS, MODEL_2_WINS = 0, 1, 2
+
+
+def _index_dtype(n: int):
+    """Smallest signed integer type that can index n entries."""
+    for dtype in (np.int8, np.int16, np.int32):
+        if n <= np.iinfo(dtype).max:
+            return dtype
+    return np.int64
+
+
+def battle_pairs(
+    model_1: np.ndarray,
+    model_2: np.ndarray,
+    outcome: np.ndarray,
+    n_models: int
+) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Model pair and result of each battle, for counting battles per conversation and pair
+    without (n_ids, n_models, n_models) arrays.
+
+    Returns (pairs, pair_index, result): pairs holds the (i, j) model pairs, i < j, that
+    played; battle k is between pairs[pair_index[k]], and result[k] is 0 if i won, 1 if j
+    won and 2 for a tie.
+    """
+    low = np.minimum(model_1, model_2)
+    cells = low.astype(_index_dtype(n_models * n_models)) * n_models + np.maximum(model_1, model_2)
+    played = np.zeros(n_models * n_models, dtype=bool)
+    played[cells] = True
+    pair_cells = np.flatnonzero(played)
+    # Pair index of every cell of the (n_models, n_models) grid, looked up per battle
+    lookup = np.zeros(n_models * n_models, dtype=_index_dtype(len(pair_cells)))
+    lookup[pair_cells] = np.arange(len(pair_cells))
+    pairs = np.stack([pair_cells // n_models, pair_cells % n_models], axis=1)
+    # model_1 is the lower indexed model of its pair unless it is the higher one
+    result = np.where(outcome == TIE, 2, (outcome == MODEL_2_WINS) == (model_1 == low)).astype(np.int8)
+    return pairs, lookup[cells], result
+
+
+class BattleStore:
+    """
+    Columnar, integer-encoded battles.
+
+    Models, battle types and ids are stored once as dictionaries; every battle is one
+    row of the parallel arrays (battle_type, id, model_1, model_2, outcome), each holding
+    an index into its dictionary (or an outcome code). Saved as an uncompressed .npz
+    so it loads without pickling and without walking nested JSON.
+    """
+
+    columns = ['battle_type', 'id', 'model_1', 'model_2', 'outcome']
+
+    def __init__(
+        self,
+        models: List[str],
+        battle_types: List[str],
+        ids: np.ndarray,
+        battle_type: np.ndarray,
+        id: np.ndarray,
+        model_1: np.ndarray,
+        model_2: np.ndarray,
+        outcome: np.ndarray
+    ):
+        self.models = list(models)
+        self.battle_types = list(battle_types)
+        self.ids = np.asarray(ids)
+        self.battle_type = np.asarray(battle_type, dtype=_index_dtype(len(self.battle_types)))
+        self.id = np.asarray(id, dtype=_index_dtype(len(self.ids)))
+        self.model_1 = np.asarray(model_1, dtype=_index_dtype(len(self.models)))
+        self.model_2 = np.asarray(model_2, dtype=_index_dtype(len(self.models)))
+        self.outcome = np.asarray(outcome, dtype=np.int8)
+
+    @classmethod
+    def from_battles(
+        cls,
+        models: List[str],
+        battle_types: List[str],
+        battle_type: np.ndarray,
+        ids: np.ndarray,
+        model_1: np.ndarray,
+        model_2: np.ndarray,
+        outcome: np.ndarray
+    ) -> "BattleStore":
+        """Build a store from raw id values, dictionary-encoding them in sorted order."""
+        id_values, id_indices = np.unique(np.asarray(ids, dtype=np.int64), return_inverse=True)
+        return cls(models, battle_types, id_values, battle_type, id_indices, model_1, model_2, outcome)
+
+    @classmethod
+    def load(cls, file_path: str) -> "BattleStore":
+        with np.load(file_path) as data:
+            return cls(
+                data['models'].tolist(),
+                data['battle_types'].tolist(),
+                data['ids'],
+                *(data[column] for column in cls.columns)
+            )
+
+    def save(self, file_path: str):
+        with open(file_path, 'wb') as f:
+            np.savez(
+                f,
+                models=np.array(self.models, dtype=str),
+                battle_types=np.array(self.battle_types, dtype=str),
+                ids=self.ids,
+                **{column: getattr(self, column) for column in self.columns}
+            )
+
+    def __len__(self) -> int:
+        return len(self.outcome)
+
+    def select(self, battle_type: str) -> Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+        """(id, model_1, model_2, outcome) arrays of one battle type."""
+        mask = self.battle_type == self.battle_types.index(battle_type)
+        return self.id[mask], self.model_1[mask], self.model_2[mask], self.outcome[mask]
+
+    def head_to_head(self, battle_type: str) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Win and tie count matrices of shape (n_models, n_models) for one battle type.
+        wins[i, j] is the number of times model i beat model j; losses are wins.T.
+        """
+        _, model_1, model_2, outcome = self.select(battle_type)
+        n_models = len(self.models)
+        winner = np.where(outcome == MODEL_2_WINS, model_2, model_1).astype(np.int64)
+        loser = np.where(outcome == MODEL_2_WINS, model_1, model_2).astype(np.int64)
+        decided = outcome != TIE
+        wins = np.bincount(
+            winner[decided] * n_models + loser[decided], minlength=n_models * n_models
+        ).reshape(n_models, n_models)
+        ties = np.bincount(
+            model_1[~decided].astype(np.int64) * n_models + model_2[~decided], minlength=n_models * n_models
+        ).reshape(n_models, n_models)
+        return wins, ties + ties.T
+
+    def battle_totals(self) -> dict:
+        """{battle_type: {model: totals}} as stored in battle_totals.json."""
+        totals = {}
+        for battle_type in self.battle_types:
+            wins, ties = self.head_to_head(battle_type)
+            losses = wins.T
+            played = (wins + losses + ties) > 0
+            totals[battle_type] = {
+                model: {
+                    'total_wins': int(wins[i].sum()),
+                    'total_losses': int(losses[i].sum()),
+                    'total_ties': int(ties[i].sum()),
+                    'wins_against': {self.models[j]: int(wins[i, j]) for j in np.flatnonzero(played[i])},
+                    'losses_against': {self.models[j]: int(losses[i, j]) for j in np.flatnonzero(played[i])},
+                    'ties_against': {self.models[j]: int(ties[i, j]) for j in np.flatnonzero(played[i])}
+                } for i, model in enumerate(self.models)
+            }
+        return totals
@@ -0,0 +1,34 @@
+import os
+import time
+import logging
+from compile_prepared_files import build_aggregator
+
+logging.basicConfig(level=logging.WARNING)
+logging.getLogger().setLevel(logging.WARNING)
+
+worker_counts = [1, 2, 4, 8]
+repeats = 3
+
+
+def benchmark_cold_compile(max_workers: int) -> float:
+    """Best of `repeats` full compilations without a manifest, so every file is parsed."""
+    timings = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        build_aggregator().run(manifest=None, max_workers=max_workers)
+        timings.append(time.perf_counter() - start)
+    return min(timings)
+
+
+def main():
+    print(f"Cold compilation of ./Data/Output on {os.cpu_count()} cores, best of {repeats}\n")
+    print(f"{'workers':>8}{'seconds':>12}{'speedup':>12}")
+    baseline = None
+    for max_workers in worker_counts:
+        elapsed = benchmark_cold_compile(max_workers)
+        baseline = baseline or elapsed
+        print(f"{max_workers:>8}{elapsed:>12.3f}{baseline / elapsed:>11.2f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,51 @@
+import time
+import logging
+import pandas as pd
+from local_embeddings import LocalEmbeddingBackend, DEFAULT_LOCAL_EMBEDDING_MODEL
+
+logging.basicConfig(level=logging.INFO)
+
+translations_file_path = "./Data/Output/translations/a_v2_big_c_conversations_test_gpt_4o.jsonl"
+
+# (label, backend options)
+configurations = [
+    ("torch fp32", {}),
+    ("torch int8", {"quantize_int8": True}),
+    ("onnxruntime", {"use_onnx": True}),
+]
+batch_sizes = [16, 64, 128]
+
+
+def load_texts(file_path: str):
+    df = pd.read_json(file_path, lines=True)
+    # References and translations, the same strings add_similarity_scores embeds
+    translation_column = [col for col in df.columns if col.endswith("_translation")][0]
+    return df['joined_english_sentences'].tolist() + df[translation_column].tolist()
+
+
+def benchmark_backend(texts, batch_size: int, **options):
+    backend = LocalEmbeddingBackend(model=DEFAULT_LOCAL_EMBEDDING_MODEL, batch_size=batch_size, **options)
+    # Warm up so model loading and first-call allocation are not timed
+    backend.embed_documents_sync(texts[:batch_size])
+    start = time.perf_counter()
+    backend.embed_documents_sync(texts)
+    elapsed = time.perf_counter() - start
+    return elapsed, len(texts) / elapsed
+
+
+def main():
+    texts = load_texts(translations_file_path)
+    print(f"Embedding {len(texts)} texts with {DEFAULT_LOCAL_EMBEDDING_MODEL}\n")
+    print(f"{'backend':<14}{'batch size':>12}{'seconds':>12}{'texts/sec':>12}")
+    for label, options in configurations:
+        for batch_size in batch_sizes:
+            try:
+                elapsed, throughput = benchmark_backend(texts, batch_size, **options)
+            except ImportError as e:
+                print(f"{label:<14}{batch_size:>12}  skipped: {e}")
+                break
+            print(f"{label:<14}{batch_size:>12}{elapsed:>12.2f}{throughput:>12.1f}")
+
+
+if __name__ == "__main__":
+    main()
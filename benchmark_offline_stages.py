@@ -0,0 +1,196 @@
+import os
+import sys
+import json
+import time
+import logging
+import tempfile
+import subprocess
+from generate_synthetic_data import generate_scale, scale_ladder, selected_scales, synthetic_root
+
+logging.basicConfig(level=logging.INFO)
+
+repo_root = os.path.dirname(os.path.abspath(__file__))
+# Baselines of a reference machine; a stage regresses when it is this much slower or
+# larger than its baseline, and at least the absolute margin
+baselines_file_path = "./Data/Benchmarks/baselines.json"
+results_file_path = "./Data/Benchmarks/latest.json"
+tolerance = 0.25
+min_seconds_margin = 0.5
+min_memory_margin_mb = 50
+# Each stage runs this many times and keeps its fastest run, to even out timing noise
+repeats = 3
+# Record this run as the new baselines instead of comparing against them
+update_baselines = False
+# Scales of generate_synthetic_data.scale_ladder to run, unless SCALES names others
+# (e.g. SCALES=small,medium,xl); generated if missing
+benchmark_scales = ["small", "medium"]
+# The memory of a stage's process tree, with its worker processes, is sampled this often
+memory_sample_interval = 0.05
+
+# Each stage runs in its own process inside the scale's folder, so its peak RSS is its own.
+# The first model pair of the scale stands in for the prepare_* scripts.
+stages = {
+    "compile_prepared_files": "import compile_prepared_files as m; m.main(full_rebuild=True)",
+    "create_elo_ratings": "import create_elo_ratings as m; m.main()",
+    # Their output is removed before and after, so the stage always writes it and it
+    # does not feed into the next compile
+    "prepare_judgment_file": (
+        "import os, prepare_judgment_file as m; from jsonl_io import artifact_path, remove_artifact; "
+        "path = f'./Data/Output/judgments/bench_big_c_test_{MODEL_1}_vs_{MODEL_2}.jsonl'; "
+        "remove_artifact(path); "
+        "m.prepare_judgment_file(MODEL_1, MODEL_2, input_version_name='a_v2', output_version_name='bench'); "
+        "os.remove(artifact_path(path))"
+    ),
+    "prepare_consistency_judgment_file": (
+        "import os, asyncio, prepare_consistency_judgment_file as m; from jsonl_io import artifact_path, remove_artifact; "
+        "path = f'./Data/Output/consistency_judgments/bench_big_c_test_{MODEL_1}_vs_{MODEL_2}.jsonl'; "
+        "remove_artifact(path); "
+        "asyncio.run(m.prepare_consistency_judgment_file(MODEL_1, MODEL_2, version_name='bench')); "
+        "os.remove(artifact_path(path))"
+    ),
+    "select_evaluation_subset": "import select_evaluation_subset as m; m.main()",
+    "display_battle_totals": (
+        "import display_battle_totals as m; from battle_store import BattleStore; "
+        "m.prepare_heatmap_data(BattleStore.load(m.battles_file_path))"
+    ),
+    "display_elo_rankings": "import display_elo_rankings as m; m.prepare_data(m.load_elo_rankings())",
+}
+
+
+# Appended to every stage: the child's own peak RSS. VmHWM starts over at exec, unlike
+# ru_maxrss, which keeps the benchmark's own RSS from before the fork.
+_report_peak_rss = """
+import sys, resource
+try:
+    with open('/proc/self/status') as f:
+        peak_kb = next(int(line.split()[1]) for line in f if line.startswith('VmHWM'))
+except (OSError, StopIteration):
+    peak_kb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss // (1024 if sys.platform == 'darwin' else 1)
+sys.stderr.write(f"\\nPEAK_RSS_KB {peak_kb}\\n")
+"""
+
+
+def _process_tree_kb(pid: int) -> int:
+    """
+    Proportional set size of a process and all its descendants, such as the workers of a
+    process pool, from /proc. Pages the workers share with their parent after fork count
+    once. 0 where /proc is not available.
+    """
+    children = {}
+    for entry in os.listdir('/proc') if os.path.isdir('/proc') else []:
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f'/proc/{entry}/stat') as f:
+                parent = int(f.read().rsplit(')', 1)[1].split()[1])
+        except (OSError, IndexError, ValueError):
+            continue
+        children.setdefault(parent, []).append(int(entry))
+    total_kb, pending = 0, [pid]
+    while pending:
+        current = pending.pop()
+        pending.extend(children.get(current, []))
+        try:
+            with open(f'/proc/{current}/smaps_rollup') as f:
+                total_kb += next(int(line.split()[1]) for line in f if line.startswith('Pss:'))
+        except (OSError, StopIteration):
+            continue
+    return total_kb
+
+
+def run_stage(scale_root: str, code: str, model_1: str, model_2: str) -> dict:
+    """
+    Run one stage in a child process; returns its wall time, its own peak RSS and the
+    sampled peak memory of its process tree with the workers, or the error it failed with.
+    """
+    code = f"MODEL_1, MODEL_2 = {model_1!r}, {model_2!r}\n{code}\n{_report_peak_rss}"
+    environment = {**os.environ, 'PYTHONPATH': repo_root + os.pathsep + os.environ.get('PYTHONPATH', '')}
+    peak_tree_kb = 0
+    with tempfile.TemporaryFile() as stderr_file:
+        start = time.perf_counter()
+        process = subprocess.Popen(
+            [sys.executable, "-c", code], cwd=scale_root, env=environment,
+            stdout=subprocess.DEVNULL, stderr=stderr_file
+        )
+        while process.poll() is None:
+            peak_tree_kb = max(peak_tree_kb, _process_tree_kb(process.pid))
+            time.sleep(memory_sample_interval)
+        elapsed = time.perf_counter() - start
+        stderr_file.seek(0)
+        stderr = stderr_file.read().decode('utf-8', errors='replace').strip().splitlines()
+    if process.returncode != 0:
+        return {'error': stderr[-1] if stderr else f"exit code {process.returncode}"}
+    peak_rss_mb = int(stderr[-1].split()[1]) / 2**10 if stderr and stderr[-1].startswith('PEAK_RSS_KB') else None
+    # Sampling can miss the stage's own short peak, which VmHWM does not
+    peak_tree_mb = max(peak_tree_kb / 2**10, peak_rss_mb or 0.0) if peak_tree_kb else None
+    return {'seconds': elapsed, 'peak_rss_mb': peak_rss_mb, 'peak_tree_mb': peak_tree_mb}
+
+
+def regressions(results: dict, baselines: dict) -> list:
+    found = []
+    for key, result in results.items():
+        baseline = baselines.get(key)
+        if baseline is None or 'error' in result or 'error' in baseline:
+            continue
+        if result['seconds'] > baseline['seconds'] * (1 + tolerance) and result['seconds'] - baseline['seconds'] > min_seconds_margin:
+            found.append(f"{key}: {result['seconds']:.2f}s vs baseline {baseline['seconds']:.2f}s")
+        for memory in ('peak_rss_mb', 'peak_tree_mb'):
+            if (result.get(memory) and baseline.get(memory)
+                    and result[memory] > baseline[memory] * (1 + tolerance)
+                    and result[memory] - baseline[memory] > min_memory_margin_mb):
+                found.append(f"{key}: {memory} {result[memory]:.0f} MB vs baseline {baseline[memory]:.0f} MB")
+    return found
+
+
+def main() -> int:
+    baselines = {}
+    if os.path.exists(baselines_file_path):
+        with open(baselines_file_path, 'r') as f:
+            baselines = json.load(f)
+
+    results = {}
+    scales = selected_scales(benchmark_scales)
+    print(f"{'scale':<10}{'stage':<36}{'seconds':>10}{'baseline':>10}{'peak MB':>10}{'baseline':>10}{'tree MB':>10}{'baseline':>10}")
+    for name, n_models, n_conversations, opponents_per_model in scale_ladder:
+        if name not in scales:
+            continue
+        scale_root = os.path.join(synthetic_root, name)
+        if not os.path.isdir(scale_root):
+            generate_scale(name, n_models, n_conversations, opponents_per_model)
+        prefix = "v2_big_c_test_"
+        judgment_files = sorted(f for f in os.listdir(os.path.join(scale_root, "Data", "Output", "judgments")) if f.startswith(prefix))
+        model_1, model_2 = judgment_files[0][len(prefix):-len(".jsonl")].split("_vs_")
+
+        # Stages run in order, since the later ones read what compile_prepared_files wrote
+        for stage, code in stages.items():
+            key = f"{name}/{stage}"
+            runs = [run_stage(os.path.abspath(scale_root), code, model_1, model_2) for _ in range(repeats)]
+            failed = [run for run in runs if 'error' in run]
+            results[key] = failed[0] if failed else min(runs, key=lambda run: run['seconds'])
+            result, baseline = results[key], baselines.get(key, {})
+            if 'error' in result:
+                # Stages whose optional display dependencies are missing are skipped, not failed
+                status = 'skipped' if result['error'].startswith('ModuleNotFoundError') else 'failed'
+                print(f"{name:<10}{stage:<36}  {status}: {result['error']}")
+                continue
+            print(f"{name:<10}{stage:<36}{result['seconds']:>10.2f}{baseline.get('seconds', float('nan')):>10.2f}"
+                  f"{result['peak_rss_mb'] or float('nan'):>10.0f}{baseline.get('peak_rss_mb') or float('nan'):>10.0f}"
+                  f"{result['peak_tree_mb'] or float('nan'):>10.0f}{baseline.get('peak_tree_mb') or float('nan'):>10.0f}")
+
+    os.makedirs(os.path.dirname(results_file_path), exist_ok=True)
+    with open(results_file_path, 'w') as f:
+        json.dump(results, f, indent=2)
+    if update_baselines:
+        with open(baselines_file_path, 'w') as f:
+            json.dump(results, f, indent=2)
+        logging.info(f"Baselines saved to {baselines_file_path}")
+        return 0
+
+    found = regressions(results, baselines)
+    for regression in found:
+        logging.error(f"Regression: {regression}")
+    return 1 if found else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
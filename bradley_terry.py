@@ -0,0 +1,160 @@
+from typing import Optional, Tuple
+import numpy as np
+
+# Ratings are reported on the Elo scale: a 400 point gap means 10:1 odds of winning
+ELO_SCALE = 400
+INITIAL_ELO = 1000
+# Largest temporary array of the bootstrap, in float64 values (64 MB)
+BOOTSTRAP_BLOCK_VALUES = 1 << 23
+
+
+def fit_bradley_terry(
+    wins: np.ndarray,
+    ties: np.ndarray,
+    prior_games: float = 1.0,
+    tol: float = 1e-9,
+    max_iter: int = 10000,
+    initial_log10_strength: Optional[np.ndarray] = None
+) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Maximum-likelihood Bradley-Terry strengths with ties (Davidson's model), by MM iteration.
+
+    wins[..., i, j] is the number of times model i beat model j and ties[..., i, j] the
+    number of ties between them (symmetric). Any leading axes are solved as a batch.
+    Under the model, with strengths g and tie parameter nu,
+        P(i beats j) = g_i / (g_i + g_j + nu * sqrt(g_i * g_j))
+        P(tie)       = nu * sqrt(g_i * g_j) / (g_i + g_j + nu * sqrt(g_i * g_j))
+    prior_games virtual games, split evenly, are added between every pair so models
+    without a win or a connected opponent still get a finite strength.
+    initial_log10_strength warm-starts the iteration, e.g. from the previous fit when
+    only a few battles were added.
+
+    Returns (log10 strengths with zero mean over models, nu).
+    """
+    wins = np.asarray(wins, dtype=float)
+    ties = np.asarray(ties, dtype=float)
+    n_models = wins.shape[-1]
+    off_diagonal = ~np.eye(n_models, dtype=bool)
+    wins = wins + (prior_games / 2) * off_diagonal
+    games = wins + np.swapaxes(wins, -1, -2) + ties
+    # Each model's wins plus half its ties, and the number of tied battles
+    score = wins.sum(axis=-1) + ties.sum(axis=-1) / 2
+    total_ties = ties.sum(axis=(-1, -2)) / 2
+
+    if initial_log10_strength is None:
+        log_strength = np.zeros(wins.shape[:-1])
+    else:
+        log_strength = np.broadcast_to(np.asarray(initial_log10_strength, dtype=float) * np.log(10), wins.shape[:-1])
+        log_strength = log_strength - log_strength.mean(axis=-1, keepdims=True)
+    nu = np.where(total_ties > 0, 1.0, 0.0)
+    for _ in range(max_iter):
+        strength = np.exp(log_strength)
+        g_i = strength[..., :, None]
+        g_j = strength[..., None, :]
+        geometric = np.sqrt(g_i * g_j)
+        denominator = g_i + g_j + nu[..., None, None] * geometric
+        expected = games * (1 + nu[..., None, None] / 2 * np.sqrt(g_j / g_i)) / denominator
+        new_log_strength = np.log(score) - np.log(expected.sum(axis=-1))
+        new_log_strength -= new_log_strength.mean(axis=-1, keepdims=True)
+        tie_propensity = (games * geometric / denominator).sum(axis=(-1, -2)) / 2
+        nu = np.where(total_ties > 0, total_ties / np.maximum(tie_propensity, 1e-300), 0.0)
+        converged = np.max(np.abs(new_log_strength - log_strength)) < tol
+        log_strength = new_log_strength
+        if converged:
+            break
+    return log_strength / np.log(10), nu
+
+
+def sum_pair_counts(
+    pair_index: np.ndarray,
+    result: np.ndarray,
+    n_pairs: int,
+    weights: Optional[np.ndarray] = None
+) -> np.ndarray:
+    """
+    Counts of shape (n_pairs, 3) of battles given by battle_pairs in battle_store.py: the
+    wins of each pair's first model, the wins of its second model and the ties. Each
+    battle counts weights[k] times if weights is given.
+    """
+    cells = pair_index.astype(np.int64) * 3 + result
+    return np.bincount(cells, weights=weights, minlength=n_pairs * 3).reshape(n_pairs, 3)
+
+
+def pair_counts_to_matrices(pairs: np.ndarray, pair_counts: np.ndarray, n_models: int) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Win and tie matrices of shape (..., n_models, n_models) from per-pair counts of shape
+    (..., n_pairs, 3): the wins of pairs[:, 0], the wins of pairs[:, 1] and the ties.
+    """
+    shape = pair_counts.shape[:-2] + (n_models, n_models)
+    wins = np.zeros(shape)
+    ties = np.zeros(shape)
+    i, j = pairs[:, 0], pairs[:, 1]
+    wins[..., i, j] = pair_counts[..., 0]
+    wins[..., j, i] = pair_counts[..., 1]
+    ties[..., i, j] = pair_counts[..., 2]
+    ties[..., j, i] = pair_counts[..., 2]
+    return wins, ties
+
+
+def bootstrap_bradley_terry(
+    pairs: np.ndarray,
+    id: np.ndarray,
+    pair_index: np.ndarray,
+    result: np.ndarray,
+    n_models: int,
+    rounds: int = 1000,
+    seed: int = 0,
+    prior_games: float = 1.0
+) -> np.ndarray:
+    """
+    Bootstrap the Bradley-Terry fit by resampling conversations with replacement.
+
+    The battles are given one by one: the conversation index id[k] of battle k, with its
+    pair and result from battle_pairs in battle_store.py. Conversations without a battle
+    are left out. Each round draws how many times every conversation is picked; the
+    resampled pair counts are matrix products of the picks with counts per conversation
+    and played pair, built for one block of conversations at a time so no temporary array
+    exceeds BOOTSTRAP_BLOCK_VALUES values. All rounds are solved as one batch.
+
+    Returns log10 strengths of shape (rounds, n_models).
+    """
+    has_battles = np.bincount(id) > 0
+    n_ids, n_cells = int(has_battles.sum()), len(pairs) * 3
+    conversation = (np.cumsum(has_battles) - 1).astype(np.int32)[id]
+    # Battles sorted by conversation, so a block of conversations is a slice of them
+    order = np.argsort(conversation, kind='stable')
+    conversation = conversation[order]
+    cells = pair_index[order].astype(np.int32) * 3 + result[order]
+    del order
+    id_block = max(1, BOOTSTRAP_BLOCK_VALUES // max(n_cells, 1))
+    round_block = max(1, BOOTSTRAP_BLOCK_VALUES // max(n_ids, 1))
+
+    rng = np.random.default_rng(seed)
+    pair_counts = np.zeros((rounds, n_cells))
+    for first_round in range(0, rounds, round_block):
+        picks = rng.multinomial(
+            n_ids, np.full(n_ids, 1 / n_ids), size=min(round_block, rounds - first_round)
+        ).astype(float)
+        for first_id in range(0, n_ids, id_block):
+            n_block = min(id_block, n_ids - first_id)
+            start, stop = np.searchsorted(conversation, [first_id, first_id + n_block])
+            block = np.bincount(
+                (conversation[start:stop] - first_id) * n_cells + cells[start:stop], minlength=n_block * n_cells
+            ).reshape(n_block, n_cells)
+            pair_counts[first_round:first_round + len(picks)] += picks[:, first_id:first_id + n_block] @ block
+    wins, ties = pair_counts_to_matrices(pairs, pair_counts.reshape(rounds, len(pairs), 3), n_models)
+    log10_strength, _ = fit_bradley_terry(wins, ties, prior_games=prior_games)
+    return log10_strength
+
+
+def rank_models(ratings: np.ndarray) -> np.ndarray:
+    """1-based rank of each model (1 is best) along the last axis."""
+    order = np.argsort(-ratings, axis=-1)
+    ranks = np.empty_like(order)
+    np.put_along_axis(ranks, order, np.arange(1, ratings.shape[-1] + 1), axis=-1)
+    return ranks
+
+
+def to_elo_scale(log10_strength: np.ndarray) -> np.ndarray:
+    """Bradley-Terry log10 strengths as Elo ratings centred on INITIAL_ELO."""
+    return INITIAL_ELO + ELO_SCALE * log10_strength
@@ -0,0 +1,51 @@
+import os
+import json
+import time
+import numpy as np
+from contextlib import contextmanager
+from typing import Dict
+
+# Append-only log of provider calls, one JSON object per line:
+# {"provider", "seconds", "ok", "time"}
+call_stats_file_path = "./Data/Output/call_stats.jsonl"
+
+
+def record_call(provider: str, seconds: float, ok: bool = True, file_path: str = call_stats_file_path):
+    """Append the latency of one call to a translation, judgment or embedding provider."""
+    line = json.dumps({'provider': provider, 'seconds': round(seconds, 4), 'ok': ok, 'time': time.time()}) + "\n"
+    os.makedirs(os.path.dirname(file_path) or '.', exist_ok=True)
+    with open(file_path, 'a') as f:
+        f.write(line)
+
+
+@contextmanager
+def timed_call(provider: str, file_path: str = call_stats_file_path):
+    """Record the latency of the call in the with block, and whether it raised."""
+    start = time.perf_counter()
+    try:
+        yield
+    except BaseException:
+        record_call(provider, time.perf_counter() - start, False, file_path)
+        raise
+    record_call(provider, time.perf_counter() - start, True, file_path)
+
+
+def observed_latency(file_path: str = call_stats_file_path) -> Dict[str, dict]:
+    """Per provider: number of successful calls and their median and 90th percentile latency in seconds."""
+    latencies = {}
+    if os.path.exists(file_path):
+        with open(file_path, 'r') as f:
+            for line in f:
+                if not line.strip():
+                    continue
+                call = json.loads(line)
+                if call['ok']:
+                    latencies.setdefault(call['provider'], []).append(call['seconds'])
+    return {
+        provider: {
+            'calls': len(seconds),
+            'median_seconds': float(np.median(seconds)),
+            'p90_seconds': float(np.percentile(seconds, 90))
+        }
+        for provider, seconds in latencies.items()
+    }
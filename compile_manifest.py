@@ -0,0 +1,100 @@
+import os
+import hashlib
+import logging
+
+try:
+    import orjson
+
+    def _loads(data: bytes):
+        return orjson.loads(data)
+
+    def _dumps(obj) -> bytes:
+        return orjson.dumps(obj, option=orjson.OPT_NON_STR_KEYS)
+except ImportError:
+    import json
+
+    def _loads(data: bytes):
+        return json.loads(data)
+
+    def _dumps(obj) -> bytes:
+        return json.dumps(obj).encode('utf-8')
+
+logging.basicConfig(level=logging.INFO)
+
+
+def file_sha256(file_path: str, chunk_size: int = 1 << 20) -> str:
+    digest = hashlib.sha256()
+    with open(file_path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class CompileManifest:
+    """
+    Manifest of the input files of a compilation, with one persisted partial
+    aggregate per file.
+
+    Each entry records the file's size, mtime and content hash, plus a config key
+    describing how it was processed. A file is fresh when its size and mtime are
+    unchanged, or when only its mtime changed but its content hash did not; only
+    stale files need to be read again.
+    """
+
+    def __init__(self, manifest_path: str, partials_folder: str):
+        self.manifest_path = manifest_path
+        self.partials_folder = partials_folder
+        self.entries = {}
+        if os.path.exists(manifest_path):
+            with open(manifest_path, 'rb') as f:
+                self.entries = _loads(f.read())
+        self._seen = set()
+
+    def _partial_path(self, file_path: str) -> str:
+        name = hashlib.sha1(file_path.encode('utf-8')).hexdigest()
+        return os.path.join(self.partials_folder, f"{name}.json")
+
+    def is_fresh(self, file_path: str, config_key: str) -> bool:
+        self._seen.add(file_path)
+        entry = self.entries.get(file_path)
+        if entry is None or entry['config_key'] != config_key:
+            return False
+        if not os.path.exists(self._partial_path(file_path)):
+            return False
+        stat = os.stat(file_path)
+        if stat.st_size == entry['size'] and stat.st_mtime_ns == entry['mtime_ns']:
+            return True
+        if stat.st_size != entry['size'] or file_sha256(file_path) != entry['sha256']:
+            return False
+        # Touched but unchanged
+        entry['mtime_ns'] = stat.st_mtime_ns
+        return True
+
+    def load_partial(self, file_path: str):
+        with open(self._partial_path(file_path), 'rb') as f:
+            return _loads(f.read())
+
+    def store_partial(self, file_path: str, config_key: str, partial):
+        self._seen.add(file_path)
+        os.makedirs(self.partials_folder, exist_ok=True)
+        with open(self._partial_path(file_path), 'wb') as f:
+            f.write(_dumps(partial))
+        stat = os.stat(file_path)
+        self.entries[file_path] = {
+            'size': stat.st_size,
+            'mtime_ns': stat.st_mtime_ns,
+            'sha256': file_sha256(file_path),
+            'config_key': config_key
+        }
+
+    def save(self):
+        # Forget files that were not part of this compilation (deleted or renamed)
+        for file_path in list(self.entries):
+            if file_path not in self._seen:
+                partial_path = self._partial_path(file_path)
+                if os.path.exists(partial_path):
+                    os.remove(partial_path)
+                del self.entries[file_path]
+        os.makedirs(os.path.dirname(self.manifest_path) or '.', exist_ok=True)
+        with open(self.manifest_path, 'wb') as f:
+            f.write(_dumps(self.entries))
@@ -1,263 +1,106 @@
 import os
-import json
-import pandas as pd
+from battle_aggregator import BattleAggregator, JudgmentScorer, MetricScorer, ScoreSource
+from compile_manifest import CompileManifest
+from profiling import profiled
 
 translations_folder = "./Data/Output/translations"
 judgments_folder = "./Data/Output/judgments"
 consistency_judgments_folder = "./Data/Output/consistency_judgments"
-output_battles_file_path = "./Data/Output/prepared_files/compiled_battles.json"
+consistency_scores_folder = "./Data/Output/consistency_scores"
+ngram_scores_folder = "./Data/Output/ngram_scores"
+output_folder = "./Data/Output/prepared_files"
+output_battles_file_path = "./Data/Output/prepared_files/battles.npz"
 output_totals_file_path = "./Data/Output/prepared_files/battle_totals.json"
+# Indexed store of the prepared records and scores, keyed by (model, id)
+results_store_file_path = "./Data/Output/prepared_files/results.sqlite"
+# Input file manifest and per-file partial aggregates for incremental recompilation
+manifest_file_path = "./Data/Output/prepared_files/compile_manifest.json"
+partials_folder = "./Data/Output/prepared_files/partials"
+# Worker processes that parse the input files needing a (re)read
+compile_workers = min(8, os.cpu_count() or 1)
 
 # Load all translations and store bert scores and similarities per model per id
 translation_file_prefix = "a_v2_big_c_conversations_test_"
-translation_files = os.listdir(translations_folder)
-
-output_folder = "./Data/Output/prepared_files"
-
-# ------------------------------------------------------------------------------------------------
-
-overall_data_dict = {}
-for filename in translation_files:
-    if filename.endswith(".jsonl") and filename.startswith(translation_file_prefix):
-        model_name = filename.replace(f"{translation_file_prefix}", "").replace(".jsonl", "")
-
-        fields_to_keep = [
-            "id", 
-            "joined_bemba_sentences",
-            "joined_english_sentences",
-            f"{model_name}_translation",
-            f"{model_name}_bertscore",
-            f"{model_name}_text-embedding-ada-002_similarity"
-        ]
-        
-        data = pd.read_json(os.path.join(translations_folder, filename), lines=True)
-        # Convert DataFrame to a list of dictionaries
-        data_records = data.to_dict(orient='records')
-        data_records = [record for record in data_records if all(field in record for field in fields_to_keep)]
-        # convert to data dict with the ids as keys
-        data_dict = {record["id"]: record for record in data_records}
-        model_package = {
-            "model_name": model_name,
-            "data": data_dict
-        }
-        overall_data_dict[model_name] = model_package
-        output_file_path = os.path.join(output_folder, f"{model_name}.json")
-        with open(output_file_path, "w") as f:
-            json.dump(model_package, f)
-
-# ------------------------------------------------------------------------------------------------
-
-# Data structure to store bert scores and similarities
-model_scores = {}  # model_name -> {id_str -> {'bert_score': ..., 'similarity': ...}}
-
-for filename in translation_files:
-    if filename.endswith(".jsonl") and filename.startswith(translation_file_prefix):
-        model_name = filename.replace(f"{translation_file_prefix}", "").replace(".jsonl", "")
-        model_scores[model_name] = {}
-        with open(os.path.join(translations_folder, filename), 'r') as f:
-            for line in f:
-                data = json.loads(line)
-                id_str = str(data['id'])
-                bert_score = data.get(f"{model_name}_bertscore")
-                similarity = data.get(f"{model_name}_text-embedding-ada-002_similarity")
-                model_scores[model_name][id_str] = {
-                    'bert_score': bert_score,
-                    'similarity': similarity
-                }
-
-# Data structure to store compiled battles
-compiled_battles = {}
-
-# Initialize totals data structure with detailed opponent info
-model_names = list(model_scores.keys())
-battle_types = ['judgment_battles', 'bert_score_battles', 'text_embedding_ada_002_battles', 'consistency_battles']
-battle_totals = {
-    battle_type: {
-        model: {
-            'total_wins': 0,
-            'total_losses': 0,
-            'total_ties': 0,
-            'wins_against': {},
-            'losses_against': {},
-            'ties_against': {}
-        } for model in model_names
-    } for battle_type in battle_types
+# Records missing any of these fields are left out of the prepared per-model files
+fields_to_keep = [
+    "id",
+    "joined_bemba_sentences",
+    "joined_english_sentences",
+    "{model}_translation",
+    "{model}_bertscore",
+    "{model}_text-embedding-ada-002_similarity"
+]
+# Similarity scores from the offline local embedding backend (add_similarity_scores with embedding_backend='local')
+local_similarity_file_prefix = "l_" + translation_file_prefix
+local_embedding_model = "all-MiniLM-L6-v2"
+# Sentence level chrF/BLEU/TER from ngram_metrics.py
+ngram_scores_file_prefix = "v1_big_c_conversations_test_"
+# Per model consistency scores from add_local_consistency_scores.py, one file and one
+# battle type per metric: metric name -> (score key, battle type)
+local_consistency_file_prefix = "v1_{metric}_big_c_conversations_test_"
+local_consistency_metrics = {
+    "all-MiniLM-L6-v2": ('local_consistency', 'local_consistency_battles'),
+    "bertscore": ('bertscore_local_consistency', 'bertscore_local_consistency_battles'),
 }
 
-# Process judgment files
-judgment_files = os.listdir(judgments_folder)
 judgment_file_prefix = "v2_big_c_test_"
-
-for filename in judgment_files:
-    if filename.endswith(".jsonl") and filename.startswith(judgment_file_prefix):
-        # Extract model names from filename
-        model_pair = filename.replace(judgment_file_prefix, "").replace(".jsonl", "")
-        model1_name, model2_name = model_pair.split("_vs_", 1)
-        with open(os.path.join(judgments_folder, filename), 'r') as f:
-            for line in f:
-                data = json.loads(line)
-                id_str = str(data['id'])
-                # Initialize the id in compiled_battles if not already present
-                if id_str not in compiled_battles:
-                    compiled_battles[id_str] = {
-                        'judgment_battles': [],
-                        'bert_score_battles': [],
-                        'text_embedding_ada_002_battles': [],
-                        'consistency_battles': []
-                    }
-                # Get the winner from 'gpt_4o_judgment'
-                winner_model = data.get('gpt_4o_judgment')
-                # Append to judgment_battles
-                compiled_battles[id_str]['judgment_battles'].append({
-                    'model_1': model1_name,
-                    'model_2': model2_name,
-                    'winner': winner_model
-                })
-                # Initialize opponent stats if not present
-                for model, opponent in [(model1_name, model2_name), (model2_name, model1_name)]:
-                    for battle_type in battle_types:
-                        if opponent not in battle_totals[battle_type][model]['wins_against']:
-                            battle_totals[battle_type][model]['wins_against'][opponent] = 0
-                            battle_totals[battle_type][model]['losses_against'][opponent] = 0
-                            battle_totals[battle_type][model]['ties_against'][opponent] = 0
-                # Update totals for judgment battles
-                if winner_model == model1_name:
-                    battle_totals['judgment_battles'][model1_name]['total_wins'] += 1
-                    battle_totals['judgment_battles'][model1_name]['wins_against'][model2_name] += 1
-                    battle_totals['judgment_battles'][model2_name]['total_losses'] += 1
-                    battle_totals['judgment_battles'][model2_name]['losses_against'][model1_name] += 1
-                elif winner_model == model2_name:
-                    battle_totals['judgment_battles'][model2_name]['total_wins'] += 1
-                    battle_totals['judgment_battles'][model2_name]['wins_against'][model1_name] += 1
-                    battle_totals['judgment_battles'][model1_name]['total_losses'] += 1
-                    battle_totals['judgment_battles'][model1_name]['losses_against'][model2_name] += 1
-                else:  # tie or invalid winner
-                    battle_totals['judgment_battles'][model1_name]['total_ties'] += 1
-                    battle_totals['judgment_battles'][model1_name]['ties_against'][model2_name] += 1
-                    battle_totals['judgment_battles'][model2_name]['total_ties'] += 1
-                    battle_totals['judgment_battles'][model2_name]['ties_against'][model1_name] += 1
-
-                # Get bert scores for both models
-                bert_score_1 = model_scores.get(model1_name, {}).get(id_str, {}).get('bert_score')
-                bert_score_2 = model_scores.get(model2_name, {}).get(id_str, {}).get('bert_score')
-                if bert_score_1 is not None and bert_score_2 is not None:
-                    if bert_score_1 > bert_score_2:
-                        winner_bert = model1_name
-                    elif bert_score_1 < bert_score_2:
-                        winner_bert = model2_name
-                    else:
-                        winner_bert = 'tie'
-                    compiled_battles[id_str]['bert_score_battles'].append({
-                        'model_1': model1_name,
-                        'model_2': model2_name,
-                        'winner': winner_bert
-                    })
-                    # Update totals for bert score battles
-                    if winner_bert == model1_name:
-                        battle_totals['bert_score_battles'][model1_name]['total_wins'] += 1
-                        battle_totals['bert_score_battles'][model1_name]['wins_against'][model2_name] += 1
-                        battle_totals['bert_score_battles'][model2_name]['total_losses'] += 1
-                        battle_totals['bert_score_battles'][model2_name]['losses_against'][model1_name] += 1
-                    elif winner_bert == model2_name:
-                        battle_totals['bert_score_battles'][model2_name]['total_wins'] += 1
-                        battle_totals['bert_score_battles'][model2_name]['wins_against'][model1_name] += 1
-                        battle_totals['bert_score_battles'][model1_name]['total_losses'] += 1
-                        battle_totals['bert_score_battles'][model1_name]['losses_against'][model2_name] += 1
-                    else:  # tie
-                        battle_totals['bert_score_battles'][model1_name]['total_ties'] += 1
-                        battle_totals['bert_score_battles'][model1_name]['ties_against'][model2_name] += 1
-                        battle_totals['bert_score_battles'][model2_name]['total_ties'] += 1
-                        battle_totals['bert_score_battles'][model2_name]['ties_against'][model1_name] += 1
-
-                # Get text embedding similarities for both models
-                sim_1 = model_scores.get(model1_name, {}).get(id_str, {}).get('similarity')
-                sim_2 = model_scores.get(model2_name, {}).get(id_str, {}).get('similarity')
-                if sim_1 is not None and sim_2 is not None:
-                    if sim_1 > sim_2:
-                        winner_sim = model1_name
-                    elif sim_1 < sim_2:
-                        winner_sim = model2_name
-                    else:
-                        winner_sim = 'tie'
-                    compiled_battles[id_str]['text_embedding_ada_002_battles'].append({
-                        'model_1': model1_name,
-                        'model_2': model2_name,
-                        'winner': winner_sim
-                    })
-                    # Update totals for similarity battles
-                    if winner_sim == model1_name:
-                        battle_totals['text_embedding_ada_002_battles'][model1_name]['total_wins'] += 1
-                        battle_totals['text_embedding_ada_002_battles'][model1_name]['wins_against'][model2_name] += 1
-                        battle_totals['text_embedding_ada_002_battles'][model2_name]['total_losses'] += 1
-                        battle_totals['text_embedding_ada_002_battles'][model2_name]['losses_against'][model1_name] += 1
-                    elif winner_sim == model2_name:
-                        battle_totals['text_embedding_ada_002_battles'][model2_name]['total_wins'] += 1
-                        battle_totals['text_embedding_ada_002_battles'][model2_name]['wins_against'][model1_name] += 1
-                        battle_totals['text_embedding_ada_002_battles'][model1_name]['total_losses'] += 1
-                        battle_totals['text_embedding_ada_002_battles'][model1_name]['losses_against'][model2_name] += 1
-                    else:  # tie
-                        battle_totals['text_embedding_ada_002_battles'][model1_name]['total_ties'] += 1
-                        battle_totals['text_embedding_ada_002_battles'][model1_name]['ties_against'][model2_name] += 1
-                        battle_totals['text_embedding_ada_002_battles'][model2_name]['total_ties'] += 1
-                        battle_totals['text_embedding_ada_002_battles'][model2_name]['ties_against'][model1_name] += 1
-
-# Process consistency judgments
-consistency_files = os.listdir(consistency_judgments_folder)
 consistency_file_prefix = "v1_big_c_test_"
 
-for filename in consistency_files:
-    if filename.endswith(".jsonl") and filename.startswith(consistency_file_prefix):
-        # Extract model names from filename
-        model_pair = filename.replace(consistency_file_prefix, "").replace(".jsonl", "")
-        model1_name, model2_name = model_pair.split("_vs_", 1)
-        with open(os.path.join(consistency_judgments_folder, filename), 'r') as f:
-            for line in f:
-                data = json.loads(line)
-                id_str = str(data['id'])
-                # Initialize the id in compiled_battles if not already present
-                if id_str not in compiled_battles:
-                    compiled_battles[id_str] = {
-                        'judgment_battles': [],
-                        'bert_score_battles': [],
-                        'text_embedding_ada_002_battles': [],
-                        'consistency_battles': []
-                    }
-                # Get the winner from 'gpt_4o_consistency_judgment'
-                winner_consistency = data.get('gpt_4o_consistency_judgment')
-                # Append to consistency_battles
-                compiled_battles[id_str]['consistency_battles'].append({
-                    'model_1': model1_name,
-                    'model_2': model2_name,
-                    'winner': winner_consistency
-                })
-                # Initialize opponent stats if not present
-                for model, opponent in [(model1_name, model2_name), (model2_name, model1_name)]:
-                    for battle_type in ['consistency_battles']:
-                        if opponent not in battle_totals[battle_type][model]['wins_against']:
-                            battle_totals[battle_type][model]['wins_against'][opponent] = 0
-                            battle_totals[battle_type][model]['losses_against'][opponent] = 0
-                            battle_totals[battle_type][model]['ties_against'][opponent] = 0
-                # Update totals for consistency battles
-                if winner_consistency == model1_name:
-                    battle_totals['consistency_battles'][model1_name]['total_wins'] += 1
-                    battle_totals['consistency_battles'][model1_name]['wins_against'][model2_name] += 1
-                    battle_totals['consistency_battles'][model2_name]['total_losses'] += 1
-                    battle_totals['consistency_battles'][model2_name]['losses_against'][model1_name] += 1
-                elif winner_consistency == model2_name:
-                    battle_totals['consistency_battles'][model2_name]['total_wins'] += 1
-                    battle_totals['consistency_battles'][model2_name]['wins_against'][model1_name] += 1
-                    battle_totals['consistency_battles'][model1_name]['total_losses'] += 1
-                    battle_totals['consistency_battles'][model1_name]['losses_against'][model2_name] += 1
-                else:  # tie
-                    battle_totals['consistency_battles'][model1_name]['total_ties'] += 1
-                    battle_totals['consistency_battles'][model1_name]['ties_against'][model2_name] += 1
-                    battle_totals['consistency_battles'][model2_name]['total_ties'] += 1
-                    battle_totals['consistency_battles'][model2_name]['ties_against'][model1_name] += 1
-
-# Write the compiled battles to a JSON file
-with open(output_battles_file_path, 'w') as f:
-    json.dump(compiled_battles, f, indent=2)
 
-# Write the battle totals to a JSON file
-with open(output_totals_file_path, 'w') as f:
-    json.dump(battle_totals, f, indent=2)
\ No newline at end of file
+def build_aggregator() -> BattleAggregator:
+    aggregator = BattleAggregator(
+        translations_folder, translation_file_prefix, fields_to_keep, output_folder, results_store_file_path
+    )
+
+    # Where the per-id scores come from
+    aggregator.register_translation_scores({
+        'bert_score': "{model}_bertscore",
+        'similarity': "{model}_text-embedding-ada-002_similarity",
+    })
+    aggregator.register_score_source(ScoreSource(
+        translations_folder, local_similarity_file_prefix,
+        {'local_similarity': f"{{model}}_{local_embedding_model}_similarity"}
+    ))
+    aggregator.register_score_source(ScoreSource(
+        ngram_scores_folder, ngram_scores_file_prefix,
+        {'chrf': "{model}_chrf", 'bleu': "{model}_bleu", 'ter': "{model}_ter"}
+    ))
+    for metric, (score_key, _) in local_consistency_metrics.items():
+        aggregator.register_score_source(ScoreSource(
+            consistency_scores_folder, local_consistency_file_prefix.format(metric=metric),
+            {score_key: f"{{model}}_{metric}_consistency"}
+        ))
+
+    # Battle types, in the order they are indexed in battles.npz
+    aggregator.register_scorer(JudgmentScorer(
+        'judgment_battles', judgments_folder, judgment_file_prefix, 'gpt_4o_judgment'
+    ))
+    # Score battles cover every pair of models, not only judged pairs
+    aggregator.register_scorer(MetricScorer('bert_score_battles', 'bert_score'))
+    aggregator.register_scorer(MetricScorer('text_embedding_ada_002_battles', 'similarity'))
+    aggregator.register_scorer(MetricScorer('all_minilm_l6_v2_battles', 'local_similarity'))
+    aggregator.register_scorer(MetricScorer('chrf_battles', 'chrf'))
+    aggregator.register_scorer(MetricScorer('bleu_battles', 'bleu'))
+    aggregator.register_scorer(MetricScorer('ter_battles', 'ter', higher_is_better=False))
+    aggregator.register_scorer(JudgmentScorer(
+        'consistency_battles', consistency_judgments_folder, consistency_file_prefix, 'gpt_4o_consistency_judgment'
+    ))
+    for score_key, battle_type in local_consistency_metrics.values():
+        aggregator.register_scorer(MetricScorer(battle_type, score_key))
+    return aggregator
+
+
+@profiled
+def main(full_rebuild: bool = False):
+    # Only new or changed input files are read; pass full_rebuild=True to read everything again
+    manifest = None if full_rebuild else CompileManifest(manifest_file_path, partials_folder)
+    aggregator = build_aggregator().run(manifest, max_workers=compile_workers)
+    aggregator.write_prepared_files()
+    aggregator.write_results_store()
+    # Write the columnar battle store and the battle totals
+    aggregator.write_battle_store(output_battles_file_path)
+    aggregator.write_battle_totals(output_totals_file_path)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,110 +1,128 @@
+import os
 import json
-import random
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+from battle_store import BattleStore, battle_pairs
+from bradley_terry import (
+    fit_bradley_terry, bootstrap_bradley_terry, pair_counts_to_matrices, rank_models, sum_pair_counts, to_elo_scale
+)
+from profiling import profiled
 
 # Paths to the input and output files
-compiled_battles_file_path = "./Data/Output/prepared_files/compiled_battles.json"
+battles_file_path = "./Data/Output/prepared_files/battles.npz"
 output_elo_file_path = "./Data/Output/prepared_files/elo_rankings.json"
+output_intervals_file_path = "./Data/Output/prepared_files/elo_confidence_intervals.json"
 
-# Parameters for ELO calculation
-INITIAL_ELO = 1000
-K_FACTOR = 10  # Starting with a standard K-factor
+# Virtual games between every pair of models, keeps ratings finite for unbeaten or winless models
+PRIOR_GAMES = 1.0
 
-def calculate_expected(player_rating, opponent_rating):
-    """Calculate the expected score between two players."""
-    return 1 / (1 + 10 ** ((opponent_rating - player_rating) / 400))
+# Bootstrap over conversations for the confidence intervals; 0 rounds skips it
+BOOTSTRAP_ROUNDS = 1000
+BOOTSTRAP_SEED = 0
+CONFIDENCE_LEVEL = 0.95
 
-def update_elo(player_rating, opponent_rating, score, K):
-    expected_score = calculate_expected(player_rating, opponent_rating)
-    new_rating = player_rating + K * (score - expected_score)
-    return new_rating
+def _played_models(wins, ties):
+    """Indices of the models that took part in at least one battle."""
+    return np.flatnonzero((wins + wins.T + ties).sum(axis=1) > 0)
 
-def compute_elo_for_battle_type(battle_type_data):
+def compute_elo_for_battle_type(battles, battle_type):
     """
-    Compute ELO ratings for a given battle type.
-    battle_type_data: Dictionary containing battles for the specific battle type.
+    Compute ELO-scale ratings for a given battle type by fitting a Bradley-Terry model
+    (with ties) to the head-to-head counts. The result does not depend on battle order.
+    battles: BattleStore holding the battles.
     Returns a dictionary with model names as keys and their ELO ratings as values.
     """
-    elo_ratings = {}
-
-    # Initialize ELO ratings for all models
-    models = set()
-    for battles in battle_type_data.values():
-        for battle in battles:
-            models.add(battle['model_1'])
-            models.add(battle['model_2'])
-    for model in models:
-        elo_ratings[model] = INITIAL_ELO
-
-    # Prepare a list of all individual matches
-    matches = []
-    for battles in battle_type_data.values():
-        for battle in battles:
-            model_1 = battle['model_1']
-            model_2 = battle['model_2']
-            winner = battle['winner']
-
-            if winner == model_1:
-                score = 1
-            elif winner == model_2:
-                score = 0
-            else:  # 'tie' or any other value
-                score = 0.5
-
-            matches.append({
-                'model_1': model_1,
-                'model_2': model_2,
-                'score': score
-            })
-
-    # Shuffle matches to randomize order
-    random.shuffle(matches)
-
-    # Update ELO ratings based on individual matches
-    epochs = 20  # Number of times to iterate over all matches
-    for _ in range(epochs):
-        for match in matches:
-            m1 = match['model_1']
-            m2 = match['model_2']
-            score = match['score']
-
-            elo1 = elo_ratings[m1]
-            elo2 = elo_ratings[m2]
-
-            # Update ratings (you might use a dynamic K-factor here)
-            new_elo1 = update_elo(elo1, elo2, score, K=K_FACTOR)
-            new_elo2 = update_elo(elo2, elo1, 1 - score, K=K_FACTOR)
-
-            elo_ratings[m1] = new_elo1
-            elo_ratings[m2] = new_elo2
-
-    return elo_ratings
-
+    wins, ties = battles.head_to_head(battle_type)
+    # Only models that took part in a battle of this type are rated
+    played = _played_models(wins, ties)
+    if len(played) == 0:
+        return {}
+    wins = wins[np.ix_(played, played)]
+    ties = ties[np.ix_(played, played)]
+
+    log10_strength, _ = fit_bradley_terry(wins, ties, prior_games=PRIOR_GAMES)
+    ratings = to_elo_scale(log10_strength)
+    return {battles.models[m]: float(rating) for m, rating in zip(played, ratings)}
+
+def compute_confidence_intervals_for_battle_type(models, columns, rounds=BOOTSTRAP_ROUNDS, seed=BOOTSTRAP_SEED):
+    """
+    Bootstrap the ratings of a given battle type by resampling conversations.
+    models: the model names of the BattleStore; columns: the battle type's
+    (id, model_1, model_2, outcome) arrays from BattleStore.select, so a worker process
+    only receives the battles it rates.
+    Returns a dictionary with, per model: the point estimate, the lower and upper bound of
+    the CONFIDENCE_LEVEL interval, the rank, the rank interval and how often the model
+    kept its rank across resamples.
+    """
+    id_indices, model_1, model_2, outcome = columns
+    pairs, pair_index, result = battle_pairs(model_1, model_2, outcome, len(models))
+    if len(pairs) == 0:
+        return {}
+    # Only models that took part in a battle of this type are rated
+    played, pairs = np.unique(pairs, return_inverse=True)
+    pairs = pairs.reshape(-1, 2)
+
+    wins, ties = pair_counts_to_matrices(pairs, sum_pair_counts(pair_index, result, len(pairs)), len(played))
+    point, _ = fit_bradley_terry(wins, ties, prior_games=PRIOR_GAMES)
+    point = to_elo_scale(point)
+    samples = to_elo_scale(bootstrap_bradley_terry(
+        pairs, id_indices, pair_index, result, len(played), rounds, seed, PRIOR_GAMES
+    ))
+    tail = (1 - CONFIDENCE_LEVEL) / 2 * 100
+    lower, upper = np.percentile(samples, [tail, 100 - tail], axis=0)
+    point_ranks = rank_models(point)
+    sample_ranks = rank_models(samples)
+    rank_lower, rank_upper = np.percentile(sample_ranks, [tail, 100 - tail], axis=0)
+    rank_stability = (sample_ranks == point_ranks).mean(axis=0)
+
+    intervals = {
+        models[m]: {
+            'elo': float(point[k]),
+            'lower': float(lower[k]),
+            'upper': float(upper[k]),
+            'rank': int(point_ranks[k]),
+            'rank_lower': int(np.floor(rank_lower[k])),
+            'rank_upper': int(np.ceil(rank_upper[k])),
+            'rank_stability': float(rank_stability[k])
+        } for k, m in enumerate(played)
+    }
+    return dict(sorted(intervals.items(), key=lambda item: item[1]['elo'], reverse=True))
+
+def compute_confidence_intervals(battles, rounds=BOOTSTRAP_ROUNDS, seed=BOOTSTRAP_SEED):
+    """Bootstrap every battle type, one worker process per battle type."""
+    n_types = len(battles.battle_types)
+    max_workers = min(n_types, os.cpu_count() or 1)
+    if max_workers <= 1:
+        results = [
+            compute_confidence_intervals_for_battle_type(battles.models, battles.select(bt), rounds, seed)
+            for bt in battles.battle_types
+        ]
+    else:
+        with ProcessPoolExecutor(max_workers=max_workers) as executor:
+            # Each worker is sent the columns of its own battle type, not the whole store
+            results = list(executor.map(
+                compute_confidence_intervals_for_battle_type,
+                [battles.models] * n_types, (battles.select(bt) for bt in battles.battle_types),
+                [rounds] * n_types, [seed] * n_types
+            ))
+    return {
+        'confidence_level': CONFIDENCE_LEVEL,
+        'bootstrap_rounds': rounds,
+        'battle_types': dict(zip(battles.battle_types, results))
+    }
+
+@profiled
 def main():
-    with open(compiled_battles_file_path, 'r') as f:
-        compiled_battles = json.load(f)
+    battles = BattleStore.load(battles_file_path)
 
     # Initialize a dictionary to store ELO rankings for each battle type
     elo_rankings = {}
 
-    # List of battle types to process
-    battle_types = [
-        'judgment_battles',
-        'bert_score_battles',
-        'text_embedding_ada_002_battles',
-        'consistency_battles'
-    ]
-
-    for battle_type in battle_types:
+    for battle_type in battles.battle_types:
         print(f"Computing ELO rankings for {battle_type}...")
 
-        # Extract battles for the current battle type
-        battle_type_data = {}
-        for id_str, battles_dict in compiled_battles.items():
-            if battle_type in battles_dict:
-                battle_type_data.setdefault(id_str, battles_dict[battle_type])
-
         # Compute ELO ratings for the battle type
-        elo_ratings = compute_elo_for_battle_type(battle_type_data)
+        elo_ratings = compute_elo_for_battle_type(battles, battle_type)
 
         # Sort the models based on ELO ratings
         sorted_elo = dict(sorted(elo_ratings.items(), key=lambda item: item[1], reverse=True))
@@ -116,5 +134,12 @@ def main():
 
     print(f"ELO rankings have been computed and saved to {output_elo_file_path}")
 
+    if BOOTSTRAP_ROUNDS > 0:
+        print(f"Bootstrapping {BOOTSTRAP_ROUNDS} resamples of the conversations per battle type...")
+        confidence_intervals = compute_confidence_intervals(battles)
+        with open(output_intervals_file_path, 'w') as f:
+            json.dump(confidence_intervals, f, indent=2)
+        print(f"Confidence intervals have been computed and saved to {output_intervals_file_path}")
+
 if __name__ == "__main__":
     main()
@@ -9,9 +9,11 @@ import plotly.express as px
 from pyvis.network import Network
 import tkinter as tk
 from tkinter import ttk
+from battle_store import BattleStore
 
-# Path to the battle totals JSON file
+# Paths to the battle totals JSON file and the columnar battle store
 battle_totals_file_path = "./Data/Output/prepared_files/battle_totals.json"
+battles_file_path = "./Data/Output/prepared_files/battles.npz"
 
 def load_battle_totals():
     # Load the battle totals from the JSON file
@@ -19,31 +21,26 @@ def load_battle_totals():
         battle_totals = json.load(f)
     return battle_totals
 
-def prepare_heatmap_data(battle_totals, battle_type='judgment_battles'):
-    # Extract the models
-    models = sorted(battle_totals[battle_type].keys())
-    # Initialize DataFrames
-    heatmap_data = pd.DataFrame(0, index=models, columns=models)
-    hover_text = pd.DataFrame('', index=models, columns=models)
-    # Populate the DataFrames
-    for model in models:
-        wins = battle_totals[battle_type][model]['wins_against']
-        losses = battle_totals[battle_type][model]['losses_against']
-        ties = battle_totals[battle_type][model]['ties_against']
-        for opponent in models:
-            win_count = wins.get(opponent, 0)
-            loss_count = losses.get(opponent, 0)
-            tie_count = ties.get(opponent, 0)
-            total_battles = win_count + loss_count + tie_count
-            # Assign the number of wins to the heatmap
-            heatmap_data.loc[model, opponent] = win_count
-            # Create hover text
-            hover_text.loc[model, opponent] = (
-                f"Wins vs {opponent}: {win_count}<br>"
-                f"Losses vs {opponent}: {loss_count}<br>"
-                f"Ties vs {opponent}: {tie_count}<br>"
-                f"Total Battles: {total_battles}"
-            )
+def prepare_heatmap_data(battles, battle_type='judgment_battles'):
+    # Head-to-head matrices, with models sorted by name
+    wins, ties = battles.head_to_head(battle_type)
+    order = np.argsort(battles.models)
+    models = [battles.models[i] for i in order]
+    wins = wins[np.ix_(order, order)]
+    ties = ties[np.ix_(order, order)]
+    losses = wins.T
+    # Assign the number of wins to the heatmap
+    heatmap_data = pd.DataFrame(wins, index=models, columns=models)
+    # Create hover text
+    hover_text = pd.DataFrame([
+        [
+            f"Wins vs {opponent}: {wins[i, j]}<br>"
+            f"Losses vs {opponent}: {losses[i, j]}<br>"
+            f"Ties vs {opponent}: {ties[i, j]}<br>"
+            f"Total Battles: {wins[i, j] + losses[i, j] + ties[i, j]}"
+            for j, opponent in enumerate(models)
+        ] for i in range(len(models))
+    ], index=models, columns=models)
     return heatmap_data, hover_text
 
 def plot_interactive_heatmap(heatmap_data, hover_text, battle_type='judgment_battles'):
@@ -67,8 +64,8 @@ def plot_interactive_heatmap(heatmap_data, hover_text, battle_type='judgment_bat
     )
     fig.show()
 
-def on_button_click(battle_type, battle_totals):
-    heatmap_data, hover_text = prepare_heatmap_data(battle_totals, battle_type)
+def on_button_click(battle_type, battles):
+    heatmap_data, hover_text = prepare_heatmap_data(battles, battle_type)
     plot_interactive_heatmap(heatmap_data, hover_text, battle_type)
 
 def plot_battle_network(battle_totals, battle_type='judgment_battles'):
@@ -182,18 +179,18 @@ def plot_pyvis_network(battle_totals, battle_type='judgment_battles'):
     net.show(f"battle_network_{battle_type}.html")
 
 def main():
-    battle_totals = load_battle_totals()
+    battles = BattleStore.load(battles_file_path)
     # Create the GUI
     root = tk.Tk()
     root.title("Interactive Battle Totals Heatmap")
     # Create buttons for each battle type
-    battle_types = list(battle_totals.keys())
+    battle_types = battles.battle_types
     for battle_type in battle_types:
         button_text = battle_type.replace('_', ' ').title()
         btn = ttk.Button(
             root,
             text=button_text,
-            command=lambda bt=battle_type: on_button_click(bt, battle_totals)
+            command=lambda bt=battle_type: on_button_click(bt, battles)
         )
         btn.pack(pady=5, padx=10, fill='x')
     root.mainloop()
@@ -1,9 +1,9 @@
-import pandas as pd
 import tkinter as tk
 from tkinter import ttk
 from tkinter import messagebox
 import os
 import sys
+from jsonl_io import read_jsonl
 
 def main():
     # Load data from the JSONL file
@@ -15,7 +15,7 @@ def main():
         sys.exit(1)
 
     try:
-        df = pd.read_json(data_file, lines=True)
+        df = read_jsonl(data_file)
     except ValueError as e:
         messagebox.showerror("Data Load Error", f"Unable to read JSON data:\n{e}")
         sys.exit(1)
@@ -1,11 +1,11 @@
-import pandas as pd
 import tkinter as tk
 from tkinter import ttk
+from jsonl_io import read_jsonl
 
 def main():
     # Load data from the JSONL file
     data_file = './Data/Output/judgments/v2_big_c_test_gpt_4o_vs_sonnet_3_point_5.jsonl'
-    df = pd.read_json(data_file, lines=True)
+    df = read_jsonl(data_file)
 
     # Identify judgment column
     judgment_column = 'gpt_4o_judgment'
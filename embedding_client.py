@@ -0,0 +1,192 @@
+import os
+import time
+import asyncio
+import logging
+from collections import deque
+from typing import List, Optional
+from dotenv import load_dotenv
+from openai import AsyncOpenAI
+from call_stats import timed_call
+load_dotenv()
+
+logging.basicConfig(level=logging.INFO)
+
+try:
+    import tiktoken
+except ImportError:
+    tiktoken = None
+
+
+class _RateLimiter:
+    """Token bucket limiting requests and tokens per minute."""
+
+    def __init__(self, requests_per_minute: int, tokens_per_minute: int):
+        self.requests_per_minute = requests_per_minute
+        self.tokens_per_minute = tokens_per_minute
+        self._request_allowance = float(requests_per_minute)
+        self._token_allowance = float(tokens_per_minute)
+        self._last_refill = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        elapsed = now - self._last_refill
+        self._last_refill = now
+        self._request_allowance = min(
+            self.requests_per_minute,
+            self._request_allowance + elapsed * self.requests_per_minute / 60
+        )
+        self._token_allowance = min(
+            self.tokens_per_minute,
+            self._token_allowance + elapsed * self.tokens_per_minute / 60
+        )
+
+    async def acquire(self, tokens: int):
+        # A single chunk may never need more than a full minute of tokens
+        tokens = min(tokens, self.tokens_per_minute)
+        async with self._lock:
+            while True:
+                self._refill()
+                if self._request_allowance >= 1 and self._token_allowance >= tokens:
+                    self._request_allowance -= 1
+                    self._token_allowance -= tokens
+                    return
+                missing_requests = max(0, 1 - self._request_allowance) * 60 / self.requests_per_minute
+                missing_tokens = max(0, tokens - self._token_allowance) * 60 / self.tokens_per_minute
+                await asyncio.sleep(max(missing_requests, missing_tokens, 0.01))
+
+
+class AsyncEmbeddingClient:
+    """
+    Embeds documents through the OpenAI embeddings endpoint with concurrent,
+    token-budgeted chunks.
+
+    Inputs are split into chunks holding at most `batch_size` texts and
+    `max_tokens_per_chunk` tokens. Up to `max_concurrency` chunks are in flight
+    at once, subject to the requests/tokens per minute limits. A failed chunk is
+    put back on the queue on its own, so only its texts are sent again. The
+    batch size grows while chunks come back faster than `target_latency` and
+    shrinks when they are slow or fail.
+    """
+
+    def __init__(
+        self,
+        model: str = 'text-embedding-ada-002',
+        api_key: Optional[str] = None,
+        max_concurrency: int = 8,
+        requests_per_minute: int = 3000,
+        tokens_per_minute: int = 1_000_000,
+        max_tokens_per_chunk: int = 100_000,
+        initial_batch_size: int = 128,
+        min_batch_size: int = 8,
+        max_batch_size: int = 2048,
+        target_latency: float = 2.0,
+        max_retries: int = 5
+    ):
+        api_key = api_key or os.getenv("OPENAI_API_KEY")
+        if not api_key:
+            raise ValueError("OpenAI API key is not set in the environment variable 'OPENAI_API_KEY'.")
+        self.model = model
+        self.client = AsyncOpenAI(api_key=api_key)
+        self.max_concurrency = max_concurrency
+        self.rate_limiter = _RateLimiter(requests_per_minute, tokens_per_minute)
+        self.max_tokens_per_chunk = max_tokens_per_chunk
+        self.batch_size = initial_batch_size
+        self.min_batch_size = min_batch_size
+        self.max_batch_size = max_batch_size
+        self.target_latency = target_latency
+        self.max_retries = max_retries
+        self._encoding = None
+        if tiktoken is not None:
+            try:
+                self._encoding = tiktoken.encoding_for_model(model)
+            except KeyError:
+                self._encoding = tiktoken.get_encoding("cl100k_base")
+            except Exception as e:
+                # tiktoken downloads its vocabularies on first use
+                logging.warning(f"Could not load tiktoken encoding ({e}). Estimating token counts.")
+
+    @property
+    def name(self) -> str:
+        """Model name used in column names, e.g. 'text-embedding-ada-002'."""
+        return self.model
+
+    def count_tokens(self, text: str) -> int:
+        if self._encoding is not None:
+            return len(self._encoding.encode(text))
+        # Rough estimate when tiktoken is not installed
+        return len(text) // 4 + 1
+
+    def _next_chunk(self, pending: deque, token_counts: List[int]) -> List[int]:
+        chunk = []
+        chunk_tokens = 0
+        while pending and len(chunk) < self.batch_size:
+            index = pending[0]
+            if chunk and chunk_tokens + token_counts[index] > self.max_tokens_per_chunk:
+                break
+            chunk.append(pending.popleft())
+            chunk_tokens += token_counts[index]
+        return chunk
+
+    def _adapt_batch_size(self, latency: float, failed: bool):
+        if failed or latency > self.target_latency:
+            self.batch_size = max(self.min_batch_size, self.batch_size // 2)
+        elif latency < self.target_latency / 2:
+            self.batch_size = min(self.max_batch_size, int(self.batch_size * 1.5) + 1)
+
+    async def _embed_chunk(self, texts: List[str]) -> List[List[float]]:
+        with timed_call(self.model):
+            response = await self.client.embeddings.create(model=self.model, input=texts)
+        data = sorted(response.data, key=lambda item: item.index)
+        return [item.embedding for item in data]
+
+    async def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        # The endpoint rejects empty strings
+        texts = [str(text) if text is not None and str(text) != '' else ' ' for text in texts]
+        token_counts = [self.count_tokens(text) for text in texts]
+        embeddings: List[Optional[List[float]]] = [None] * len(texts)
+        attempts = [0] * len(texts)
+        pending = deque(range(len(texts)))
+        in_flight = 0
+        errors = []
+
+        async def worker():
+            nonlocal in_flight
+            while not errors:
+                chunk = self._next_chunk(pending, token_counts)
+                if not chunk:
+                    if in_flight == 0:
+                        return
+                    # A chunk in flight may still fail and come back
+                    await asyncio.sleep(0.05)
+                    continue
+                in_flight += 1
+                chunk_tokens = sum(token_counts[i] for i in chunk)
+                try:
+                    await self.rate_limiter.acquire(chunk_tokens)
+                    start = time.monotonic()
+                    result = await self._embed_chunk([texts[i] for i in chunk])
+                    latency = time.monotonic() - start
+                    for index, embedding in zip(chunk, result):
+                        embeddings[index] = embedding
+                    self._adapt_batch_size(latency, failed=False)
+                except Exception as e:
+                    self._adapt_batch_size(0, failed=True)
+                    for index in chunk:
+                        attempts[index] += 1
+                    if max(attempts[i] for i in chunk) > self.max_retries:
+                        errors.append(e)
+                        return
+                    logging.warning(
+                        f"Embedding chunk of {len(chunk)} texts failed ({e}). "
+                        f"Retrying with batch size {self.batch_size}."
+                    )
+                    pending.extendleft(reversed(chunk))
+                    await asyncio.sleep(min(2 ** max(attempts[i] for i in chunk), 30))
+                finally:
+                    in_flight -= 1
+
+        await asyncio.gather(*(worker() for _ in range(self.max_concurrency)))
+        if errors:
+            raise RuntimeError(f"Embedding failed after {self.max_retries} retries.") from errors[0]
+        return embeddings
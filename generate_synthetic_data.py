@@ -0,0 +1,221 @@
+import os
+import logging
+import numpy as np
+from typing import Dict, List, Tuple
+from prepare_judgment_file import full_judgment_prompt
+from prepare_consistency_judgment_file import full_consistency_judgment_prompt
+from jsonl_io import write_jsonl
+
+logging.basicConfig(level=logging.INFO)
+
+# Each scale is written to synthetic_root/<name>/ with the same Data/Static and
+# Data/Output layout as the real data, so the offline stages run on it unchanged
+synthetic_root = "./Data/Synthetic"
+# (name, models, conversations, judged opponents per model)
+scale_ladder = [
+    ("small", 8, 500, 4),
+    ("medium", 20, 2000, 4),
+    ("large", 50, 5000, 2),
+    ("xl", 50, 100000, 2),
+]
+# Scales that are only generated or benchmarked when named in SCALES; xl takes over 100 GB of disk
+opt_in_scales = {"xl"}
+seed = 0
+
+judgment_model = "gpt_4o"
+embedding_model = "text-embedding-ada-002"
+vocabulary_size = 5000
+sentences_per_conversation = 5
+words_per_sentence = (6, 16)
+# Share of judge verdicts that are ties
+tie_rate = 0.1
+
+translation_prompt = """
+Translate the following conversation between two Bemba speakers into English, line by line.
+{conversation}
+Your translation:""".strip()
+
+
+def _words(rng: np.random.Generator, n_words: int) -> np.ndarray:
+    syllables = np.array(["ba", "ka", "la", "ma", "na", "ta", "li", "ku", "mu", "si", "we", "bo", "ye", "sha", "nga"])
+    lengths = rng.integers(1, 4, size=n_words)
+    return np.array(["".join(rng.choice(syllables, size=length)) for length in lengths])
+
+
+def _join_sentences(sentences: List[str]) -> str:
+    # Same format as get_regular_translations.join_sentences
+    return "".join(f"\n{'A' if i % 2 == 0 else 'B'}: {sentence}" for i, sentence in enumerate(sentences))
+
+
+class SyntheticScale:
+    """
+    Conversations and models of one scale. Every model has a latent noise level: its
+    translation of a conversation is the English reference with that share of words
+    replaced. Scores and judge verdicts follow the words each translation got right,
+    so the ratings computed from the synthetic files are meaningful.
+    """
+
+    def __init__(self, n_models: int, n_conversations: int, opponents_per_model: int, rng: np.random.Generator):
+        self.rng = rng
+        self.models = [f"synthetic_{i:02d}" for i in range(n_models)]
+        self.noise = dict(zip(self.models, rng.uniform(0.05, 0.6, size=n_models)))
+        self.bemba_words = _words(rng, vocabulary_size)
+        self.english_words = _words(rng, vocabulary_size)
+        self.ids = rng.choice(np.arange(1_000_000, 100_000_000), size=n_conversations, replace=False).tolist()
+        # Per conversation, the word ids of each English sentence
+        self.english_tokens = [
+            [rng.integers(0, vocabulary_size, size=rng.integers(*words_per_sentence)) for _ in range(sentences_per_conversation)]
+            for _ in range(n_conversations)
+        ]
+        self.conversations = [self._conversation(id_value, tokens) for id_value, tokens in zip(self.ids, self.english_tokens)]
+        # Each model is judged against opponents_per_model others, in a ring so every model plays
+        pairs = set()
+        for i in range(n_models):
+            for k in range(1, (opponents_per_model + 1) // 2 + 1):
+                j = (i + k) % n_models
+                if i != j:
+                    pairs.add((self.models[min(i, j)], self.models[max(i, j)]))
+        self.pairs = sorted(pairs)
+
+    def _conversation(self, id_value: int, tokens: List[np.ndarray]) -> dict:
+        bemba_sentences = [" ".join(self.bemba_words[self.rng.integers(0, vocabulary_size, size=len(t))]) for t in tokens]
+        english_sentences = [" ".join(self.english_words[t]) for t in tokens]
+        joined_bemba = _join_sentences(bemba_sentences)
+        return {
+            'bemba_sentences': bemba_sentences,
+            'english_sentences': english_sentences,
+            'id': id_value,
+            'img_path': f"{id_value}.jpg",
+            'joined_bemba_sentences': joined_bemba,
+            'joined_english_sentences': _join_sentences(english_sentences),
+            'full_translation_prompt': translation_prompt.format(conversation=joined_bemba)
+        }
+
+    def translate(self, model: str) -> Tuple[List[str], np.ndarray]:
+        """One translation per conversation and the share of words it got right."""
+        translations, accuracy = [], np.empty(len(self.ids))
+        for k, tokens in enumerate(self.english_tokens):
+            sentences, kept, total = [], 0, 0
+            for sentence in tokens:
+                replaced = self.rng.random(len(sentence)) < self.noise[model]
+                sentence = np.where(replaced, self.rng.integers(0, vocabulary_size, size=len(sentence)), sentence)
+                sentences.append(" ".join(self.english_words[sentence]))
+                kept += len(sentence) - replaced.sum()
+                total += len(sentence)
+            translations.append(_join_sentences(sentences).lstrip("\n"))
+            accuracy[k] = kept / total
+        return translations, accuracy
+
+    def verdicts(self, quality_1: np.ndarray, quality_2: np.ndarray, model_1: str, model_2: str) -> List[str]:
+        """Judge verdicts: the better translation wins with a logistic probability, with tie_rate ties."""
+        p_model_1 = 1 / (1 + np.exp(-(quality_1 - quality_2) * 10))
+        draws = self.rng.random(len(quality_1))
+        ties = self.rng.random(len(quality_1)) < tie_rate
+        return np.where(ties, 'tie', np.where(draws < p_model_1, model_1, model_2)).tolist()
+
+
+def generate_scale(name: str, n_models: int, n_conversations: int, opponents_per_model: int, root: str = synthetic_root) -> str:
+    """Write the static, translation, judgment and consistency files of one scale; returns its folder."""
+    rng = np.random.default_rng(seed)
+    scale = SyntheticScale(n_models, n_conversations, opponents_per_model, rng)
+    scale_root = os.path.join(root, name)
+    output = os.path.join(scale_root, "Data", "Output")
+    logging.info(f"Generating {name}: {n_models} models, {n_conversations} conversations, {len(scale.pairs)} judged pairs")
+
+    write_jsonl(
+        os.path.join(scale_root, "Data", "Static", "big_c_conversations_test.jsonl"),
+        ({key: c[key] for key in ('bemba_sentences', 'english_sentences', 'id', 'img_path')} for c in scale.conversations)
+    )
+
+    translations: Dict[str, List[str]] = {}
+    accuracy: Dict[str, np.ndarray] = {}
+    high_temp: Dict[str, List[List[str]]] = {}
+    for model in scale.models:
+        translations[model], accuracy[model] = scale.translate(model)
+        bertscore = 0.80 + 0.15 * accuracy[model] + rng.normal(0, 0.01, size=n_conversations)
+        similarity = 0.75 + 0.2 * accuracy[model] + rng.normal(0, 0.01, size=n_conversations)
+        write_jsonl(
+            os.path.join(output, "translations", f"a_v2_big_c_conversations_test_{model}.jsonl"),
+            ({
+                **conversation,
+                f"{model}_translation": translation,
+                f"{model}_bertscore": float(b),
+                f"{model}_{embedding_model}_similarity": float(s)
+            } for conversation, translation, b, s in zip(scale.conversations, translations[model], bertscore, similarity))
+        )
+        # Two high temperature samples per model for the consistency battles
+        high_temp[model] = []
+        for t_number in (1, 2):
+            samples, _ = scale.translate(model)
+            high_temp[model].append(samples)
+            write_jsonl(
+                os.path.join(output, "translations_high_temp", f"big_c_conversations_test_{model}_t{t_number}.jsonl"),
+                ({**conversation, f"{model}_translation_t{t_number}": sample}
+                 for conversation, sample in zip(scale.conversations, samples))
+            )
+
+    for model_1, model_2 in scale.pairs:
+        judgments = scale.verdicts(accuracy[model_1], accuracy[model_2], model_1, model_2)
+        similarity_1 = 0.75 + 0.2 * accuracy[model_1]
+        similarity_2 = 0.75 + 0.2 * accuracy[model_2]
+        write_jsonl(
+            os.path.join(output, "judgments", f"v2_big_c_test_{model_1}_vs_{model_2}.jsonl"),
+            ({
+                **conversation,
+                f"{model_1}_translation": translations[model_1][k],
+                f"{model_2}_translation": translations[model_2][k],
+                'v1_model': model_1,
+                'v2_model': model_2,
+                'full_judgment_prompt': full_judgment_prompt.format(
+                    conversation=conversation['joined_english_sentences'],
+                    alternate_version_1=translations[model_1][k],
+                    alternate_version_2=translations[model_2][k]
+                ),
+                f"{judgment_model}_judgment": judgments[k],
+                f"{model_1}_similarity_score": float(similarity_1[k]),
+                f"{model_2}_similarity_score": float(similarity_2[k]),
+                'similarity_score_winner': model_1 if similarity_1[k] >= similarity_2[k] else model_2
+            } for k, conversation in enumerate(scale.conversations))
+        )
+
+        # The more consistent model has the lower noise, judged with the same verdict model
+        consistency = scale.verdicts(-np.full(n_conversations, scale.noise[model_1]),
+                                     -np.full(n_conversations, scale.noise[model_2]), model_1, model_2)
+        write_jsonl(
+            os.path.join(output, "consistency_judgments", f"v1_big_c_test_{model_1}_vs_{model_2}.jsonl"),
+            ({
+                **conversation,
+                f"{model_1}_translation_t1": high_temp[model_1][0][k],
+                f"{model_1}_translation_t2": high_temp[model_1][1][k],
+                f"{model_2}_translation_t1": high_temp[model_2][0][k],
+                f"{model_2}_translation_t2": high_temp[model_2][1][k],
+                'v1_model': model_1,
+                'v2_model': model_2,
+                'full_consistency_judgment_prompt': full_consistency_judgment_prompt.format(
+                    model_1_version_1=high_temp[model_1][0][k],
+                    model_1_version_2=high_temp[model_1][1][k],
+                    model_2_version_1=high_temp[model_2][0][k],
+                    model_2_version_2=high_temp[model_2][1][k]
+                ),
+                f"{judgment_model}_consistency_judgment": consistency[k]
+            } for k, conversation in enumerate(scale.conversations))
+        )
+    os.makedirs(os.path.join(output, "prepared_files"), exist_ok=True)
+    return scale_root
+
+
+def selected_scales(default: List[str]) -> List[str]:
+    """The scales named in the SCALES environment variable, comma separated, or default."""
+    scales = os.environ.get("SCALES")
+    return scales.split(",") if scales else default
+
+
+def main():
+    names = selected_scales([name for name, *_ in scale_ladder if name not in opt_in_scales])
+    for name, n_models, n_conversations, opponents_per_model in scale_ladder:
+        if name in names:
+            generate_scale(name, n_models, n_conversations, opponents_per_model)
+
+
+if __name__ == "__main__":
+    main()
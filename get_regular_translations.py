@@ -1,7 +1,6 @@
 import asyncio
 from typing import List
 import pandas as pd
-import json
 from pathlib import Path
 from llm_services.get_gpt_4o_response import get_gpt_4o_response
 from llm_services.get_sonnet_3_point_5_response import get_sonnet_3_point_5_response
@@ -11,9 +10,11 @@ from llm_services.get_aya_8b_response import get_aya_8b_response
 from llm_services.get_aya_32b_response import get_aya_32b_response
 from llm_services.get_llama_3_1_400b_response import get_llama_3_1_400b_response
 from llm_services.get_google_translate_response import get_google_translate_response
+from profiling import profiled
+from jsonl_io import read_jsonl, append_jsonl, appended_path, finish_appended_artifact
 
 def load_data(input_directory: Path, input_file_name: str) -> pd.DataFrame:
-    df = pd.read_json(input_directory / input_file_name, lines=True)
+    df = read_jsonl(input_directory / input_file_name)
     return df
 
 def join_sentences(sentence_list: List[str]) -> str:
@@ -49,6 +50,7 @@ Here is the conversation for you to translate:
     )
     return df
 
+@profiled
 async def get_translations(
         df: pd.DataFrame, 
         llm_service, 
@@ -78,13 +80,14 @@ async def get_translations(
                 df.at[index, f'{llm_service.__name__}_translation_t{t_number}'] = response
 
             # Save the response incrementally to avoid losing progress
-            with output_file_name.open('a') as f:
-                json_line = json.dumps(df.loc[index].to_dict())
-                f.write(f'{json_line}\n')
+            append_jsonl(appended_path(output_file_name), [df.loc[index].to_dict()])
 
         except Exception as e:
             print(f"Error processing index {index}: {e}")
 
+    # Converted to Parquet once complete when ARTIFACT_FORMAT=parquet
+    finish_appended_artifact(output_file_name)
+
 async def get_regular_translations( 
         llm_service
 ) -> str:
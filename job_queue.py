@@ -0,0 +1,205 @@
+import json
+import time
+import sqlite3
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    job_name TEXT PRIMARY KEY,
+    kind TEXT NOT NULL,
+    params TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS tasks (
+    job_name TEXT NOT NULL,
+    task_id TEXT NOT NULL,
+    payload TEXT NOT NULL,
+    status TEXT NOT NULL DEFAULT 'pending',
+    worker TEXT,
+    lease_expires REAL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    error TEXT,
+    PRIMARY KEY (job_name, task_id)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS tasks_by_status ON tasks (status, lease_expires);
+CREATE TABLE IF NOT EXISTS results (
+    job_name TEXT NOT NULL,
+    task_id TEXT NOT NULL,
+    result TEXT NOT NULL,
+    worker TEXT NOT NULL,
+    finished_at REAL NOT NULL,
+    PRIMARY KEY (job_name, task_id)
+) WITHOUT ROWID;
+"""
+
+# Task states
+PENDING, LEASED, DONE, FAILED = 'pending', 'leased', 'done', 'failed'
+
+
+class JobQueue:
+    """
+    Jobs of independent tasks (one translation or judgment row each) shared by any
+    number of worker processes through one SQLite file.
+
+    A worker leases tasks for lease_seconds and has to heartbeat() to keep them. Tasks
+    whose lease ran out, because the worker died or hung, are handed to the next worker
+    that asks. A result is only accepted from the worker that currently holds the lease
+    and is stored once per task, so the results table is free of duplicates even when a
+    slow worker finishes a task that was already reassigned.
+
+    Several machines can share the file on a network filesystem as long as it supports
+    POSIX locks. The rollback journal is used rather than WAL, which needs shared
+    memory on one host, and lease expiry compares wall clocks, so the machines' clocks
+    should be synchronized.
+    """
+
+    def __init__(self, db_path: str, max_attempts: int = 3, timeout: float = 60.0):
+        self.db_path = db_path
+        self.max_attempts = max_attempts
+        # Transactions are opened explicitly with BEGIN IMMEDIATE
+        self.connection = sqlite3.connect(db_path, timeout=timeout, isolation_level=None)
+        self.connection.execute("PRAGMA journal_mode=DELETE")
+        self.connection.executescript(SCHEMA)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def close(self):
+        self.connection.close()
+
+    def _transaction(self):
+        return _ImmediateTransaction(self.connection)
+
+    def submit(self, job_name: str, kind: str, params: dict, tasks: Iterable[Tuple[str, dict]]) -> int:
+        """Add a job and its (task_id, payload) tasks; tasks that already exist are kept. Returns the number added."""
+        with self._transaction() as connection:
+            connection.execute(
+                "INSERT OR IGNORE INTO jobs (job_name, kind, params) VALUES (?, ?, ?)",
+                (job_name, kind, json.dumps(params))
+            )
+            before = connection.total_changes
+            connection.executemany(
+                "INSERT OR IGNORE INTO tasks (job_name, task_id, payload) VALUES (?, ?, ?)",
+                [(job_name, str(task_id), json.dumps(payload)) for task_id, payload in tasks]
+            )
+            return connection.total_changes - before
+
+    def jobs(self) -> Dict[str, Tuple[str, dict]]:
+        """{job_name -> (kind, params)}"""
+        return {
+            job_name: (kind, json.loads(params))
+            for job_name, kind, params in self.connection.execute("SELECT job_name, kind, params FROM jobs")
+        }
+
+    def lease(self, worker: str, n_tasks: int = 1, lease_seconds: float = 120.0,
+              job_names: Optional[List[str]] = None) -> List[Tuple[str, str, dict]]:
+        """
+        Lease up to n_tasks pending or expired tasks, from the given jobs or from any job.
+        Returns (job_name, task_id, payload) tuples.
+        """
+        now = time.time()
+        job_filter = ""
+        job_args = []
+        if job_names is not None:
+            job_filter = f" AND job_name IN ({', '.join('?' * len(job_names))})"
+            job_args = list(job_names)
+        with self._transaction() as connection:
+            # Tasks that used up their attempts on expired leases are given up
+            connection.execute(
+                "UPDATE tasks SET status = ?, error = 'lease expired' "
+                "WHERE status = ? AND lease_expires < ? AND attempts >= ?",
+                (FAILED, LEASED, now, self.max_attempts)
+            )
+            rows = connection.execute(
+                "SELECT job_name, task_id, payload FROM tasks "
+                "WHERE (status = ? OR (status = ? AND lease_expires < ?))" + job_filter +
+                " ORDER BY attempts, job_name, task_id LIMIT ?",
+                [PENDING, LEASED, now] + job_args + [n_tasks]
+            ).fetchall()
+            connection.executemany(
+                "UPDATE tasks SET status = ?, worker = ?, lease_expires = ?, attempts = attempts + 1 "
+                "WHERE job_name = ? AND task_id = ?",
+                [(LEASED, worker, now + lease_seconds, job_name, task_id) for job_name, task_id, _ in rows]
+            )
+        return [(job_name, task_id, json.loads(payload)) for job_name, task_id, payload in rows]
+
+    def heartbeat(self, worker: str, tasks: Iterable[Tuple[str, str]], lease_seconds: float = 120.0) -> int:
+        """Extend the leases this worker still holds on (job_name, task_id); returns how many it holds."""
+        expires = time.time() + lease_seconds
+        with self._transaction() as connection:
+            before = connection.total_changes
+            connection.executemany(
+                "UPDATE tasks SET lease_expires = ? WHERE job_name = ? AND task_id = ? AND status = ? AND worker = ?",
+                [(expires, job_name, task_id, LEASED, worker) for job_name, task_id in tasks]
+            )
+            return connection.total_changes - before
+
+    def complete(self, worker: str, job_name: str, task_id: str, result: dict) -> bool:
+        """Store the result if this worker still holds the lease; returns whether it was accepted."""
+        with self._transaction() as connection:
+            updated = connection.execute(
+                "UPDATE tasks SET status = ?, lease_expires = NULL WHERE job_name = ? AND task_id = ? AND status = ? AND worker = ?",
+                (DONE, job_name, task_id, LEASED, worker)
+            ).rowcount
+            if updated:
+                connection.execute(
+                    "INSERT OR IGNORE INTO results (job_name, task_id, result, worker, finished_at) VALUES (?, ?, ?, ?, ?)",
+                    (job_name, task_id, json.dumps(result), worker, time.time())
+                )
+        return bool(updated)
+
+    def fail(self, worker: str, job_name: str, task_id: str, error: str):
+        """Give the task back for another attempt, or mark it failed after max_attempts."""
+        with self._transaction() as connection:
+            connection.execute(
+                "UPDATE tasks SET status = CASE WHEN attempts >= ? THEN ? ELSE ? END, "
+                "worker = NULL, lease_expires = NULL, error = ? "
+                "WHERE job_name = ? AND task_id = ? AND status = ? AND worker = ?",
+                (self.max_attempts, FAILED, PENDING, error, job_name, task_id, LEASED, worker)
+            )
+
+    def requeue_failed(self, job_name: Optional[str] = None) -> int:
+        """Make the failed tasks of one job, or of all jobs, pending again with fresh attempts; returns how many."""
+        job_filter, job_args = "", []
+        if job_name is not None:
+            job_filter, job_args = " AND job_name = ?", [job_name]
+        with self._transaction() as connection:
+            return connection.execute(
+                "UPDATE tasks SET status = ?, attempts = 0, worker = NULL, lease_expires = NULL, error = NULL "
+                "WHERE status = ?" + job_filter,
+                [PENDING, FAILED] + job_args
+            ).rowcount
+
+    def progress(self, job_name: Optional[str] = None) -> Dict[str, int]:
+        """Number of tasks per status, for one job or all of them."""
+        if job_name is None:
+            rows = self.connection.execute("SELECT status, COUNT(*) FROM tasks GROUP BY status")
+        else:
+            rows = self.connection.execute(
+                "SELECT status, COUNT(*) FROM tasks WHERE job_name = ? GROUP BY status", (job_name,)
+            )
+        counts = {PENDING: 0, LEASED: 0, DONE: 0, FAILED: 0}
+        counts.update(dict(rows))
+        return counts
+
+    def results(self, job_name: str) -> Iterator[Tuple[str, dict]]:
+        for task_id, result in self.connection.execute(
+            "SELECT task_id, result FROM results WHERE job_name = ? ORDER BY task_id", (job_name,)
+        ):
+            yield task_id, json.loads(result)
+
+
+class _ImmediateTransaction:
+    """BEGIN IMMEDIATE takes the write lock up front, so two workers never lease the same task."""
+
+    def __init__(self, connection: sqlite3.Connection):
+        self.connection = connection
+
+    def __enter__(self) -> sqlite3.Connection:
+        self.connection.execute("BEGIN IMMEDIATE")
+        return self.connection
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.connection.execute("COMMIT" if exc_type is None else "ROLLBACK")
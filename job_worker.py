@@ -0,0 +1,200 @@
+import os
+import socket
+import asyncio
+import logging
+import importlib
+from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Optional
+from job_queue import JobQueue
+from get_regular_translations import load_data, prepare_dataframe
+from translation_sweep import call_llm_service, translation_input
+from add_judgments import get_llm_service_function, judgment_winner
+from verdict_log import append_verdict
+from jsonl_io import iter_jsonl, write_artifact, artifact_exists, reference_texts
+from text_store import resolve_texts
+
+logging.basicConfig(level=logging.INFO)
+
+# Shared by every worker; put it on a filesystem all machines can reach
+job_queue_file_path = "./Data/Output/jobs/jobs.sqlite"
+translations_folder = "./Data/Output/translations"
+judgments_folder = "./Data/Output/judgments"
+
+# Rows in flight per worker process
+worker_concurrency = 8
+lease_seconds = 120.0
+# How long an idle worker waits for leases held by other workers to finish or expire
+poll_seconds = 10.0
+# Give the tasks that used up their attempts another round before working
+requeue_failed = False
+
+# Jobs to submit; submitting is idempotent, so every worker can run the same main()
+translation_service_modules = []  # e.g. ["llm_services.get_gemini_response"]
+judgment_files = []  # e.g. ["./Data/Output/judgments/big_c_test_gemini_1_5_pro_vs_gpt_4o.jsonl"]
+judgment_model = "gpt_4o"
+judgment_version_name = "v3"
+
+
+def _service_from_module(module_name: str):
+    module = importlib.import_module(module_name)
+    return getattr(module, module_name.split('.')[-1])
+
+
+def submit_translation_job(queue: JobQueue, service_module: str, t_number: int = None, temperature: float = .3) -> str:
+    """One task per conversation of the test set, for the response function in service_module."""
+    llm_service = _service_from_module(service_module)
+    df = prepare_dataframe(load_data(Path('./Data/Static'), 'big_c_conversations_test.jsonl'))
+    if t_number is None:
+        job_name = f"translations_{llm_service.__name__}"
+        column = f"{llm_service.__name__}_translation"
+        output_file = os.path.join(translations_folder, f"big_c_conversations_test_{llm_service.__name__}.jsonl")
+    else:
+        job_name = f"translations_{llm_service.__name__}_t{t_number}"
+        column = f"{llm_service.__name__}_translation_t{t_number}"
+        output_file = os.path.join("./Data/Output/translations_high_temp", f"big_c_conversations_test_{llm_service.__name__}_t{t_number}.jsonl")
+    params = {'service_module': service_module, 'column': column, 'temperature': temperature, 'output_file': output_file}
+    rows = reference_texts(df.to_dict('records'))
+    added = queue.submit(job_name, 'translation', params, ((row['id'], row) for row in rows))
+    logging.info(f"Submitted {job_name}: {added} new tasks")
+    return job_name
+
+
+def submit_judgment_job(queue: JobQueue, judgments_file_path: str, judgment_model: str, version_name: str) -> str:
+    """One task per row of a prepared judgment file, written like add_judgments once done."""
+    records = list(iter_jsonl(judgments_file_path))
+    v1_model, v2_model = records[0]['v1_model'], records[0]['v2_model']
+    job_name = f"{version_name}_judgments_{v1_model}_vs_{v2_model}"
+    params = {
+        'judgment_model': judgment_model,
+        'v1_model': v1_model,
+        'v2_model': v2_model,
+        'output_file': os.path.join(judgments_folder, f"{version_name}_big_c_test_{v1_model}_vs_{v2_model}.jsonl")
+    }
+    added = queue.submit(job_name, 'judgment', params, ((record['id'], record) for record in reference_texts(records)))
+    logging.info(f"Submitted {job_name}: {added} new tasks")
+    return job_name
+
+
+def run_task(kind: str, params: dict, payload: dict) -> dict:
+    """
+    Do one task in a worker thread; returns the row to store. Texts the payload
+    references are resolved for the call and stay references in the row.
+    """
+    [texts] = resolve_texts([dict(payload)])
+    if kind == 'translation':
+        llm_service = _service_from_module(params['service_module'])
+        response = call_llm_service(llm_service, translation_input(llm_service, texts), params['temperature'])
+        return {**payload, params['column']: response}
+    if kind == 'judgment':
+        judge = get_llm_service_function(params['judgment_model'])
+        response = int(call_llm_service(judge, texts['full_judgment_prompt'], None))
+        winner = judgment_winner(response, params['v1_model'], params['v2_model'])
+        return {**payload, f"{params['judgment_model']}_judgment": winner}
+    raise ValueError(f"Unknown job kind '{kind}'")
+
+
+async def run_worker(queue: JobQueue, worker: str, concurrency: int = worker_concurrency,
+                     job_names: Optional[List[str]] = None):
+    """
+    Lease and run tasks until no job has pending or leased tasks left. The leases of
+    the tasks in flight are renewed every third of lease_seconds; if this process dies,
+    they expire and other workers pick the tasks up.
+    """
+    loop = asyncio.get_running_loop()
+    # SQLite calls wait up to the busy timeout for the write lock, so they run off the
+    # event loop, on a connection of their own that stays on one thread
+    queue_executor = ThreadPoolExecutor(max_workers=1)
+    worker_queue = await loop.run_in_executor(queue_executor, JobQueue, queue.db_path, queue.max_attempts)
+
+    async def call(method, *args):
+        return await loop.run_in_executor(queue_executor, method, *args)
+
+    jobs = await call(worker_queue.jobs)
+    in_flight = set()
+
+    async def heartbeat():
+        while True:
+            await asyncio.sleep(lease_seconds / 3)
+            if in_flight:
+                await call(worker_queue.heartbeat, worker, list(in_flight), lease_seconds)
+
+    async def slot(executor: ThreadPoolExecutor):
+        nonlocal jobs
+        while True:
+            leased = await call(worker_queue.lease, worker, 1, lease_seconds, job_names)
+            if not leased:
+                progress = await call(worker_queue.progress)
+                if progress['pending'] == 0 and progress['leased'] == 0:
+                    return
+                await asyncio.sleep(poll_seconds)
+                continue
+            job_name, task_id, payload = leased[0]
+            if job_name not in jobs:
+                jobs = await call(worker_queue.jobs)
+            kind, params = jobs[job_name]
+            in_flight.add((job_name, task_id))
+            try:
+                result = await loop.run_in_executor(executor, run_task, kind, params, payload)
+                if await call(worker_queue.complete, worker, job_name, task_id, result):
+                    if kind == 'judgment':
+                        # Publish the verdict for the live leaderboard, once per task
+                        append_verdict('judgment_battles', payload['id'], params['v1_model'], params['v2_model'],
+                                       result[f"{params['judgment_model']}_judgment"])
+                else:
+                    logging.warning(f"Lease on {job_name}/{task_id} was lost; result discarded")
+            except Exception as e:
+                logging.error(f"Error processing {job_name}/{task_id}: {e}")
+                await call(worker_queue.fail, worker, job_name, task_id, str(e))
+            finally:
+                in_flight.discard((job_name, task_id))
+
+    heartbeat_task = asyncio.create_task(heartbeat())
+    try:
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            await asyncio.gather(*(slot(executor) for _ in range(concurrency)))
+    finally:
+        heartbeat_task.cancel()
+        await call(worker_queue.close)
+        queue_executor.shutdown()
+
+
+def export_finished_jobs(queue: JobQueue):
+    """
+    Write the output file of every job whose tasks are all done, if it doesn't exist
+    yet. A job with failed tasks is not written, since its file would be taken as
+    complete; requeue_failed gives those tasks another round of attempts.
+    """
+    for job_name, (kind, params) in queue.jobs().items():
+        progress = queue.progress(job_name)
+        output_file = params['output_file']
+        if progress['pending'] or progress['leased'] or artifact_exists(output_file):
+            continue
+        if progress['failed']:
+            logging.warning(f"{job_name}: {progress['failed']} tasks failed; not writing {output_file}. "
+                            f"Set requeue_failed = True to retry them.")
+            continue
+        rows = sorted((result for _, result in queue.results(job_name)), key=lambda row: row['id'])
+        # Several workers may finish at once; each writes its own temporary file and renames it
+        write_artifact(output_file, rows)
+        logging.info(f"{job_name}: {len(rows)} rows written to {output_file}")
+
+
+def main():
+    os.makedirs(os.path.dirname(job_queue_file_path), exist_ok=True)
+    worker = f"{socket.gethostname()}-{os.getpid()}"
+    with JobQueue(job_queue_file_path) as queue:
+        for service_module in translation_service_modules:
+            submit_translation_job(queue, service_module)
+        for judgments_file_path in judgment_files:
+            submit_judgment_job(queue, judgments_file_path, judgment_model, judgment_version_name)
+        if requeue_failed:
+            logging.info(f"Requeued {queue.requeue_failed()} failed tasks")
+        logging.info(f"Worker {worker} starting: {queue.progress()}")
+        asyncio.run(run_worker(queue, worker))
+        export_finished_jobs(queue)
+        logging.info(f"Worker {worker} done: {queue.progress()}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,539 @@
+import os
+import json
+import logging
+import itertools
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+import numpy as np
+from text_store import TEXT_REFERENCE_PREFIX, deduplicate_texts, resolve_texts
+
+try:
+    import orjson
+
+    def loads(line: bytes):
+        return orjson.loads(line)
+
+    def dumps(obj, indent: bool = False) -> bytes:
+        option = orjson.OPT_NON_STR_KEYS | orjson.OPT_SERIALIZE_NUMPY
+        if indent:
+            option |= orjson.OPT_INDENT_2
+        return orjson.dumps(obj, option=option)
+except ImportError:
+    def _default(obj):
+        if isinstance(obj, np.generic):
+            return obj.item()
+        if isinstance(obj, np.ndarray):
+            return obj.tolist()
+        raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
+
+    def loads(line: bytes):
+        return json.loads(line)
+
+    def dumps(obj, indent: bool = False) -> bytes:
+        return json.dumps(obj, indent=2 if indent else None, ensure_ascii=False, default=_default).encode('utf-8')
+
+logging.basicConfig(level=logging.INFO)
+
+# Read and write buffer of the JSONL files
+buffer_size = 1 << 20
+
+# Format the translation, score and judgment stages write their outputs in: 'jsonl', or
+# 'parquet' (zstd-compressed, dictionary-encoded columns; needs pyarrow). Set
+# ARTIFACT_FORMAT=parquet to switch a run. Readers take either, whatever the setting.
+ARTIFACT_FORMATS = ['jsonl', 'parquet']
+artifact_format = os.environ.get("ARTIFACT_FORMAT", "jsonl")
+parquet_compression = "zstd"
+parquet_row_group_size = 10_000
+# Set TEXT_STORE=1 to have the stages store the long strings of their outputs once in
+# text_store.py's shared table, and write references to them. Readers resolve
+# references whatever the setting.
+text_store_enabled = os.environ.get("TEXT_STORE") == "1"
+
+
+def _import_pyarrow():
+    # pyarrow is optional and heavy; it is imported when a Parquet file is first touched
+    try:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+    except ImportError as e:
+        raise ImportError("pyarrow is required for Parquet artifacts. Install it with: pip install pyarrow") from e
+    return pa, pq
+
+
+def parquet_path(file_path) -> str:
+    """The Parquet sibling of a .jsonl path."""
+    return os.path.splitext(str(file_path))[0] + ".parquet"
+
+
+def artifact_path(file_path) -> str:
+    """
+    The file to read for an artifact named by its .jsonl path: the JSONL file if it
+    exists, else its Parquet sibling if that exists, else the path unchanged.
+    """
+    file_path = str(file_path)
+    if file_path.endswith(".jsonl") and not os.path.exists(file_path):
+        candidate = parquet_path(file_path)
+        if os.path.exists(candidate):
+            return candidate
+    return file_path
+
+
+def appended_path(file_path) -> str:
+    """
+    The file rows saved one at a time are appended to, for an artifact named by its
+    .jsonl path: the JSONL file itself, or with ARTIFACT_FORMAT=parquet a separate
+    .partial.jsonl file, so that a JSONL export of the Parquet file is never taken for
+    appended rows.
+    """
+    file_path = str(file_path)
+    if artifact_format == 'parquet':
+        return os.path.splitext(file_path)[0] + ".partial.jsonl"
+    return file_path
+
+
+def artifact_exists(file_path) -> bool:
+    return os.path.exists(artifact_path(file_path))
+
+
+def remove_artifact(file_path):
+    """Remove an artifact in either format."""
+    for path in (str(file_path), parquet_path(file_path)):
+        if os.path.exists(path):
+            os.remove(path)
+
+
+def list_artifacts(folder: str, prefix: str, suffix: str = "") -> List[Tuple[str, str]]:
+    """
+    (file_path, name) of the artifacts {prefix}{name}{suffix}.jsonl or .parquet in
+    folder, sorted by file name. Where both formats exist, the JSONL file is listed.
+    """
+    found = {}
+    for filename in os.listdir(folder):
+        stem, extension = os.path.splitext(filename)
+        if extension not in (".jsonl", ".parquet") or not stem.startswith(prefix) or not stem.endswith(suffix):
+            continue
+        name = stem[len(prefix):len(stem) - len(suffix)]
+        if name not in found or extension == ".jsonl":
+            found[name] = os.path.join(folder, filename)
+    return sorted(((file_path, name) for name, file_path in found.items()), key=lambda item: os.path.basename(item[0]))
+
+
+def iter_jsonl(file_path: str, columns: Optional[List[str]] = None) -> Iterator[dict]:
+    """
+    Stream the records of a JSONL file, parsing each line once. With columns, each
+    record holds only those keys, None where a line lacks one, so the rest of the
+    line is dropped as soon as it is parsed. A Parquet artifact is streamed by row
+    group, reading only the columns asked for. Text references are resolved from the
+    text store.
+    """
+    file_path = artifact_path(file_path)
+    if file_path.endswith(".parquet"):
+        yield from resolve_texts(_iter_parquet(file_path, columns))
+    else:
+        yield from resolve_texts(_iter_jsonl_lines(file_path, columns))
+
+
+def _iter_jsonl_lines(file_path: str, columns: Optional[List[str]] = None) -> Iterator[dict]:
+    with open(file_path, 'rb', buffering=buffer_size) as f:
+        for line in f:
+            if not line.strip():
+                continue
+            record = loads(line)
+            if columns is not None:
+                record = {column: record.get(column) for column in columns}
+            yield record
+
+
+def _iter_parquet(file_path: str, columns: Optional[List[str]] = None) -> Iterator[dict]:
+    _, pq = _import_pyarrow()
+    parquet_file = pq.ParquetFile(file_path)
+    names = parquet_file.schema_arrow.names
+    present = None if columns is None else [column for column in columns if column in names]
+    for batch in parquet_file.iter_batches(columns=present):
+        for record in batch.to_pylist():
+            if columns is not None:
+                record = {column: record.get(column) for column in columns}
+            yield record
+
+
+def _columns(records: Iterable[dict]) -> Dict[str, list]:
+    """One list per key, in order of first appearance; None where a record lacks the key."""
+    data = {}
+    n_rows = 0
+    for record in records:
+        for column, value in record.items():
+            if column not in data:
+                data[column] = [None] * n_rows
+            data[column].append(value)
+        n_rows += 1
+        for values in data.values():
+            if len(values) < n_rows:
+                values.append(None)
+    return data
+
+
+def read_columns(file_path: str, columns: Optional[List[str]] = None) -> Dict[str, list]:
+    """
+    The file as one list per column. Without columns, every key seen is a column, in
+    order of first appearance; rows without a key get None, as pd.read_json gives NaN.
+    """
+    if columns is not None:
+        data = {column: [] for column in columns}
+        for record in iter_jsonl(file_path, columns):
+            for column, values in data.items():
+                values.append(record.get(column))
+        return data
+    return _columns(iter_jsonl(file_path))
+
+
+def read_jsonl(
+    file_path: str,
+    columns: Optional[List[str]] = None,
+    dtypes: Optional[Dict[str, str]] = None,
+    as_arrow: bool = False,
+    nrows: Optional[int] = None
+):
+    """
+    Read a JSONL file into a DataFrame, or a pyarrow Table with as_arrow=True.
+
+    Replaces pd.read_json(file_path, lines=True): the lines are parsed one at a time
+    straight into columns, so neither the whole text nor a frame of every field is
+    held at once when only some columns are asked for. dtypes casts columns after
+    loading, e.g. {'id': 'int64'}. Parquet artifacts are read with only the columns
+    asked for. nrows reads only the first rows, as in pd.read_json.
+    """
+    # pandas and pyarrow are imported here, so the compile workers that only stream
+    # records do not load them
+    file_path = artifact_path(file_path)
+    if nrows is not None:
+        df = records_to_frame(itertools.islice(iter_jsonl(file_path, columns), nrows))
+        return df.astype(dtypes) if dtypes else df
+    if file_path.endswith(".parquet"):
+        table = _resolve_table(_read_parquet(file_path, columns))
+    elif as_arrow:
+        pa, _ = _import_pyarrow()
+        table = pa.table(read_columns(file_path, columns))
+    else:
+        table = None
+    if as_arrow:
+        if dtypes:
+            pa, _ = _import_pyarrow()
+            schema = pa.schema([
+                pa.field(name, pa.from_numpy_dtype(np.dtype(dtypes[name])) if name in dtypes else table.schema.field(name).type)
+                for name in table.column_names
+            ])
+            table = table.cast(schema)
+        return table
+    import pandas as pd
+    if table is not None:
+        df = table.to_pandas()
+        # Lists come back as numpy arrays; keep them lists, as in the JSONL records
+        for name in table.column_names:
+            if _is_list_type(table.schema.field(name).type):
+                df[name] = table.column(name).to_pylist()
+    else:
+        df = pd.DataFrame(read_columns(file_path, columns))
+    if dtypes:
+        df = df.astype(dtypes)
+    return df
+
+
+def records_to_frame(records: Iterable[dict], columns: Optional[List[str]] = None):
+    """A DataFrame of records, as read_jsonl builds it; columns lists the columns even if there are no records."""
+    import pandas as pd
+    if columns is None:
+        return pd.DataFrame(_columns(records))
+    records = list(records)
+    return pd.DataFrame({column: [record.get(column) for record in records] for column in columns})
+
+
+def read_jsonl_shards(file_path: str, shard_size: int, columns: Optional[List[str]] = None) -> Iterator:
+    """read_jsonl in DataFrames of shard_size rows, so only one shard is in memory at a time."""
+    records = iter_jsonl(file_path, columns)
+    while True:
+        shard = list(itertools.islice(records, shard_size))
+        if not shard:
+            return
+        yield records_to_frame(shard)
+
+
+def _is_list_type(arrow_type) -> bool:
+    pa, _ = _import_pyarrow()
+    return pa.types.is_list(arrow_type) or pa.types.is_large_list(arrow_type)
+
+
+def _read_parquet(file_path: str, columns: Optional[List[str]] = None):
+    """The Parquet file's table, with only the columns asked for; missing ones are null."""
+    pa, pq = _import_pyarrow()
+    if columns is None:
+        return pq.read_table(file_path)
+    names = pq.read_schema(file_path).names
+    table = pq.read_table(file_path, columns=[column for column in columns if column in names])
+    for column in columns:
+        if column not in names:
+            table = table.append_column(column, pa.nulls(table.num_rows))
+    return table.select(columns)
+
+
+def _resolve_table(table):
+    """The table with the text references in its string columns resolved."""
+    pa, _ = _import_pyarrow()
+    import pyarrow.compute as pc
+    for i, name in enumerate(table.column_names):
+        column = table.column(name)
+        if not pa.types.is_string(column.type) or not pc.any(pc.starts_with(column, TEXT_REFERENCE_PREFIX)).as_py():
+            continue
+        values = [record[name] for record in resolve_texts({name: value} for value in column.to_pylist())]
+        table = table.set_column(i, name, pa.array(values, pa.string()))
+    return table
+
+
+def _dataframe_records(df) -> Iterator[dict]:
+    """Rows of a DataFrame as dicts of Python values, with None for NaN, one row at a time."""
+    columns = [str(column) for column in df.columns]
+    values = [df[column].astype(object).where(df[column].notna(), None).tolist() for column in df.columns]
+    for row in zip(*values):
+        yield dict(zip(columns, row))
+
+
+def write_jsonl(file_path: str, records):
+    """
+    Write records, or the rows of a DataFrame, as JSONL. Values keep their type: ids
+    stay integers and floats keep full precision, where df.to_json rounds them to 10
+    digits. The file is written to a temporary file next to it and renamed into place,
+    so a stage that checks whether its output exists never sees a partial file.
+    """
+    import pandas as pd
+    if isinstance(records, pd.DataFrame):
+        records = _dataframe_records(records)
+    directory = os.path.dirname(file_path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    temporary_file_path = f"{file_path}.{os.getpid()}.tmp"
+    try:
+        with open(temporary_file_path, 'wb', buffering=buffer_size) as f:
+            for record in records:
+                f.write(dumps(record))
+                f.write(b"\n")
+        os.replace(temporary_file_path, file_path)
+    except BaseException:
+        if os.path.exists(temporary_file_path):
+            os.remove(temporary_file_path)
+        raise
+
+
+def reference_texts(records) -> Iterable[dict]:
+    """
+    Records, or the rows of a DataFrame, with their long strings moved to the text store
+    and referenced when text_store_enabled; otherwise records unchanged.
+    """
+    if not text_store_enabled:
+        return records
+    import pandas as pd
+    if isinstance(records, pd.DataFrame):
+        records = _dataframe_records(records)
+    return deduplicate_texts(records)
+
+
+def append_jsonl(file_path: str, records: Iterable[dict]):
+    """Append records to a JSONL file, for rows saved one by one as they finish."""
+    # Listed first, so the texts are committed before the rows that reference them are written
+    records = list(reference_texts(records))
+    with open(file_path, 'ab') as f:
+        f.write(b"".join(dumps(record) + b"\n" for record in records))
+
+
+def _arrow_table(records):
+    """
+    A pyarrow Table of records or a DataFrame. Columns mixing types, such as a verdict
+    column holding both model names and raw answers, are stored as strings.
+    """
+    pa, _ = _import_pyarrow()
+    import pandas as pd
+    if isinstance(records, pd.DataFrame):
+        try:
+            return pa.Table.from_pandas(records, preserve_index=False)
+        except (pa.ArrowInvalid, pa.ArrowTypeError):
+            data = {
+                str(column): records[column].astype(object).where(records[column].notna(), None).tolist()
+                for column in records.columns
+            }
+    else:
+        data = _columns(records)
+    arrays = {}
+    for column, values in data.items():
+        try:
+            arrays[column] = pa.array(values)
+        except (pa.ArrowInvalid, pa.ArrowTypeError):
+            logging.warning(f"Column '{column}' mixes types; storing it as strings.")
+            arrays[column] = pa.array([None if value is None else str(value) for value in values], pa.string())
+    return pa.table(arrays)
+
+
+def write_parquet(file_path: str, records):
+    """Write records, or the rows of a DataFrame, as a zstd-compressed, dictionary-encoded Parquet file."""
+    _, pq = _import_pyarrow()
+    table = _arrow_table(records)
+    directory = os.path.dirname(file_path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    temporary_file_path = f"{file_path}.{os.getpid()}.tmp"
+    try:
+        pq.write_table(
+            table, temporary_file_path, compression=parquet_compression,
+            use_dictionary=True, row_group_size=parquet_row_group_size
+        )
+        os.replace(temporary_file_path, file_path)
+    except BaseException:
+        if os.path.exists(temporary_file_path):
+            os.remove(temporary_file_path)
+        raise
+
+
+def write_artifact(file_path, records) -> str:
+    """
+    Write a stage output named by its .jsonl path in artifact_format, and remove a copy
+    of it in the other format. With text_store_enabled, its long strings go to the text
+    store and the file holds references. Returns the path written: file_path itself,
+    or its Parquet sibling.
+    """
+    if artifact_format not in ARTIFACT_FORMATS:
+        raise ValueError(f"Unknown artifact format '{artifact_format}'. Expected one of {ARTIFACT_FORMATS}.")
+    file_path = str(file_path)
+    written, other = (parquet_path(file_path), file_path) if artifact_format == 'parquet' else (file_path, parquet_path(file_path))
+    records = reference_texts(records)
+    if artifact_format == 'parquet':
+        write_parquet(written, records)
+    else:
+        write_jsonl(written, records)
+    if os.path.exists(other):
+        os.remove(other)
+    return written
+
+
+def finish_appended_artifact(file_path, sort_key=None) -> str:
+    """
+    Rows saved one at a time are appended to appended_path(file_path). Once a run is
+    done, this merges them after the rows an earlier run left in the artifact, keeps
+    the first row of each id, sorts them by sort_key if given, and writes the artifact
+    in artifact_format. Returns the artifact's path.
+    """
+    file_path = str(file_path)
+    appended = appended_path(file_path)
+    if appended != file_path:
+        if not os.path.exists(appended):
+            # Nothing was appended: the artifact, and a JSONL export of it, stay as they are
+            return artifact_path(file_path)
+        earlier = parquet_path(file_path) if os.path.exists(parquet_path(file_path)) else file_path
+        sources = [path for path in (earlier, appended) if os.path.exists(path)]
+    else:
+        sources = [path for path in (parquet_path(file_path), file_path) if os.path.exists(path)]
+        if not sources or (sources == [file_path] and sort_key is None):
+            return artifact_path(file_path)
+    records = []
+    seen_ids = set()
+    for path in sources:
+        for record in iter_jsonl(path):
+            # A JSONL file next to the Parquet file may be an export of it, repeating its rows
+            if 'id' in record:
+                if record['id'] in seen_ids:
+                    continue
+                seen_ids.add(record['id'])
+            records.append(record)
+    if sort_key is not None:
+        records.sort(key=sort_key)
+    written = write_artifact(file_path, records)
+    if appended != file_path:
+        os.remove(appended)
+    return written
+
+
+def concat_artifacts(file_paths: List[str], output_path) -> str:
+    """
+    Concatenate artifacts into the artifact output_path, in artifact_format, without
+    holding them in memory: JSONL lines are copied as they are, and Parquet is written
+    one row group at a time, after a first pass that unifies the row groups' schemas.
+    Text references are copied, not resolved. Returns the path written.
+    """
+    if artifact_format not in ARTIFACT_FORMATS:
+        raise ValueError(f"Unknown artifact format '{artifact_format}'. Expected one of {ARTIFACT_FORMATS}.")
+    output_path = str(output_path)
+    written, other = (parquet_path(output_path), output_path) if artifact_format == 'parquet' else (output_path, parquet_path(output_path))
+    directory = os.path.dirname(written)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+
+    def source_records(file_path):
+        file_path = artifact_path(file_path)
+        return _iter_parquet(file_path) if file_path.endswith(".parquet") else _iter_jsonl_lines(file_path)
+
+    def row_groups():
+        records = itertools.chain.from_iterable(source_records(file_path) for file_path in file_paths)
+        while True:
+            batch = list(itertools.islice(records, parquet_row_group_size))
+            if not batch:
+                return
+            yield _arrow_table(batch)
+
+    temporary_file_path = f"{written}.{os.getpid()}.tmp"
+    try:
+        if artifact_format == 'parquet':
+            pa, pq = _import_pyarrow()
+            # A column that is all null in one row group takes its type from the others
+            schemas = [table.schema for table in row_groups()]
+            schema = pa.unify_schemas(schemas, promote_options='permissive') if schemas else pa.schema([])
+            with pq.ParquetWriter(temporary_file_path, schema, compression=parquet_compression, use_dictionary=True) as writer:
+                for table in row_groups():
+                    for name in schema.names:
+                        if name not in table.column_names:
+                            table = table.append_column(name, pa.nulls(table.num_rows))
+                    writer.write_table(table.select(schema.names).cast(schema))
+        else:
+            with open(temporary_file_path, 'wb', buffering=buffer_size) as output:
+                for file_path in map(artifact_path, file_paths):
+                    if file_path.endswith(".parquet"):
+                        for record in _iter_parquet(file_path):
+                            output.write(dumps(record) + b"\n")
+                        continue
+                    with open(file_path, 'rb', buffering=buffer_size) as f:
+                        for line in f:
+                            if line.strip():
+                                output.write(line if line.endswith(b"\n") else line + b"\n")
+        os.replace(temporary_file_path, written)
+    except BaseException:
+        if os.path.exists(temporary_file_path):
+            os.remove(temporary_file_path)
+        raise
+    if os.path.exists(other):
+        os.remove(other)
+    return written
+
+
+def export_jsonl(file_path: str) -> str:
+    """Write a JSONL copy of a Parquet artifact next to it, for the frontend. Returns its path."""
+    output_file = os.path.splitext(file_path)[0] + ".jsonl"
+    write_jsonl(output_file, iter_jsonl(file_path))
+    return output_file
+
+
+# Artifact folders exported by main()
+export_folders = [
+    "./Data/Output/translations",
+    "./Data/Output/translations_high_temp",
+    "./Data/Output/judgments",
+    "./Data/Output/consistency_judgments"
+]
+
+
+def main():
+    """Export every Parquet artifact without a JSONL copy to JSONL."""
+    for folder in export_folders:
+        if not os.path.isdir(folder):
+            continue
+        for filename in sorted(os.listdir(folder)):
+            file_path = os.path.join(folder, filename)
+            if filename.endswith(".parquet") and not os.path.exists(os.path.splitext(file_path)[0] + ".jsonl"):
+                logging.info(f"Exported {export_jsonl(file_path)}")
+
+
+if __name__ == "__main__":
+    main()
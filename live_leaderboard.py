@@ -0,0 +1,168 @@
+import os
+import json
+import time
+import logging
+import numpy as np
+from battle_store import BattleStore
+from bradley_terry import fit_bradley_terry, to_elo_scale
+from create_elo_ratings import PRIOR_GAMES, battles_file_path, output_elo_file_path
+from verdict_log import VerdictLogTail, verdict_log_file_path
+
+logging.basicConfig(level=logging.INFO)
+
+# Ratings are published at most once per SNAPSHOT_INTERVAL seconds, and only if they changed
+SNAPSHOT_INTERVAL = 10.0
+POLL_INTERVAL = 1.0
+
+
+class LiveLeaderboard:
+    """
+    Ratings that follow the verdict log as it grows.
+
+    Starts from the head-to-head counts of the compiled battle store, then adds the
+    verdicts of the log, read from its start and followed as it grows. A verdict counts
+    once per battle type, id and model pair: battles already in the store and verdicts
+    logged again by a rerun are skipped. Battle types that received verdicts are
+    refitted with the Bradley-Terry model of create_elo_ratings.py, warm-started from
+    their previous ratings, so a refit only takes a few iterations.
+    """
+
+    def __init__(self, battles_file_path: str = None, verdict_log_path: str = verdict_log_file_path):
+        self.models = []
+        self.battles = None
+        self.wins = {}  # battle_type -> (n_models, n_models) win counts
+        self.ties = {}  # battle_type -> (n_models, n_models) tie counts, symmetric
+        self.log10_strength = {}  # battle_type -> log10 strength per model
+        self._counted = {}  # battle_type -> {(id, model index, model index)} already counted
+        self._dirty = set()
+
+        if battles_file_path is not None and os.path.exists(battles_file_path):
+            self.battles = BattleStore.load(battles_file_path)
+            self.models = list(self.battles.models)
+            for battle_type in self.battles.battle_types:
+                wins, ties = self.battles.head_to_head(battle_type)
+                self.wins[battle_type] = wins.astype(float)
+                self.ties[battle_type] = ties.astype(float)
+                self.log10_strength[battle_type] = np.zeros(len(self.models))
+                self._dirty.add(battle_type)
+        # The whole log is replayed: verdicts already compiled into the store are skipped
+        self.tail = VerdictLogTail(verdict_log_path, from_start=True)
+        self.refit()
+
+    def _model_index(self, model: str) -> int:
+        if model not in self.models:
+            logging.info(f"New model: {model}")
+            self.models.append(model)
+            for battle_type in self.wins:
+                self.wins[battle_type] = np.pad(self.wins[battle_type], ((0, 1), (0, 1)))
+                self.ties[battle_type] = np.pad(self.ties[battle_type], ((0, 1), (0, 1)))
+                self.log10_strength[battle_type] = np.append(self.log10_strength[battle_type], 0.0)
+        return self.models.index(model)
+
+    def _battle_type(self, battle_type: str):
+        if battle_type not in self.wins:
+            n_models = len(self.models)
+            self.wins[battle_type] = np.zeros((n_models, n_models))
+            self.ties[battle_type] = np.zeros((n_models, n_models))
+            self.log10_strength[battle_type] = np.zeros(n_models)
+
+    def _counted_battles(self, battle_type: str) -> set:
+        """Keys of the battles counted for a battle type, seeded from the store on first use."""
+        if battle_type not in self._counted:
+            counted = set()
+            if self.battles is not None and battle_type in self.battles.battle_types:
+                id_indices, model_1, model_2, _ = self.battles.select(battle_type)
+                counted = set(zip(
+                    self.battles.ids[id_indices].tolist(),
+                    np.minimum(model_1, model_2).tolist(),
+                    np.maximum(model_1, model_2).tolist()
+                ))
+            self._counted[battle_type] = counted
+        return self._counted[battle_type]
+
+    def add_verdict(self, verdict: dict) -> bool:
+        """Count a verdict; returns False if its battle was already counted."""
+        battle_type = verdict['battle_type']
+        counted = self._counted_battles(battle_type)
+        self._battle_type(battle_type)
+        i = self._model_index(verdict['model_1'])
+        j = self._model_index(verdict['model_2'])
+        key = (int(verdict['id']), min(i, j), max(i, j))
+        if key in counted:
+            return False
+        counted.add(key)
+        if verdict['winner'] == verdict['model_1']:
+            self.wins[battle_type][i, j] += 1
+        elif verdict['winner'] == verdict['model_2']:
+            self.wins[battle_type][j, i] += 1
+        else:
+            self.ties[battle_type][i, j] += 1
+            self.ties[battle_type][j, i] += 1
+        self._dirty.add(battle_type)
+        return True
+
+    def poll(self) -> int:
+        """Add the verdicts appended since the last poll; returns how many were new."""
+        return sum(self.add_verdict(verdict) for verdict in self.tail.read_new())
+
+    def refit(self):
+        """Refit the battle types that received verdicts since the last refit."""
+        for battle_type in self._dirty:
+            wins, ties = self.wins[battle_type], self.ties[battle_type]
+            played = np.flatnonzero((wins + wins.T + ties).sum(axis=1) > 0)
+            if len(played) == 0:
+                continue
+            log10_strength, _ = fit_bradley_terry(
+                wins[np.ix_(played, played)], ties[np.ix_(played, played)],
+                prior_games=PRIOR_GAMES,
+                initial_log10_strength=self.log10_strength[battle_type][played]
+            )
+            self.log10_strength[battle_type][played] = log10_strength
+        self._dirty.clear()
+
+    def rankings(self) -> dict:
+        """Current ratings in the format of elo_rankings.json."""
+        elo_rankings = {}
+        for battle_type in self.wins:
+            wins, ties = self.wins[battle_type], self.ties[battle_type]
+            played = np.flatnonzero((wins + wins.T + ties).sum(axis=1) > 0)
+            ratings = to_elo_scale(self.log10_strength[battle_type])
+            elo_ratings = {self.models[m]: float(ratings[m]) for m in played}
+            elo_rankings[battle_type] = dict(sorted(elo_ratings.items(), key=lambda item: item[1], reverse=True))
+        return elo_rankings
+
+    def write_snapshot(self, file_path: str):
+        # Write to a temporary file and rename, so readers never see a partial file
+        temporary_file_path = f"{file_path}.tmp"
+        with open(temporary_file_path, 'w') as f:
+            json.dump(self.rankings(), f, indent=2)
+        os.replace(temporary_file_path, file_path)
+
+    def run(self, output_file_path: str, snapshot_interval: float = SNAPSHOT_INTERVAL, poll_interval: float = POLL_INTERVAL):
+        """Follow the log until interrupted, publishing a snapshot at most every snapshot_interval seconds."""
+        self.write_snapshot(output_file_path)
+        last_snapshot = time.monotonic()
+        pending = 0
+        try:
+            while True:
+                pending += self.poll()
+                if pending and time.monotonic() - last_snapshot >= snapshot_interval:
+                    self.refit()
+                    self.write_snapshot(output_file_path)
+                    logging.info(f"Published ratings after {pending} new verdicts")
+                    last_snapshot = time.monotonic()
+                    pending = 0
+                time.sleep(poll_interval)
+        except KeyboardInterrupt:
+            if pending:
+                self.refit()
+                self.write_snapshot(output_file_path)
+
+
+def main():
+    leaderboard = LiveLeaderboard(battles_file_path, verdict_log_file_path)
+    leaderboard.run(output_elo_file_path)
+
+
+if __name__ == "__main__":
+    main()
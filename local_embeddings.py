@@ -0,0 +1,93 @@
+import asyncio
+import logging
+from typing import List
+import numpy as np
+import torch
+from transformers import AutoTokenizer, AutoModel
+
+logging.basicConfig(level=logging.INFO)
+
+DEFAULT_LOCAL_EMBEDDING_MODEL = 'sentence-transformers/all-MiniLM-L6-v2'
+
+
+class LocalEmbeddingBackend:
+    """
+    Embeds documents on the CPU with a sentence-transformers checkpoint.
+
+    Texts are sorted by length and run through the model in batches of
+    `batch_size` so padding stays small, and token embeddings are mean pooled
+    into one normalized vector per text. Set `use_onnx` to run the encoder with
+    ONNX Runtime (needs `optimum[onnxruntime]`) or `quantize_int8` to apply
+    dynamic int8 quantization to the PyTorch model's linear layers.
+    """
+
+    def __init__(
+        self,
+        model: str = DEFAULT_LOCAL_EMBEDDING_MODEL,
+        batch_size: int = 64,
+        max_length: int = 256,
+        use_onnx: bool = False,
+        quantize_int8: bool = False,
+        num_threads: int = None
+    ):
+        self.model_name = model
+        self.batch_size = batch_size
+        self.max_length = max_length
+        self.use_onnx = use_onnx
+        if num_threads is not None:
+            torch.set_num_threads(num_threads)
+
+        self.tokenizer = AutoTokenizer.from_pretrained(model)
+        if use_onnx:
+            try:
+                from optimum.onnxruntime import ORTModelForFeatureExtraction
+            except ImportError as e:
+                raise ImportError("ONNX Runtime backend requires 'optimum[onnxruntime]' to be installed.") from e
+            self.model = ORTModelForFeatureExtraction.from_pretrained(model, export=True)
+        else:
+            self.model = AutoModel.from_pretrained(model)
+            self.model.eval()
+            if quantize_int8:
+                self.model = torch.quantization.quantize_dynamic(
+                    self.model, {torch.nn.Linear}, dtype=torch.qint8
+                )
+
+    @property
+    def name(self) -> str:
+        """Short model name used in column and battle type names, e.g. 'all-MiniLM-L6-v2'."""
+        return self.model_name.split('/')[-1]
+
+    def _embed_batch(self, texts: List[str]) -> np.ndarray:
+        encoded = self.tokenizer(
+            texts,
+            padding=True,
+            truncation=True,
+            max_length=self.max_length,
+            return_tensors='pt'
+        )
+        with torch.inference_mode():
+            output = self.model(**encoded)
+        token_embeddings = output.last_hidden_state
+        mask = encoded['attention_mask'].unsqueeze(-1).to(token_embeddings.dtype)
+        pooled = (token_embeddings * mask).sum(dim=1) / mask.sum(dim=1).clamp(min=1e-9)
+        pooled = torch.nn.functional.normalize(pooled, p=2, dim=1)
+        return pooled.cpu().numpy()
+
+    def embed_documents_sync(self, texts: List[str]) -> np.ndarray:
+        texts = [str(text) if text is not None else '' for text in texts]
+        order = np.argsort([len(text) for text in texts], kind='stable')
+        embeddings = None
+        for start in range(0, len(texts), self.batch_size):
+            batch_indices = order[start:start + self.batch_size]
+            batch = self._embed_batch([texts[i] for i in batch_indices])
+            if embeddings is None:
+                embeddings = np.empty((len(texts), batch.shape[1]), dtype=np.float32)
+            embeddings[batch_indices] = batch
+        if embeddings is None:
+            return np.empty((0, 0), dtype=np.float32)
+        return embeddings
+
+    async def embed_documents(self, texts: List[str]) -> np.ndarray:
+        # Same interface as AsyncEmbeddingClient; inference runs off the event loop
+        loop = asyncio.get_event_loop()
+        return await loop.run_in_executor(None, self.embed_documents_sync, texts)
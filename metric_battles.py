@@ -0,0 +1,60 @@
+from typing import Dict, List, Tuple
+import numpy as np
+
+
+def build_score_matrix(model_scores: Dict[str, Dict[str, dict]], models: List[str], ids: List[str], score_key: str) -> np.ndarray:
+    """
+    Gather one score per (model, id) into a float array of shape (n_models, n_ids).
+    Missing scores are NaN.
+    """
+    scores = np.full((len(models), len(ids)), np.nan)
+    id_index = {id_str: k for k, id_str in enumerate(ids)}
+    for m, model in enumerate(models):
+        for id_str, model_id_scores in model_scores.get(model, {}).items():
+            value = model_id_scores.get(score_key)
+            if value is not None and id_str in id_index:
+                scores[m, id_index[id_str]] = value
+    return scores
+
+
+def pairwise_outcomes(scores: np.ndarray, higher_is_better: bool = True) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Compare every pair of models on every id by broadcasting the score matrix.
+
+    Returns boolean tensors (wins, ties) of shape (n_models, n_models, n_ids):
+    wins[i, j, k] is True when model i beats model j on id k, and ties[i, j, k] when
+    both have a score and the scores are equal. Losses are wins transposed on the
+    first two axes. Pairs where either score is missing are neither.
+    """
+    left = scores[:, None, :]
+    right = scores[None, :, :]
+    valid = ~np.isnan(left) & ~np.isnan(right)
+    with np.errstate(invalid='ignore'):
+        wins = (left > right) if higher_is_better else (left < right)
+        ties = left == right
+    wins &= valid
+    ties &= valid
+    # A model does not battle itself
+    diagonal = np.eye(scores.shape[0], dtype=bool)[:, :, None]
+    wins &= ~diagonal
+    ties &= ~diagonal
+    return wins, ties
+
+
+def pair_battle_outcomes(wins: np.ndarray, ties: np.ndarray) -> Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Flatten the outcome tensors into one battle per decided (id, pair) with i < j.
+
+    Returns arrays (id_indices, model_1_indices, model_2_indices, outcomes) ordered by
+    id, where outcome is 1 when model_1 wins, 2 when model_2 wins and 0 for a tie.
+    """
+    n_models = wins.shape[0]
+    upper = np.triu(np.ones((n_models, n_models), dtype=bool), k=1)[:, :, None]
+    losses = wins.transpose(1, 0, 2)
+    decided = (wins | losses | ties) & upper
+    id_indices, model_1_indices, model_2_indices = np.nonzero(decided.transpose(2, 0, 1))
+    outcomes = np.where(
+        wins[model_1_indices, model_2_indices, id_indices], 1,
+        np.where(losses[model_1_indices, model_2_indices, id_indices], 2, 0)
+    )
+    return id_indices, model_1_indices, model_2_indices, outcomes
@@ -0,0 +1,320 @@
+import os
+import re
+import json
+import math
+import time
+import logging
+from typing import Dict, List
+import numpy as np
+from profiling import profiled
+from jsonl_io import read_jsonl, write_artifact, list_artifacts
+
+logging.basicConfig(level=logging.INFO)
+
+translations_folder = "./Data/Output/translations"
+ngram_scores_folder = "./Data/Output/ngram_scores"
+translation_file_prefix = "a_v2_big_c_conversations_test_"
+
+BLEU_MAX_ORDER = 4
+CHRF_CHAR_ORDER = 6
+CHRF_BETA = 2
+# References scored together; bounds the n-gram arrays to a batch and its hypotheses
+NGRAM_BATCH_SIZE = 1000
+
+# Metric name -> whether a higher score is better
+NGRAM_METRICS = {'chrf': True, 'bleu': True, 'ter': False}
+
+# Rules of the '13a' tokenizer used by sacreBLEU
+_TOKENIZE_13A_RULES = [
+    (re.compile(r'([\{-\~\[-\` -\&\(-\+\:-\@\/])'), r' \1 '),
+    (re.compile(r'([^0-9])([\.,])'), r'\1 \2 '),
+    (re.compile(r'([\.,])([^0-9])'), r' \1 \2'),
+    (re.compile(r'([0-9])(-)'), r'\1 \2 '),
+]
+
+
+def tokenize_13a(text: str) -> List[str]:
+    text = text.replace('<skipped>', '').replace('-\n', '').replace('\n', ' ')
+    text = text.replace('&quot;', '"').replace('&amp;', '&').replace('&lt;', '<').replace('&gt;', '>')
+    text = f" {text} "
+    for pattern, replacement in _TOKENIZE_13A_RULES:
+        text = pattern.sub(replacement, text)
+    return text.split()
+
+
+def _ngram_statistics(symbols: np.ndarray, lengths: np.ndarray, reference_of: np.ndarray, max_order: int):
+    """
+    Clipped n-gram matches and n-gram totals of every document, for orders 1..max_order.
+
+    symbols holds the documents' tokens or characters as integer ids, one document after
+    the other, and lengths their lengths. The n-grams of a document are matched against
+    those of document reference_of[doc], each at most as often as it occurs there.
+    N-grams get integer ids, an n-gram being its (n - 1)-gram prefix plus one symbol,
+    so the counting and clipping run on arrays for all documents at once.
+
+    Returns (matches, totals), both of shape (n_docs, max_order).
+    """
+    n_docs = len(lengths)
+    matches = np.zeros((n_docs, max_order))
+    totals = np.zeros((n_docs, max_order))
+    doc = np.repeat(np.arange(n_docs), lengths)
+    # Symbols left in the document from each position, so an n-gram starting there fits if n <= remaining
+    remaining = np.repeat(np.cumsum(lengths), lengths) - np.arange(len(symbols))
+    _, unigrams = np.unique(symbols, return_inverse=True)
+    ngrams = unigrams = unigrams.ravel()
+    n_unigrams = len(unigrams) and int(unigrams.max()) + 1
+    for n in range(1, max_order + 1):
+        if n > 1:
+            _, ngrams = np.unique(ngrams[:-1] * n_unigrams + unigrams[n - 1:], return_inverse=True)
+            ngrams = ngrams.ravel()
+        valid = remaining[:len(ngrams)] >= n
+        if not valid.any():
+            break
+        n_ngrams = int(ngrams.max()) + 1
+        keys, counts = np.unique(doc[:len(ngrams)][valid] * n_ngrams + ngrams[valid], return_counts=True)
+        key_docs = keys // n_ngrams
+        # Count of the same n-gram in the reference, found by binary search in the sorted keys
+        reference_keys = reference_of[key_docs] * n_ngrams + keys % n_ngrams
+        position = np.minimum(np.searchsorted(keys, reference_keys), len(keys) - 1)
+        reference_counts = np.where(keys[position] == reference_keys, counts[position], 0)
+        matches[:, n - 1] = np.bincount(key_docs, weights=np.minimum(counts, reference_counts), minlength=n_docs)
+        totals[:, n - 1] = np.bincount(key_docs, weights=counts, minlength=n_docs)
+    return matches, totals
+
+
+def _edit_distances(hypotheses: List[np.ndarray], reference: np.ndarray) -> np.ndarray:
+    """
+    Word-level Levenshtein distance of every hypothesis to the same reference. All
+    hypotheses advance together, one vectorized row per hypothesis token position.
+    """
+    lengths = np.array([len(hypothesis) for hypothesis in hypotheses], dtype=np.int64)
+    if len(reference) == 0 or len(hypotheses) == 0:
+        return lengths
+    padded = np.full((len(hypotheses), lengths.max()), -1, dtype=np.int64)
+    for k, hypothesis in enumerate(hypotheses):
+        padded[k, :len(hypothesis)] = hypothesis
+    offsets = np.arange(len(reference) + 1)
+    rows = np.tile(offsets, (len(hypotheses), 1))
+    distances = np.where(lengths == 0, len(reference), 0)
+    for i in range(1, lengths.max() + 1):
+        substitution = rows[:, :-1] + (reference[None, :] != padded[:, i - 1, None])
+        deletion = rows[:, 1:] + 1
+        candidate = np.empty_like(rows)
+        candidate[:, 0] = i
+        candidate[:, 1:] = np.minimum(substitution, deletion)
+        # Insertions chain along the row: row[j] = min(candidate[j], row[j - 1] + 1)
+        rows = np.minimum.accumulate(candidate - offsets, axis=1) + offsets
+        # A hypothesis's distance is the last entry of the row of its last token
+        finished = lengths == i
+        distances[finished] = rows[finished, -1]
+    return distances
+
+
+def _batch_statistics(references: List[str], hypotheses: List[List], bleu_stats, chrf_stats, ter_stats):
+    """Fill the statistics of a batch of references and every model's hypotheses for them."""
+    n_models, n_refs = len(hypotheses), len(references)
+    texts = [str(reference) for reference in references]
+    present = np.zeros((n_models, n_refs), dtype=bool)
+    for m, model_hypotheses in enumerate(hypotheses):
+        for r, hypothesis in enumerate(model_hypotheses):
+            if hypothesis is None or (isinstance(hypothesis, float) and math.isnan(hypothesis)):
+                texts.append('')
+            else:
+                texts.append(str(hypothesis))
+                present[m, r] = True
+    # Document (m + 1) * n_refs + r is model m's hypothesis for reference r
+    reference_of = np.tile(np.arange(n_refs), n_models + 1)
+
+    vocabulary: Dict[str, int] = {}
+    tokens = [tokenize_13a(text) for text in texts]
+    token_ids = np.array([vocabulary.setdefault(token, len(vocabulary)) for doc in tokens for token in doc], dtype=np.int64)
+    lengths = np.array([len(doc) for doc in tokens], dtype=np.int64)
+    matches, totals = _ngram_statistics(token_ids, lengths, reference_of, BLEU_MAX_ORDER)
+    bleu_stats[..., :BLEU_MAX_ORDER] = matches[n_refs:].reshape(n_models, n_refs, -1)
+    bleu_stats[..., BLEU_MAX_ORDER:2 * BLEU_MAX_ORDER] = totals[n_refs:].reshape(n_models, n_refs, -1)
+    bleu_stats[..., -2] = lengths[n_refs:].reshape(n_models, n_refs)
+    bleu_stats[..., -1] = lengths[:n_refs]
+
+    chars = [''.join(text.split()) for text in texts]
+    codes = np.frombuffer(''.join(chars).encode('utf-32-le'), dtype=np.uint32).astype(np.int64)
+    lengths = np.array([len(text) for text in chars], dtype=np.int64)
+    matches, totals = _ngram_statistics(codes, lengths, reference_of, CHRF_CHAR_ORDER)
+    chrf_stats[..., 0::3] = matches[n_refs:].reshape(n_models, n_refs, -1)
+    chrf_stats[..., 1::3] = totals[n_refs:].reshape(n_models, n_refs, -1)
+    chrf_stats[..., 2::3] = totals[:n_refs]
+
+    # TER works on lowercased whitespace tokens, like sacreBLEU's default TER
+    ter_vocabulary: Dict[str, int] = {}
+    reference_ids = [
+        np.array([ter_vocabulary.setdefault(token, len(ter_vocabulary)) for token in text.lower().split()], dtype=np.int64)
+        for text in texts[:n_refs]
+    ]
+    for r, reference in enumerate(reference_ids):
+        translated = np.flatnonzero(present[:, r])
+        hypothesis_ids = [
+            np.array([ter_vocabulary.get(token, -1) for token in texts[(m + 1) * n_refs + r].lower().split()], dtype=np.int64)
+            for m in translated
+        ]
+        ter_stats[translated, r, 0] = _edit_distances(hypothesis_ids, reference)
+        ter_stats[translated, r, 1] = len(reference)
+
+    for stats in (bleu_stats, chrf_stats, ter_stats):
+        stats[~present] = np.nan
+
+
+def collect_statistics(references: List[str], hypotheses_by_model: Dict[str, List[str]]):
+    """
+    Gather sufficient statistics for each model, NGRAM_BATCH_SIZE references at a time.
+
+    Returns (models, bleu_stats, chrf_stats, ter_stats) where the stats arrays are
+    shaped (n_models, n_references, k). A missing hypothesis (None) yields NaN stats.
+    """
+    models = list(hypotheses_by_model.keys())
+    n_models, n_refs = len(models), len(references)
+
+    # matches[1..4], totals[1..4], hypothesis length, reference length
+    bleu_stats = np.full((n_models, n_refs, 2 * BLEU_MAX_ORDER + 2), np.nan)
+    # matches, hypothesis counts, reference counts per character order
+    chrf_stats = np.full((n_models, n_refs, 3 * CHRF_CHAR_ORDER), np.nan)
+    # edits, reference length
+    ter_stats = np.full((n_models, n_refs, 2), np.nan)
+
+    for start in range(0, n_refs, NGRAM_BATCH_SIZE):
+        batch = slice(start, start + NGRAM_BATCH_SIZE)
+        _batch_statistics(
+            list(references[batch]), [list(hypotheses_by_model[model][batch]) for model in models],
+            bleu_stats[:, batch], chrf_stats[:, batch], ter_stats[:, batch]
+        )
+    return models, bleu_stats, chrf_stats, ter_stats
+
+
+def bleu_from_statistics(stats: np.ndarray, smooth: bool = True) -> np.ndarray:
+    """BLEU over the last axis of `stats`; sentence scores use sacreBLEU's 'exp' smoothing."""
+    matches = stats[..., :BLEU_MAX_ORDER]
+    totals = stats[..., BLEU_MAX_ORDER:2 * BLEU_MAX_ORDER]
+    hypothesis_length = stats[..., -2]
+    reference_length = stats[..., -1]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        if smooth:
+            zero_matches = np.cumsum(matches == 0, axis=-1)
+            precisions = np.where(
+                matches > 0,
+                matches / np.maximum(totals, 1),
+                1.0 / (2.0 ** zero_matches * np.maximum(totals, 1))
+            )
+        else:
+            precisions = np.where(matches > 0, matches / np.maximum(totals, 1), 0.0)
+        log_precision = np.where(precisions > 0, np.log(np.where(precisions > 0, precisions, 1)), -np.inf)
+        brevity_penalty = np.where(
+            hypothesis_length < reference_length,
+            np.exp(1 - reference_length / np.maximum(hypothesis_length, 1)),
+            1.0
+        )
+        scores = 100 * brevity_penalty * np.exp(log_precision.mean(axis=-1))
+    scores = np.where(hypothesis_length == 0, 0.0, scores)
+    return np.where(np.isnan(reference_length), np.nan, scores)
+
+
+def chrf_from_statistics(stats: np.ndarray, beta: int = CHRF_BETA) -> np.ndarray:
+    """chrF over the last axis of `stats`, averaging precision and recall over character orders."""
+    matches = stats[..., 0::3]
+    hypothesis_counts = stats[..., 1::3]
+    reference_counts = stats[..., 2::3]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        precision = np.where(hypothesis_counts > 0, matches / np.maximum(hypothesis_counts, 1), 0.0).mean(axis=-1)
+        recall = np.where(reference_counts > 0, matches / np.maximum(reference_counts, 1), 0.0).mean(axis=-1)
+        denominator = beta ** 2 * precision + recall
+        scores = np.where(denominator > 0, 100 * (1 + beta ** 2) * precision * recall / denominator, 0.0)
+    return np.where(np.isnan(stats[..., 0]), np.nan, scores)
+
+
+def ter_from_statistics(stats: np.ndarray) -> np.ndarray:
+    """
+    Translation edit rate over the last axis of `stats`; lower is better.
+    Block shifts are not searched, so on the same lowercased tokens this is the
+    shift-free upper bound of sacreBLEU's TER.
+    """
+    edits = stats[..., 0]
+    reference_length = stats[..., 1]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        scores = 100 * edits / np.maximum(reference_length, 1)
+    return scores
+
+
+def score_all_models(references: List[str], hypotheses_by_model: Dict[str, List[str]]):
+    """
+    Sentence and corpus chrF/BLEU/TER for every model in one pass.
+
+    Returns (sentence_scores, corpus_scores): sentence_scores maps metric -> array of shape
+    (n_models, n_references) and corpus_scores maps model -> {metric: score}.
+    """
+    models, bleu_stats, chrf_stats, ter_stats = collect_statistics(references, hypotheses_by_model)
+    sentence_scores = {
+        'chrf': chrf_from_statistics(chrf_stats),
+        'bleu': bleu_from_statistics(bleu_stats, smooth=True),
+        'ter': ter_from_statistics(ter_stats),
+    }
+    # Corpus scores pool the statistics of the references each model translated
+    corpus_bleu = bleu_from_statistics(np.nansum(bleu_stats, axis=1), smooth=False)
+    corpus_chrf = chrf_from_statistics(np.nansum(chrf_stats, axis=1))
+    corpus_ter = ter_from_statistics(np.nansum(ter_stats, axis=1))
+    corpus_scores = {
+        model: {
+            'chrf': float(corpus_chrf[m]),
+            'bleu': float(corpus_bleu[m]),
+            'ter': float(corpus_ter[m]),
+        } for m, model in enumerate(models)
+    }
+    return sentence_scores, corpus_scores
+
+
+def load_translations(prefix: str = translation_file_prefix):
+    """Load every model's translations aligned on a shared list of ids."""
+    references = {}
+    translations = {}
+    for file_path, model_name in list_artifacts(translations_folder, prefix):
+        df = read_jsonl(file_path, ['id', 'joined_english_sentences', f'{model_name}_translation'])
+        for record in df.itertuples(index=False):
+            references[record[0]] = record[1]
+        translations[model_name] = dict(zip(df['id'], df[f'{model_name}_translation']))
+    ids = sorted(references.keys())
+    hypotheses_by_model = {
+        model_name: [model_translations.get(id_) for id_ in ids]
+        for model_name, model_translations in translations.items()
+    }
+    return ids, [references[id_] for id_ in ids], hypotheses_by_model
+
+
+@profiled
+def add_ngram_scores(version_name: str = "v1"):
+    """Write {model}_chrf/_bleu/_ter per id for every model, plus corpus scores."""
+    start = time.perf_counter()
+    ids, references, hypotheses_by_model = load_translations()
+    sentence_scores, corpus_scores = score_all_models(references, hypotheses_by_model)
+    logging.info(
+        f"Scored {len(hypotheses_by_model)} models on {len(ids)} conversations "
+        f"in {time.perf_counter() - start:.2f}s"
+    )
+
+    os.makedirs(ngram_scores_folder, exist_ok=True)
+    for m, model_name in enumerate(hypotheses_by_model.keys()):
+        output_file = os.path.join(ngram_scores_folder, f"{version_name}_big_c_conversations_test_{model_name}.jsonl")
+        write_artifact(output_file, (
+            {'id': int(id_), **{f"{model_name}_{metric}": float(sentence_scores[metric][m, r]) for metric in NGRAM_METRICS}}
+            for r, id_ in enumerate(ids)
+            if hypotheses_by_model[model_name][r] is not None
+        ))
+        logging.info(f"Results saved to {output_file}")
+
+    corpus_file = os.path.join(ngram_scores_folder, f"{version_name}_corpus_scores.json")
+    with open(corpus_file, 'w') as f:
+        json.dump(corpus_scores, f, indent=2)
+    logging.info(f"Corpus scores saved to {corpus_file}")
+
+
+def main():
+    add_ngram_scores(version_name="v1")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,203 @@
+import os
+import json
+import time
+import asyncio
+import hashlib
+import logging
+from typing import Callable, Dict, List, Optional
+from compile_manifest import file_sha256
+from jsonl_io import artifact_exists, artifact_path, remove_artifact
+
+logging.basicConfig(level=logging.INFO)
+
+# Cache keys of the stages that completed, by stage name
+pipeline_state_file_path = "./Data/Output/pipeline_state.json"
+# Prefix of the key of a stage that started and has not completed yet
+RUNNING_PREFIX = "running:"
+
+
+class Stage:
+    """
+    One step of a Pipeline. `func` is called without arguments (sync functions run in a
+    worker thread, coroutine functions are awaited) and must write every path in
+    `outputs`. `inputs` are the files it reads and `params` everything else that changes
+    its result; both go into the stage's cache key. Paths are named by their .jsonl
+    file and may be stored as its Parquet sibling (see jsonl_io.artifact_path).
+    A resumable stage continues outputs an interrupted run left, such as a translation
+    file that is still being appended to, so an existing output is not taken as done.
+    """
+
+    def __init__(self, name: str, func: Callable, inputs: List[str], outputs: List[str], params: Optional[dict] = None,
+                 resumable: bool = False):
+        self.name = name
+        self.func = func
+        self.inputs = inputs
+        self.outputs = outputs
+        self.params = params or {}
+        self.resumable = resumable
+
+    def key(self) -> str:
+        digest = hashlib.sha256()
+        digest.update(json.dumps({'name': self.name, 'params': self.params}, sort_keys=True, default=str).encode('utf-8'))
+        for input_path in self.inputs:
+            digest.update(input_path.encode('utf-8'))
+            digest.update(file_sha256(artifact_path(input_path)).encode('utf-8'))
+        return digest.hexdigest()
+
+
+class Pipeline:
+    """
+    A graph of stages connected by the files they produce and read. A stage depends on
+    the stages whose outputs are among its inputs.
+
+    run() starts every stage as soon as its dependencies are done, so independent stages
+    run concurrently. A stage is skipped when its cache key (hash of its parameters and
+    of the contents of its inputs) matches the last successful run and its outputs still
+    exist. Outputs recorded under another key are stale: they are removed and the stage
+    runs again. Outputs the pipeline has no record of, because they were written before
+    it or by a run interrupted before its state was saved, are kept: the stage is
+    adopted as done if they all exist, and otherwise runs to complete them, so a
+    resumable stage picks up the rows it already has. force=True removes those outputs
+    as well.
+    """
+
+    def __init__(self, state_file_path: str = pipeline_state_file_path, force: bool = False):
+        self.state_file_path = state_file_path
+        self.force = force
+        self.stages: Dict[str, Stage] = {}
+        self.state = {}
+        if os.path.exists(state_file_path):
+            with open(state_file_path, 'r') as f:
+                self.state = json.load(f)
+        self.report = []
+
+    def add_stage(self, name: str, func: Callable, inputs: List[str], outputs: List[str], params: Optional[dict] = None,
+                  resumable: bool = False) -> Stage:
+        if name in self.stages:
+            raise ValueError(f"Stage '{name}' is already defined.")
+        stage = Stage(name, func, inputs, outputs, params, resumable)
+        self.stages[name] = stage
+        return stage
+
+    def dependencies(self, stage: Stage) -> List[str]:
+        producers = {output: other.name for other in self.stages.values() for output in other.outputs}
+        return sorted({producers[path] for path in stage.inputs if path in producers and producers[path] != stage.name})
+
+    def _check_acyclic(self):
+        visiting, done = set(), set()
+
+        def visit(name):
+            if name in done:
+                return
+            if name in visiting:
+                raise ValueError(f"Pipeline has a cycle through stage '{name}'.")
+            visiting.add(name)
+            for dependency in self.dependencies(self.stages[name]):
+                visit(dependency)
+            visiting.discard(name)
+            done.add(name)
+
+        for name in self.stages:
+            visit(name)
+
+    def has_stale_outputs(self, stage: Stage, key: str) -> bool:
+        """Whether the stage's outputs were written for another key, or are to be rebuilt with force."""
+        recorded = self.state.get(stage.name)
+        return self.force or (recorded is not None and recorded not in (key, RUNNING_PREFIX + key))
+
+    def _is_adoptable(self, stage: Stage, key: str) -> bool:
+        """Whether the stage's outputs all exist, are not stale and are complete files to be kept as they are."""
+        return (
+            not stage.resumable and not self.has_stale_outputs(stage, key)
+            and all(artifact_exists(path) for path in stage.outputs)
+        )
+
+    def is_up_to_date(self, stage: Stage, key: Optional[str] = None) -> bool:
+        """
+        Whether run() would skip the stage: its inputs and key are unchanged and its
+        outputs exist, or it would adopt the outputs it finds.
+        """
+        if not all(artifact_exists(path) for path in stage.inputs):
+            return False
+        key = key or stage.key()
+        if self.state.get(stage.name) == key and all(artifact_exists(path) for path in stage.outputs):
+            return True
+        return self._is_adoptable(stage, key)
+
+    def _save_state(self):
+        os.makedirs(os.path.dirname(self.state_file_path) or '.', exist_ok=True)
+        with open(self.state_file_path, 'w') as f:
+            json.dump(self.state, f, indent=2)
+
+    async def _run_stage(self, stage: Stage, tasks: Dict[str, asyncio.Task]) -> bool:
+        for dependency in self.dependencies(stage):
+            if not await tasks[dependency]:
+                self.report.append((stage.name, 'skipped', 0.0))
+                logging.warning(f"Stage '{stage.name}' skipped: dependency '{dependency}' did not complete.")
+                return False
+
+        missing_inputs = [path for path in stage.inputs if not artifact_exists(path)]
+        if missing_inputs:
+            self.report.append((stage.name, 'skipped', 0.0))
+            logging.error(f"Stage '{stage.name}' skipped: missing inputs {missing_inputs}")
+            return False
+
+        key = stage.key()
+        if self.state.get(stage.name) == key and all(artifact_exists(path) for path in stage.outputs):
+            self.report.append((stage.name, 'cached', 0.0))
+            logging.info(f"Stage '{stage.name}' is up to date.")
+            return True
+        if self._is_adoptable(stage, key):
+            self.state[stage.name] = key
+            self._save_state()
+            self.report.append((stage.name, 'adopted', 0.0))
+            logging.info(f"Stage '{stage.name}': adopting its existing outputs.")
+            return True
+
+        if self.has_stale_outputs(stage, key):
+            # The stage functions skip outputs that already exist, so stale outputs are removed first
+            for path in stage.outputs:
+                if artifact_exists(path):
+                    logging.info(f"Removing stale output {path}")
+                    remove_artifact(path)
+        # Marked as started, so a run interrupted from here on is continued, not removed, next time
+        self.state[stage.name] = RUNNING_PREFIX + key
+        self._save_state()
+        logging.info(f"Running stage '{stage.name}'")
+        start = time.perf_counter()
+        try:
+            if asyncio.iscoroutinefunction(stage.func):
+                await stage.func()
+            else:
+                await asyncio.to_thread(stage.func)
+        except Exception as e:
+            self.report.append((stage.name, 'failed', time.perf_counter() - start))
+            logging.error(f"Stage '{stage.name}' failed: {e}")
+            return False
+        elapsed = time.perf_counter() - start
+
+        missing_outputs = [path for path in stage.outputs if not artifact_exists(path)]
+        if missing_outputs:
+            self.report.append((stage.name, 'failed', elapsed))
+            logging.error(f"Stage '{stage.name}' did not write {missing_outputs}")
+            return False
+        self.state[stage.name] = key
+        self._save_state()
+        self.report.append((stage.name, 'ran', elapsed))
+        return True
+
+    async def run(self) -> bool:
+        """Run every stale stage; returns True when all stages completed."""
+        self._check_acyclic()
+        self.report = []
+        tasks: Dict[str, asyncio.Task] = {}
+        for stage in self.stages.values():
+            tasks[stage.name] = asyncio.ensure_future(self._run_stage(stage, tasks))
+        results = await asyncio.gather(*tasks.values())
+        self.print_report()
+        return all(results)
+
+    def print_report(self):
+        print(f"\n{'stage':<48}{'status':>10}{'seconds':>12}")
+        for name, status, elapsed in self.report:
+            print(f"{name:<48}{status:>10}{elapsed:>12.2f}")
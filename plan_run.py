@@ -0,0 +1,285 @@
+import os
+import math
+import logging
+import pandas as pd
+from pathlib import Path
+from typing import Dict, List, Optional
+import add_new_model_script as new_model
+from add_judgments import JudgmentQueue
+from call_stats import observed_latency
+from jsonl_io import read_jsonl, iter_jsonl, artifact_exists, list_artifacts
+from get_regular_translations import load_data, prepare_dataframe
+from prepare_judgment_file import full_judgment_prompt
+from sharded import default_shard_size, shard_folder, shards_are_current
+from translation_sweep import completed_ids, default_concurrency, provider_concurrency, translation_input
+
+logging.basicConfig(level=logging.INFO)
+
+try:
+    import tiktoken
+except ImportError:
+    tiktoken = None
+
+# USD per million input and output tokens. The o1 models also bill their hidden
+# reasoning tokens as output, which the plan cannot see, so their cost is a lower bound.
+provider_prices = {
+    "gpt_4o": (2.50, 10.00),
+    "o1_preview": (15.00, 60.00),
+    "o1_mini": (3.00, 12.00),
+    "sonnet_3_point_5": (3.00, 15.00),
+    "gemini_1_5_pro": (1.25, 5.00),
+    "text-embedding-ada-002": (0.10, 0.0)
+}
+# Google Translate bills characters instead of tokens
+google_translate_price_per_million_characters = 20.0
+# Latency assumed for providers without recorded calls in call_stats.jsonl
+default_latency_seconds = 10.0
+# The judge answers with a single digit
+judgment_output_tokens = 1
+embedding_batch_size = 128
+embedding_concurrency = 8
+
+consistency_judgments_folder = "./Data/Output/consistency_judgments"
+consistency_judgment_model = "gpt_4o"
+consistency_version_name = "v1"
+
+
+def _load_encoding():
+    if tiktoken is None:
+        return None
+    try:
+        return tiktoken.get_encoding("o200k_base")
+    except Exception as e:
+        # tiktoken downloads its vocabularies on first use
+        logging.warning(f"Could not load tiktoken encoding ({e}). Estimating token counts.")
+        return None
+
+
+def count_tokens(texts: List[str], encoding) -> int:
+    texts = [str(text) for text in texts if text is not None]
+    if encoding is not None:
+        return sum(len(tokens) for tokens in encoding.encode_batch(texts))
+    # Rough estimate without tiktoken
+    return sum(len(text) // 4 + 1 for text in texts)
+
+
+def _stage_plan(stage: str, provider: Optional[str], status: str, concurrency: int = 1, calls: int = 0,
+                input_texts: List[str] = (), output_tokens: int = 0, encoding=None) -> dict:
+    return {
+        'stage': stage,
+        'provider': provider,
+        'status': status,
+        'concurrency': concurrency,
+        'calls': calls,
+        'input_tokens': count_tokens(list(input_texts), encoding),
+        'input_characters': sum(len(str(text)) for text in input_texts),
+        'output_tokens': output_tokens
+    }
+
+
+def _existing_translations(model_name: str) -> Optional[pd.Series]:
+    """The model's translations from its raw or scored translation file, if there is one."""
+    for version_name in (None, new_model.scores_version_name):
+        file_path = new_model.translation_file_path(model_name, version_name)
+        if artifact_exists(file_path):
+            df = read_jsonl(file_path, ['id', f"{model_name}_translation"])
+            return df.set_index('id')[f"{model_name}_translation"]
+    return None
+
+
+def _translations_or_references(model_name: str, df: pd.DataFrame) -> List[str]:
+    """Translations to render prompts with: the model's own where they exist, else the English references."""
+    translations = _existing_translations(model_name)
+    references = df.set_index('id')['joined_english_sentences']
+    if translations is None:
+        return references.tolist()
+    return translations.reindex(references.index).fillna(references).tolist()
+
+
+def _checkpointed_ids(input_path: str, output_path: str) -> set:
+    """Ids in the shard checkpoints of output_path that a sharded rerun over input_path keeps."""
+    if default_shard_size is None or not shards_are_current([input_path], output_path, default_shard_size):
+        return set()
+    ids = set()
+    for path, _ in list_artifacts(shard_folder(output_path), "shard_"):
+        ids.update(record['id'] for record in iter_jsonl(path, ['id']))
+    return ids
+
+
+def _translated_ids(pipeline, stage) -> set:
+    """Ids a resumed translation stage skips: the rows an interrupted run already translated."""
+    # Outputs written for another key are removed before the stage runs
+    if pipeline.has_stale_outputs(stage, stage.key()):
+        return set()
+    output_path = stage.outputs[0]
+    if default_shard_size is None:
+        return completed_ids(Path(output_path))
+    # The sharded sweep keeps its translations in the checkpoints until all rows are done
+    return _checkpointed_ids(str(Path(new_model.source_file_path)), str(Path(output_path)))
+
+
+def plan_new_model_pipeline(encoding) -> List[dict]:
+    """Calls, tokens and status of every stage add_new_model_script.py would run."""
+    llm_services = {llm_service.__name__: llm_service for llm_service in new_model.new_llm_services}
+    pipeline = new_model.build_pipeline(new_model.new_llm_services, JudgmentQueue(new_model.judgment_model))
+    df = prepare_dataframe(load_data(Path('./Data/Static'), 'big_c_conversations_test.jsonl'))
+    model_names = list(llm_services)
+
+    plans = []
+    for name, stage in pipeline.stages.items():
+        # Cached stages are skipped by the pipeline and cost nothing
+        status = 'cached' if pipeline.is_up_to_date(stage) else 'pending'
+        if name.startswith('translations_'):
+            model_name = name[len('translations_'):]
+            if status == 'cached':
+                plans.append(_stage_plan(name, model_name, status))
+                continue
+            llm_service = llm_services[model_name]
+            # Translation stages resume, so only the rows without a translation yet are
+            # called; the output is about as long as a previous translation by the
+            # model, or the reference
+            pending = ~df['id'].isin(_translated_ids(pipeline, stage))
+            output_texts = [text for text, is_pending in zip(_translations_or_references(model_name, df), pending) if is_pending]
+            plans.append(_stage_plan(
+                name, model_name, status,
+                concurrency=provider_concurrency.get(model_name, default_concurrency),
+                calls=int(pending.sum()),
+                input_texts=[translation_input(llm_service, row) for _, row in df[pending].iterrows()],
+                output_tokens=count_tokens(output_texts, encoding),
+                encoding=encoding
+            ))
+        elif name == 'similarity_scores' and new_model.embedding_model in provider_prices:
+            if status == 'cached':
+                plans.append(_stage_plan(name, new_model.embedding_model, status))
+                continue
+            texts = set(df['joined_english_sentences'])
+            for model_name in model_names:
+                texts.update(_translations_or_references(model_name, df))
+            plans.append(_stage_plan(
+                name, new_model.embedding_model, status, concurrency=embedding_concurrency,
+                calls=math.ceil(len(texts) / embedding_batch_size), input_texts=sorted(texts), encoding=encoding
+            ))
+        elif name.startswith('judgments_'):
+            if status == 'cached':
+                plans.append(_stage_plan(name, new_model.judgment_model, status))
+                continue
+            judgment_file = stage.inputs[0]
+            if artifact_exists(judgment_file):
+                judgments = read_jsonl(judgment_file, ['id', 'full_judgment_prompt'])
+                # Sharded runs skip the shards an interrupted run checkpointed
+                judgments = judgments[~judgments['id'].isin(_checkpointed_ids(judgment_file, stage.outputs[0]))]
+                prompts = judgments['full_judgment_prompt'].tolist()
+            else:
+                # The judgment file is not prepared yet; render its prompts from the
+                # translations that exist, with the references standing in for the rest
+                v1_model, v2_model = name[len('judgments_'):].split('_vs_')
+                prompts = [
+                    full_judgment_prompt.format(conversation=reference, alternate_version_1=v1, alternate_version_2=v2)
+                    for reference, v1, v2 in zip(
+                        df['joined_english_sentences'],
+                        _translations_or_references(v1_model, df),
+                        _translations_or_references(v2_model, df)
+                    )
+                ]
+            plans.append(_stage_plan(
+                name, new_model.judgment_model, status, concurrency=new_model.judgment_concurrency,
+                calls=len(prompts), input_texts=prompts, output_tokens=judgment_output_tokens * len(prompts),
+                encoding=encoding
+            ))
+        # BERTScore, merges and file preparation run locally and are left out
+    return plans
+
+
+def plan_consistency_judgments(encoding, judgment_model: str = consistency_judgment_model,
+                               version_name: str = consistency_version_name) -> List[dict]:
+    """Calls and tokens of add_consistency_judgments.py over the prepared consistency files."""
+    plans = []
+    for file_path, file_name in list_artifacts(consistency_judgments_folder, ""):
+        if version_name in file_name:
+            continue
+        df = read_jsonl(file_path, ['v1_model', 'v2_model', 'full_consistency_judgment_prompt'])
+        if df.empty:
+            continue
+        v1_model, v2_model = df['v1_model'].iloc[0], df['v2_model'].iloc[0]
+        name = f"consistency_{v1_model}_vs_{v2_model}"
+        output_file = os.path.join(consistency_judgments_folder, f"{version_name}_big_c_test_{v1_model}_vs_{v2_model}.jsonl")
+        # Files that were already judged are skipped by add_consistency_judgments
+        if artifact_exists(output_file):
+            plans.append(_stage_plan(name, judgment_model, 'cached'))
+            continue
+        prompts = df['full_consistency_judgment_prompt'].tolist()
+        plans.append(_stage_plan(
+            name, judgment_model, 'pending', calls=len(prompts), input_texts=prompts,
+            output_tokens=judgment_output_tokens * len(prompts), encoding=encoding
+        ))
+    return plans
+
+
+def stage_cost(plan: dict) -> Optional[float]:
+    if plan['calls'] == 0:
+        return 0.0
+    if plan['provider'] == 'google_translate':
+        return plan['input_characters'] / 1e6 * google_translate_price_per_million_characters
+    if plan['provider'] not in provider_prices:
+        return None
+    input_price, output_price = provider_prices[plan['provider']]
+    return plan['input_tokens'] / 1e6 * input_price + plan['output_tokens'] / 1e6 * output_price
+
+
+def stage_seconds(plan: dict, latency: Dict[str, dict]) -> float:
+    """Calls times the provider's median latency, spread over the stage's concurrent requests."""
+    if plan['calls'] == 0:
+        return 0.0
+    seconds_per_call = latency.get(plan['provider'], {}).get('median_seconds', default_latency_seconds)
+    return plan['calls'] * seconds_per_call / plan['concurrency']
+
+
+def pipeline_wall_seconds(plans: List[dict], latency: Dict[str, dict]) -> float:
+    """
+    The translation stages run side by side, then the embeddings, then the judgment
+    stages, which share one queue of judgment_concurrency requests.
+    """
+    translations = [stage_seconds(p, latency) for p in plans if p['stage'].startswith('translations_')]
+    embeddings = [stage_seconds(p, latency) for p in plans if p['stage'] == 'similarity_scores']
+    judgments = sum(stage_seconds(p, latency) for p in plans if p['stage'].startswith('judgments_'))
+    return max(translations, default=0.0) + max(embeddings, default=0.0) + judgments
+
+
+def print_plan(title: str, plans: List[dict], latency: Dict[str, dict], wall_seconds: float):
+    print(f"\n{title}")
+    print(f"{'stage':<56}{'status':>9}{'calls':>8}{'in tokens':>12}{'out tokens':>12}{'USD':>10}{'hours':>8}")
+    total_cost = 0.0
+    unpriced = False
+    for plan in plans:
+        cost = stage_cost(plan)
+        total_cost += cost or 0.0
+        unpriced |= cost is None
+        cost_text = 'n/a' if cost is None else f"{cost:.2f}"
+        # Stages whose provider has no recorded calls use the default latency
+        assumed = '*' if plan['calls'] and plan['provider'] not in latency else ''
+        print(f"{plan['stage']:<56}{plan['status']:>9}{plan['calls']:>8}{plan['input_tokens']:>12}"
+              f"{plan['output_tokens']:>12}{cost_text:>10}{stage_seconds(plan, latency) / 3600:>7.2f}{assumed:1}")
+    calls = sum(plan['calls'] for plan in plans)
+    total_cost_text = f"{total_cost:.2f}" + ('+' if unpriced else '')
+    print(f"{'total':<56}{'':>9}{calls:>8}{sum(p['input_tokens'] for p in plans):>12}"
+          f"{sum(p['output_tokens'] for p in plans):>12}{total_cost_text:>10}{wall_seconds / 3600:>7.2f}")
+
+
+def main():
+    encoding = _load_encoding()
+    latency = observed_latency()
+    for provider, stats in sorted(latency.items()):
+        logging.info(f"{provider}: median {stats['median_seconds']:.2f}s over {stats['calls']} recorded calls")
+
+    plans = plan_new_model_pipeline(encoding)
+    print_plan("add_new_model_script.py", plans, latency, pipeline_wall_seconds(plans, latency))
+
+    plans = plan_consistency_judgments(encoding)
+    # add_consistency_judgments judges one row at a time, one file after the other
+    print_plan("add_consistency_judgments.py", plans, latency, sum(stage_seconds(p, latency) for p in plans))
+    print(f"\n* no recorded calls; assumes {default_latency_seconds:.0f}s per call. "
+          f"'+' marks totals missing providers without a price.")
+
+
+if __name__ == "__main__":
+    main()
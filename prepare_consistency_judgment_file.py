@@ -1,7 +1,9 @@
-import pandas as pd
 import json
 import asyncio
-import os
+from contextlib import ExitStack
+from profiling import profiled
+from jsonl_io import read_jsonl, write_artifact, artifact_exists
+from sharded import RecordIndex, run_sharded, default_shard_size
 
 full_consistency_judgment_prompt = """
 You will be given 4 versions of a short conversation in English between two speakers. Conversant A always begins with a description of an image they are viewing.
@@ -37,10 +39,28 @@ Just respond with the number. Do not include any other text.
 **Your response:**
 """
 
+def add_consistency_judgment_prompts(result_df, v1_model, v2_model):
+    # Add v1_model and v2_model columns
+    result_df['v1_model'] = v1_model
+    result_df['v2_model'] = v2_model
+
+    # Generate the full consistency judgment prompt
+    result_df['full_consistency_judgment_prompt'] = result_df.apply(
+        lambda row: full_consistency_judgment_prompt.format(
+            model_1_version_1=row[f'{v1_model}_translation_t1'],
+            model_1_version_2=row[f'{v1_model}_translation_t2'],
+            model_2_version_1=row[f'{v2_model}_translation_t1'],
+            model_2_version_2=row[f'{v2_model}_translation_t2']
+        ), axis=1
+    )
+    return result_df
+
+@profiled
 async def prepare_consistency_judgment_file(
         v1_model,
         v2_model,
-        version_name="v0"
+        version_name="v0",
+        shard_size=default_shard_size
     ):
 
     v1_t1_jsonl_path = f"./Data/Output/translations_high_temp/big_c_conversations_test_{v1_model}_t1.jsonl"
@@ -48,11 +68,21 @@ async def prepare_consistency_judgment_file(
     v2_t1_jsonl_path = f"./Data/Output/translations_high_temp/big_c_conversations_test_{v2_model}_t1.jsonl"
     v2_t2_jsonl_path = f"./Data/Output/translations_high_temp/big_c_conversations_test_{v2_model}_t2.jsonl"
 
+    # Define the output file path
+    output_file = f"./Data/Output/consistency_judgments/{version_name}_big_c_test_{v1_model}_vs_{v2_model}.jsonl"
+
+    # Only the translation column is needed from the other three files
+    other_files = [
+        (v1_t2_jsonl_path, ['id', f'{v1_model}_translation_t2']),
+        (v2_t1_jsonl_path, ['id', f'{v2_model}_translation_t1']),
+        (v2_t2_jsonl_path, ['id', f'{v2_model}_translation_t2'])
+    ]
+    if shard_size is not None:
+        return _prepare_consistency_judgment_file_sharded(v1_t1_jsonl_path, other_files, v1_model, v2_model, output_file, shard_size)
+
     # Read JSONL files
-    df_1_t1 = pd.read_json(v1_t1_jsonl_path, lines=True)
-    df_1_t2 = pd.read_json(v1_t2_jsonl_path, lines=True)
-    df_2_t1 = pd.read_json(v2_t1_jsonl_path, lines=True)
-    df_2_t2 = pd.read_json(v2_t2_jsonl_path, lines=True)
+    df_1_t1 = read_jsonl(v1_t1_jsonl_path)
+    df_1_t2, df_2_t1, df_2_t2 = (read_jsonl(path, columns) for path, columns in other_files)
     
     # Start with df_1_t1 as the base DataFrame
     result_df = df_1_t1
@@ -70,31 +100,40 @@ async def prepare_consistency_judgment_file(
     duplicate_columns = [col for col in result_df.columns if col.endswith('_dup')]
     result_df.drop(columns=duplicate_columns, inplace=True)
     
-    # Add v1_model and v2_model columns
-    result_df['v1_model'] = v1_model
-    result_df['v2_model'] = v2_model
-
-    # Generate the full consistency judgment prompt
-    result_df['full_consistency_judgment_prompt'] = result_df.apply(
-        lambda row: full_consistency_judgment_prompt.format(
-            model_1_version_1=row[f'{v1_model}_translation_t1'],
-            model_1_version_2=row[f'{v1_model}_translation_t2'],
-            model_2_version_1=row[f'{v2_model}_translation_t1'],
-            model_2_version_2=row[f'{v2_model}_translation_t2']
-        ), axis=1
-    )
-    
-    # Define the output file path
-    output_file = f"./Data/Output/consistency_judgments/{version_name}_big_c_test_{v1_model}_vs_{v2_model}.jsonl"
+    result_df = add_consistency_judgment_prompts(result_df, v1_model, v2_model)
     
     # Check if the file already exists
-    if os.path.exists(output_file):
+    if artifact_exists(output_file):
         print(f"File '{output_file}' already exists. Skipping file creation.")
     else:
         # Save to JSONL file
-        result_df.to_json(output_file, orient='records', lines=True)
+        write_artifact(output_file, result_df)
         print(f"File '{output_file}' has been created.")
 
+def _prepare_consistency_judgment_file_sharded(v1_t1_jsonl_path, other_files, v1_model, v2_model, output_file, shard_size):
+    """
+    prepare_consistency_judgment_file in bounded memory: v1's _t1 file is read shard by
+    shard and each shard is joined with the other three files through indexes on id.
+    """
+    if artifact_exists(output_file):
+        print(f"File '{output_file}' already exists. Skipping file creation.")
+        return output_file
+    with ExitStack() as stack:
+        indexes = [stack.enter_context(RecordIndex(path, columns)) for path, columns in other_files]
+
+        def prepare_shard(result_df):
+            for index in indexes:
+                result_df = index.merge(result_df, how='left', suffixes=('', '_dup'))
+            result_df = result_df.drop(columns=[col for col in result_df.columns if col.endswith('_dup')])
+            return add_consistency_judgment_prompts(result_df, v1_model, v2_model)
+
+        run_sharded(
+            v1_t1_jsonl_path, output_file, prepare_shard, shard_size,
+            extra_inputs=[path for path, _ in other_files]
+        )
+    print(f"File '{output_file}' has been created.")
+    return output_file
+
 all_models = [
     "gemini_1_5_pro", 
     "o1_preview", 
@@ -1,7 +1,9 @@
 import pandas as pd
 import json
 import asyncio
-import os
+from profiling import profiled
+from jsonl_io import read_jsonl, write_artifact, artifact_exists
+from sharded import RecordIndex, run_sharded, default_shard_size
 
 full_judgment_prompt = """
 You will be given a short conversation in English between two speakers. Conversant A always begins with a description of an image they are viewing.
@@ -31,11 +33,28 @@ Respond with **1**, **2**, or **3**:
 **Your response:**
 """ 
 
+def add_judgment_prompts(result_df, v1_model, v2_model):
+    # Add v1_model and v2_model columns
+    result_df['v1_model'] = v1_model
+    result_df['v2_model'] = v2_model
+
+    # Generate the full judgment prompt
+    result_df['full_judgment_prompt'] = result_df.apply(
+        lambda row: full_judgment_prompt.format(
+            conversation=row['joined_english_sentences'],
+            alternate_version_1=row[f'{v1_model}_translation'],
+            alternate_version_2=row[f'{v2_model}_translation']
+        ), axis=1
+    )
+    return result_df
+
+@profiled
 def prepare_judgment_file(
         v1_model,
         v2_model,
         input_version_name=None,
-        output_version_name=None
+        output_version_name=None,
+        shard_size=default_shard_size
     ):
     if input_version_name is None:
         v1_jsonl_path = f"./Data/Output/translations/big_c_conversations_test_{v1_model}.jsonl"
@@ -44,9 +63,18 @@ def prepare_judgment_file(
         v1_jsonl_path = f"./Data/Output/translations/{input_version_name}_big_c_conversations_test_{v1_model}.jsonl"
         v2_jsonl_path = f"./Data/Output/translations/{input_version_name}_big_c_conversations_test_{v2_model}.jsonl"
 
+    # Define the output file path
+    if output_version_name is None:
+        output_file = f"./Data/Output/judgments/big_c_test_{v1_model}_vs_{v2_model}.jsonl"
+    else:
+        output_file = f"./Data/Output/judgments/{output_version_name}_big_c_test_{v1_model}_vs_{v2_model}.jsonl"
+
+    if shard_size is not None:
+        return _prepare_judgment_file_sharded(v1_jsonl_path, v2_jsonl_path, v1_model, v2_model, output_file, shard_size)
+
     # Read JSONL files
-    df_1 = pd.read_json(v1_jsonl_path, lines=True)
-    df_2 = pd.read_json(v2_jsonl_path, lines=True)
+    df_1 = read_jsonl(v1_jsonl_path)
+    df_2 = read_jsonl(v2_jsonl_path)
 
     # Ensure 'id' is included in the columns to use from df_2
     columns_to_use_from_df2 = [
@@ -65,35 +93,41 @@ def prepare_judgment_file(
         how='inner'
     )
 
-    # Add v1_model and v2_model columns
-    result_df['v1_model'] = v1_model
-    result_df['v2_model'] = v2_model
-
-    # Generate the full judgment prompt
-    result_df['full_judgment_prompt'] = result_df.apply(
-        lambda row: full_judgment_prompt.format(
-            conversation=row['joined_english_sentences'],
-            alternate_version_1=row[f'{v1_model}_translation'],
-            alternate_version_2=row[f'{v2_model}_translation']
-        ), axis=1
-    )
-
-    # Define the output file path
-    if output_version_name is None:
-        output_file = f"./Data/Output/judgments/big_c_test_{v1_model}_vs_{v2_model}.jsonl"
-    else:
-        output_file = f"./Data/Output/judgments/{output_version_name}_big_c_test_{v1_model}_vs_{v2_model}.jsonl"
+    result_df = add_judgment_prompts(result_df, v1_model, v2_model)
 
     # Check if the file already exists
-    if os.path.exists(output_file):
+    if artifact_exists(output_file):
         print(f"File '{output_file}' already exists. Skipping file creation.")
     else:
         # Save to JSONL file
-        result_df.to_json(output_file, orient='records', lines=True)
+        write_artifact(output_file, result_df)
         print(f"File '{output_file}' has been created.")
 
     return output_file
 
+def _prepare_judgment_file_sharded(v1_jsonl_path, v2_jsonl_path, v1_model, v2_model, output_file, shard_size):
+    """
+    prepare_judgment_file in bounded memory: v1's file is read shard by shard and each
+    shard is joined with v2's file through an index on id.
+    """
+    if artifact_exists(output_file):
+        print(f"File '{output_file}' already exists. Skipping file creation.")
+        return output_file
+    columns_1 = list(read_jsonl(v1_jsonl_path, nrows=1).columns)
+    columns_2 = list(read_jsonl(v2_jsonl_path, nrows=1).columns)
+    columns_to_use_from_df2 = [
+        col for col in columns_2
+        if col == 'id' or col not in columns_1 or col == f'{v2_model}_translation'
+    ]
+    with RecordIndex(v2_jsonl_path, columns_to_use_from_df2) as index:
+        run_sharded(
+            v1_jsonl_path, output_file,
+            lambda df: add_judgment_prompts(index.merge(df, how='inner'), v1_model, v2_model),
+            shard_size, extra_inputs=[v2_jsonl_path]
+        )
+    print(f"File '{output_file}' has been created.")
+    return output_file
+
 def main():
     prepare_judgment_file(
         v1_model="google_translate",
@@ -0,0 +1,279 @@
+import os
+import sys
+import json
+import time
+import inspect
+import logging
+import threading
+import functools
+import tracemalloc
+from datetime import datetime
+from collections import Counter
+from typing import Optional
+
+try:
+    import resource
+except ImportError:
+    # Not available on Windows
+    resource = None
+
+logging.basicConfig(level=logging.INFO)
+
+# Profiling is opt-in: PROFILE_STAGES=1 profiles every stage entry point, and
+# PROFILE_SAMPLING=1 adds a sampling profile of the Python stack
+profile_stages = os.environ.get("PROFILE_STAGES") == "1"
+profile_sampling = os.environ.get("PROFILE_SAMPLING") == "1"
+profile_report_folder = "./Data/Output/profiles"
+
+# Sampler settings
+memory_interval = 0.01
+sampling_interval = 0.005
+top_allocation_sites = 10
+top_functions = 20
+# tracemalloc keeps a snapshot of the allocations whenever traced memory grows by this factor
+snapshot_growth = 1.1
+
+_report_file_path = None
+_report = {'started': None, 'argv': sys.argv, 'stages': []}
+_report_lock = threading.Lock()
+# The profiles of the stages running now
+_active_stages = set()
+# Whether the profiled stages started tracemalloc, which is global to the process: it
+# runs while any stage is active, and is stopped by the last one to finish
+_tracing_started = False
+
+
+def _current_rss() -> Optional[int]:
+    """Resident set size of this process in bytes."""
+    try:
+        with open("/proc/self/statm", 'r') as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, AttributeError):
+        pass
+    if resource is not None:
+        # Without /proc only the peak since the process started is known
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak if sys.platform == 'darwin' else peak * 1024
+    return None
+
+
+def _frame_key(frame) -> str:
+    code = frame.f_code
+    return f"{code.co_filename}:{code.co_firstlineno} {code.co_name}"
+
+
+class _Sampler(threading.Thread):
+    """Background thread that tracks peak RSS and, optionally, samples the stage's stack."""
+
+    def __init__(self, thread_id: int, sample_stack: bool):
+        super().__init__(daemon=True)
+        self.thread_id = thread_id
+        self.sample_stack = sample_stack
+        self.stop_event = threading.Event()
+        self.peak_rss = _current_rss()
+        self.snapshot = None
+        self.snapshot_size = 0
+        self.samples = 0
+        self.self_counts = Counter()
+        self.cumulative_counts = Counter()
+
+    def run(self):
+        interval = sampling_interval if self.sample_stack else memory_interval
+        last_memory_check = 0.0
+        while not self.stop_event.wait(interval):
+            now = time.perf_counter()
+            if now - last_memory_check >= memory_interval:
+                last_memory_check = now
+                rss = _current_rss()
+                if rss is not None and (self.peak_rss is None or rss > self.peak_rss):
+                    self.peak_rss = rss
+                traced, _ = tracemalloc.get_traced_memory()
+                if traced > self.snapshot_size * snapshot_growth:
+                    self.snapshot = tracemalloc.take_snapshot()
+                    self.snapshot_size = traced
+            if self.sample_stack:
+                self._sample()
+
+    def _sample(self):
+        frame = sys._current_frames().get(self.thread_id)
+        if frame is None:
+            return
+        self.samples += 1
+        self.self_counts[_frame_key(frame)] += 1
+        seen = set()
+        while frame is not None:
+            key = _frame_key(frame)
+            if key not in seen:
+                seen.add(key)
+                self.cumulative_counts[key] += 1
+            frame = frame.f_back
+
+    def stop(self):
+        self.stop_event.set()
+        self.join()
+
+
+class StageProfile:
+    """Wall and CPU time, peak RSS, allocation sites and an optional stack sample of one stage run."""
+
+    def __init__(self, name: str, sample_stack: bool = profile_sampling):
+        self.name = name
+        self.sample_stack = sample_stack
+
+    def __enter__(self):
+        global _tracing_started
+        with _report_lock:
+            _active_stages.add(self)
+            # Every running stage overlaps the one starting now
+            self.concurrent_stages = 1
+            for profile in _active_stages:
+                profile.concurrent_stages = max(profile.concurrent_stages, len(_active_stages))
+            if len(_active_stages) == 1:
+                if not tracemalloc.is_tracing():
+                    tracemalloc.start()
+                    _tracing_started = True
+                tracemalloc.reset_peak()
+        self.start_rss = _current_rss()
+        self.start_wall = time.perf_counter()
+        self.start_cpu = time.process_time()
+        self.start_times = os.times()
+        self.sampler = _Sampler(threading.get_ident(), self.sample_stack)
+        self.sampler.start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        global _tracing_started
+        wall = time.perf_counter() - self.start_wall
+        cpu = time.process_time() - self.start_cpu
+        # Worker processes (the process pools of compile_prepared_files and the bootstrap)
+        # are counted once they have exited
+        end_times = os.times()
+        child_cpu = (end_times.children_user - self.start_times.children_user
+                     + end_times.children_system - self.start_times.children_system)
+        self.sampler.stop()
+        with _report_lock:
+            # The traced allocations are the whole process's, so they are only this
+            # stage's when no other stage overlapped it
+            if self.concurrent_stages == 1:
+                _, traced_peak = tracemalloc.get_traced_memory()
+                snapshot = self.sampler.snapshot or tracemalloc.take_snapshot()
+            else:
+                traced_peak = snapshot = None
+            _active_stages.discard(self)
+            if not _active_stages and _tracing_started:
+                tracemalloc.stop()
+                _tracing_started = False
+
+        if snapshot is not None:
+            snapshot = snapshot.filter_traces([
+                tracemalloc.Filter(False, tracemalloc.__file__),
+                tracemalloc.Filter(False, __file__)
+            ])
+        record = {
+            'stage': self.name,
+            'finished': datetime.now().isoformat(timespec='seconds'),
+            'failed': exc_type is not None,
+            'wall_seconds': wall,
+            'cpu_seconds': cpu,
+            'child_cpu_seconds': child_cpu,
+            'start_rss_mb': None if self.start_rss is None else self.start_rss / 2**20,
+            'peak_rss_mb': None if self.sampler.peak_rss is None else self.sampler.peak_rss / 2**20,
+            # None when other stages overlapped this one
+            'traced_peak_mb': None if traced_peak is None else traced_peak / 2**20,
+            # CPU time and memory are per process; stages that overlapped share them
+            'concurrent_stages': self.concurrent_stages,
+            'top_allocation_sites': None if snapshot is None else [
+                {'site': str(stat.traceback[0]), 'size_mb': stat.size / 2**20, 'count': stat.count}
+                for stat in snapshot.statistics('lineno')[:top_allocation_sites]
+            ]
+        }
+        if self.sample_stack and self.sampler.samples:
+            samples = self.sampler.samples
+            record['sampling_profile'] = {
+                'samples': samples,
+                'interval_seconds': sampling_interval,
+                'self': [{'function': key, 'share': count / samples}
+                         for key, count in self.sampler.self_counts.most_common(top_functions)],
+                'cumulative': [{'function': key, 'share': count / samples}
+                               for key, count in self.sampler.cumulative_counts.most_common(top_functions)]
+            }
+        _write_record(record)
+        logging.info(
+            f"[profile] {self.name}: {wall:.2f}s wall, {cpu:.2f}s CPU, "
+            f"peak RSS {record['peak_rss_mb'] or 0:.0f} MB, traced peak "
+            + ("shared with overlapping stages" if traced_peak is None else f"{record['traced_peak_mb']:.0f} MB")
+        )
+        return False
+
+
+def _write_record(record: dict):
+    """Add the record to this run's report file, rewritten whole so it is always valid JSON."""
+    global _report_file_path
+    with _report_lock:
+        if _report_file_path is None:
+            _report['started'] = datetime.now().isoformat(timespec='seconds')
+            os.makedirs(profile_report_folder, exist_ok=True)
+            _report_file_path = os.path.join(
+                profile_report_folder, f"profile_{datetime.now():%Y%m%d_%H%M%S}_{os.getpid()}.json"
+            )
+        _report['stages'].append(record)
+        temporary_file_path = f"{_report_file_path}.tmp"
+        with open(temporary_file_path, 'w') as f:
+            json.dump(_report, f, indent=2)
+        os.replace(temporary_file_path, _report_file_path)
+
+
+def profiled(func):
+    """
+    Profile every call of a stage entry point when PROFILE_STAGES=1. Without the flag
+    the function is returned unchanged, so it costs nothing.
+    """
+    if not profile_stages:
+        return func
+    name = f"{func.__module__}.{func.__qualname__}"
+    if inspect.iscoroutinefunction(func):
+        @functools.wraps(func)
+        async def async_wrapper(*args, **kwargs):
+            with StageProfile(name):
+                return await func(*args, **kwargs)
+        return async_wrapper
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        with StageProfile(name):
+            return func(*args, **kwargs)
+    return wrapper
+
+
+def _load_reports():
+    reports = []
+    if os.path.isdir(profile_report_folder):
+        for file_name in sorted(os.listdir(profile_report_folder)):
+            if file_name.startswith("profile_") and file_name.endswith(".json"):
+                with open(os.path.join(profile_report_folder, file_name), 'r') as f:
+                    reports.append((file_name, json.load(f)))
+    return reports
+
+
+def main():
+    """Compare each stage's last profiled run with the run before it."""
+    runs = {}
+    for file_name, report in _load_reports():
+        for record in report['stages']:
+            runs.setdefault(record['stage'], []).append(record)
+    print(f"{'stage':<60}{'wall s':>9}{'x prev':>8}{'CPU s':>9}{'x prev':>8}{'peak MB':>9}{'x prev':>8}")
+    for stage, records in sorted(runs.items()):
+        last = records[-1]
+        previous = records[-2] if len(records) > 1 else None
+
+        def ratio(key):
+            if previous is None or not previous.get(key) or last.get(key) is None:
+                return ''
+            return f"{last[key] / previous[key]:.2f}"
+
+        print(f"{stage:<60}{last['wall_seconds']:>9.2f}{ratio('wall_seconds'):>8}{last['cpu_seconds']:>9.2f}"
+              f"{ratio('cpu_seconds'):>8}{last['peak_rss_mb'] or 0:>9.0f}{ratio('peak_rss_mb'):>8}")
+
+
+if __name__ == "__main__":
+    main()
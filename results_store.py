@@ -0,0 +1,190 @@
+import sqlite3
+from typing import Dict, Iterable, List, Optional
+
+try:
+    import orjson
+
+    def _loads(data):
+        return orjson.loads(data)
+
+    def _dumps(obj) -> bytes:
+        return orjson.dumps(obj, option=orjson.OPT_SERIALIZE_NUMPY)
+except ImportError:
+    import json
+
+    def _loads(data):
+        return json.loads(data)
+
+    def _dumps(obj) -> bytes:
+        return json.dumps(obj).encode('utf-8')
+
+# Fields that are the same for every model; stored once per conversation
+CONVERSATION_FIELDS = [
+    "bemba_sentences",
+    "english_sentences",
+    "img_path",
+    "joined_bemba_sentences",
+    "joined_english_sentences"
+]
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS conversations (
+    id INTEGER PRIMARY KEY,
+    record BLOB NOT NULL
+);
+CREATE TABLE IF NOT EXISTS results (
+    model TEXT NOT NULL,
+    id INTEGER NOT NULL,
+    record BLOB NOT NULL,
+    PRIMARY KEY (model, id)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS scores (
+    model TEXT NOT NULL,
+    id INTEGER NOT NULL,
+    scores BLOB NOT NULL,
+    PRIMARY KEY (model, id)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS results_by_id ON results (id);
+CREATE INDEX IF NOT EXISTS scores_by_id ON scores (id);
+"""
+
+
+class ResultsStore:
+    """
+    SQLite store of the prepared per-model records, indexed by (model, id).
+
+    The source fields of a conversation are stored once in `conversations`; each
+    model's own fields ({model}_translation, {model}_bertscore, the prompt, ...) are
+    one row of `results`, and the compiled per-id scores one row of `scores`. Any
+    single record, or a conversation across all models, is a primary key lookup.
+    """
+
+    def __init__(self, db_path: str):
+        self.db_path = db_path
+        self.connection = sqlite3.connect(db_path)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.executescript(SCHEMA)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def close(self):
+        self.connection.commit()
+        self.connection.close()
+
+    def write_model(self, model_name: str, data_dict: Dict[int, dict]):
+        """Replace all records of one model with data_dict ({id -> record})."""
+        conversation_rows = []
+        result_rows = []
+        for id_value, record in data_dict.items():
+            conversation = {field: record[field] for field in CONVERSATION_FIELDS if field in record}
+            own_fields = {field: value for field, value in record.items()
+                          if field not in CONVERSATION_FIELDS and field != 'id'}
+            conversation_rows.append((int(id_value), _dumps(conversation)))
+            result_rows.append((model_name, int(id_value), _dumps(own_fields)))
+        with self.connection:
+            self.connection.executemany(
+                "INSERT OR REPLACE INTO conversations (id, record) VALUES (?, ?)", conversation_rows
+            )
+            self.connection.execute("DELETE FROM results WHERE model = ?", (model_name,))
+            self.connection.executemany(
+                "INSERT INTO results (model, id, record) VALUES (?, ?, ?)", result_rows
+            )
+
+    def write_scores(self, model_scores: Dict[str, Dict[str, dict]]):
+        """Replace the scores of every model in model_scores ({model -> {id_str -> {score_key: score}}})."""
+        with self.connection:
+            for model_name, scores in model_scores.items():
+                self.connection.execute("DELETE FROM scores WHERE model = ?", (model_name,))
+                self.connection.executemany(
+                    "INSERT INTO scores (model, id, scores) VALUES (?, ?, ?)",
+                    [(model_name, int(id_str), _dumps(id_scores)) for id_str, id_scores in scores.items()]
+                )
+
+    def retain_models(self, model_names: Iterable[str]):
+        """
+        Delete the records and scores of every model not in model_names, such as a model
+        whose translation file was removed, and the conversations no model has left.
+        """
+        model_names = list(model_names)
+        not_kept = f"model NOT IN ({','.join('?' * len(model_names))})"
+        with self.connection:
+            self.connection.execute(f"DELETE FROM results WHERE {not_kept}", model_names)
+            self.connection.execute(f"DELETE FROM scores WHERE {not_kept}", model_names)
+            self.connection.execute("DELETE FROM conversations WHERE id NOT IN (SELECT id FROM results)")
+
+    def models(self) -> List[str]:
+        return [row[0] for row in self.connection.execute("SELECT DISTINCT model FROM results ORDER BY model")]
+
+    def ids(self) -> List[int]:
+        return [row[0] for row in self.connection.execute("SELECT id FROM conversations ORDER BY id")]
+
+    def conversations(self) -> Dict[int, dict]:
+        """Source fields of every conversation, by id."""
+        return {
+            id_value: _loads(record)
+            for id_value, record in self.connection.execute("SELECT id, record FROM conversations ORDER BY id")
+        }
+
+    def get_record(self, model_name: str, id_value: int) -> Optional[dict]:
+        """The record of one model for one conversation, as in the prepared {model}.json file."""
+        row = self.connection.execute(
+            "SELECT c.record, r.record FROM results r JOIN conversations c ON c.id = r.id "
+            "WHERE r.model = ? AND r.id = ?",
+            (model_name, int(id_value))
+        ).fetchone()
+        if row is None:
+            return None
+        return {'id': int(id_value), **_loads(row[0]), **_loads(row[1])}
+
+    def get_scores(self, model_name: str, id_value: int) -> Optional[dict]:
+        row = self.connection.execute(
+            "SELECT scores FROM scores WHERE model = ? AND id = ?", (model_name, int(id_value))
+        ).fetchone()
+        return None if row is None else _loads(row[0])
+
+    def get_conversation(self, id_value: int) -> Optional[dict]:
+        """
+        One conversation across all models:
+        {'id', <source fields>, 'models': {model: {'record': {...}, 'scores': {...}}}}.
+        """
+        row = self.connection.execute(
+            "SELECT record FROM conversations WHERE id = ?", (int(id_value),)
+        ).fetchone()
+        if row is None:
+            return None
+        conversation = {'id': int(id_value), **_loads(row[0]), 'models': {}}
+        for model_name, record in self.connection.execute(
+            "SELECT model, record FROM results WHERE id = ? ORDER BY model", (int(id_value),)
+        ):
+            conversation['models'][model_name] = {'record': _loads(record), 'scores': None}
+        for model_name, scores in self.connection.execute(
+            "SELECT model, scores FROM scores WHERE id = ?", (int(id_value),)
+        ):
+            if model_name in conversation['models']:
+                conversation['models'][model_name]['scores'] = _loads(scores)
+        return conversation
+
+    def get_model_records(self, model_name: str, ids: Optional[Iterable[int]] = None) -> Dict[int, dict]:
+        """Records of one model, for all ids or only the given ones."""
+        if ids is None:
+            rows = self.connection.execute(
+                "SELECT r.id, c.record, r.record FROM results r JOIN conversations c ON c.id = r.id "
+                "WHERE r.model = ? ORDER BY r.id",
+                (model_name,)
+            ).fetchall()
+        else:
+            rows = [
+                row for id_value in ids for row in self.connection.execute(
+                    "SELECT r.id, c.record, r.record FROM results r JOIN conversations c ON c.id = r.id "
+                    "WHERE r.model = ? AND r.id = ?",
+                    (model_name, int(id_value))
+                )
+            ]
+        return {
+            id_value: {'id': id_value, **_loads(conversation), **_loads(record)}
+            for id_value, conversation, record in rows
+        }
@@ -0,0 +1,209 @@
+import os
+import json
+import logging
+import numpy as np
+from battle_store import BattleStore, battle_pairs
+from bradley_terry import fit_bradley_terry, pair_counts_to_matrices, rank_models, sum_pair_counts, to_elo_scale
+from create_elo_ratings import PRIOR_GAMES, battles_file_path
+from results_store import ResultsStore
+from profiling import profiled
+
+logging.basicConfig(level=logging.INFO)
+
+results_store_file_path = "./Data/Output/prepared_files/results.sqlite"
+output_folder = "./Data/Output/evaluation_subsets"
+
+# Battle type whose past outcomes decide how discriminative a conversation is
+reference_battle_type = "judgment_battles"
+# Subset sizes to evaluate, as fractions of all conversations
+subset_fractions = [0.05, 0.1, 0.15, 0.2, 0.3, 0.5]
+# A subset reproduces a model's full-set rating when it is within this many Elo points
+# and the model keeps its rank
+tolerance_elo = 50
+# Strata: conversation length quantiles x discrimination quantiles
+length_bins = 4
+discrimination_bins = 3
+# Random subsets of the same size, as a baseline
+random_baseline_draws = 20
+seed = 0
+
+
+def conversation_lengths(ids: np.ndarray) -> np.ndarray:
+    """Number of words in each conversation's Bemba source."""
+    with ResultsStore(results_store_file_path) as store:
+        conversations = store.conversations()
+    return np.array([
+        len(conversations.get(int(id_value), {}).get('joined_bemba_sentences', '').split())
+        for id_value in ids
+    ])
+
+
+def discrimination_power(battles_of_type, n_ids: int, ratings: np.ndarray, excluded_model: int = None) -> np.ndarray:
+    """
+    Per conversation, the share of its decided battles won by the model that is rated
+    higher on the full set, minus the share won by the lower rated one. Conversations
+    where the judge's verdicts follow the overall ranking score close to 1. The battles
+    of excluded_model are left out.
+    """
+    conversation, pairs, pair_index, result, _ = battles_of_type
+    first, second = pairs[pair_index, 0], pairs[pair_index, 1]
+    decided = result != 2
+    if excluded_model is not None:
+        decided &= (first != excluded_model) & (second != excluded_model)
+    winner = np.where(result == 0, first, second)[decided]
+    loser = np.where(result == 0, second, first)[decided]
+    agree = np.bincount(conversation[decided], weights=ratings[winner] > ratings[loser], minlength=n_ids)
+    decided = np.bincount(conversation[decided], minlength=n_ids)
+    disagree = decided - agree
+    return np.where(decided > 0, (agree - disagree) / np.maximum(decided, 1), 0.0)
+
+
+def quantile_bins(values: np.ndarray, n_bins: int) -> np.ndarray:
+    edges = np.quantile(values, np.linspace(0, 1, n_bins + 1)[1:-1])
+    return np.searchsorted(edges, values, side='right')
+
+
+def stratified_subset(strata: np.ndarray, order_by: np.ndarray, size: int) -> np.ndarray:
+    """
+    Indices of `size` conversations, allocated to strata in proportion to their size
+    (largest remainder). Within a stratum the conversations are sorted by `order_by` and
+    picked at evenly spaced positions, so the subset keeps the stratum's spread rather
+    than only its extremes.
+    """
+    labels, counts = np.unique(strata, return_counts=True)
+    quota = counts / counts.sum() * size
+    allocation = np.floor(quota).astype(int)
+    for k in np.argsort(-(quota - allocation))[:size - allocation.sum()]:
+        allocation[k] += 1
+    selected = []
+    for label, n in zip(labels, allocation):
+        if n == 0:
+            continue
+        members = np.flatnonzero(strata == label)
+        members = members[np.argsort(order_by[members], kind='stable')]
+        positions = np.round((np.arange(n) + 0.5) * len(members) / n - 0.5).astype(int)
+        selected.extend(members[positions])
+    return np.sort(np.array(selected, dtype=int))
+
+
+def battles_on(battles: BattleStore, battle_type: str, ids: np.ndarray):
+    """
+    The battles of a battle type on the given conversations, as (conversation, pairs,
+    pair_index, result, played): conversation indexes ids, played holds the models that
+    took part and pairs, from battle_pairs, index played.
+    """
+    id_indices, model_1, model_2, outcome = battles.select(battle_type)
+    conversation = np.minimum(np.searchsorted(ids, id_indices), len(ids) - 1)
+    on_ids = ids[conversation] == id_indices
+    pairs, pair_index, result = battle_pairs(model_1[on_ids], model_2[on_ids], outcome[on_ids], len(battles.models))
+    played, pairs = np.unique(pairs, return_inverse=True)
+    return conversation[on_ids], pairs.reshape(-1, 2), pair_index, result, played
+
+
+def ratings_on_subsets(battles_of_type, in_subsets: np.ndarray, excluded_model: int = None) -> np.ndarray:
+    """
+    Ratings of the played models from the battles on each subset, fitted as one batch.
+    in_subsets has shape (n_subsets, n_ids); the battles of excluded_model are left out.
+    """
+    conversation, pairs, pair_index, result, played = battles_of_type
+    counts = np.stack([
+        sum_pair_counts(pair_index, result, len(pairs), in_subset[conversation].astype(float))
+        for in_subset in in_subsets
+    ])
+    if excluded_model is not None:
+        counts[:, (pairs == excluded_model).any(axis=1)] = 0
+    log10_strength, _ = fit_bradley_terry(*pair_counts_to_matrices(pairs, counts, len(played)), prior_games=PRIOR_GAMES)
+    return to_elo_scale(log10_strength)
+
+
+def select_subsets(reference, lengths: np.ndarray, sizes: list, excluded_model: int = None) -> list:
+    """
+    A stratified subset of every size. Discrimination power comes from the reference
+    battles and ratings without excluded_model, so the subsets are chosen blind to it.
+    """
+    n_ids = len(lengths)
+    ratings = ratings_on_subsets(reference, np.ones((1, n_ids), dtype=bool), excluded_model)[0]
+    discrimination = discrimination_power(reference, n_ids, ratings, excluded_model)
+    strata = quantile_bins(lengths, length_bins) * discrimination_bins + quantile_bins(discrimination, discrimination_bins)
+    return [stratified_subset(strata, discrimination, size) for size in sizes]
+
+
+def reproduced(full_ratings: np.ndarray, subset_ratings: np.ndarray):
+    """Per subset and model: the rating difference to the full set, and whether the rank is the same."""
+    differences = np.abs(subset_ratings - full_ratings)
+    return differences, rank_models(subset_ratings) == rank_models(full_ratings)
+
+
+@profiled
+def main():
+    battles = BattleStore.load(battles_file_path)
+    # Conversations the reference battle type was judged on
+    ids = np.unique(battles.select(reference_battle_type)[0])
+    n_ids = len(ids)
+    logging.info(f"{n_ids} conversations with {reference_battle_type}")
+
+    # Battle types with at least two rated models on these conversations
+    battles_by_type = {bt: battles_on(battles, bt, ids) for bt in battles.battle_types}
+    battles_by_type = {bt: b for bt, b in battles_by_type.items() if len(b[4]) > 1}
+    full_ratings = {bt: ratings_on_subsets(b, np.ones((1, n_ids), dtype=bool))[0] for bt, b in battles_by_type.items()}
+    reference = battles_by_type[reference_battle_type]
+    lengths = conversation_lengths(battles.ids[ids])
+    sizes = [max(1, int(round(fraction * n_ids))) for fraction in subset_fractions]
+
+    subsets = select_subsets(reference, lengths, sizes)
+    # Fidelity is measured out of sample: each model is held out of the choice of the
+    # subsets that are then checked on it, as a new model would be
+    held_out = reference[4]
+    held_out_subsets = [select_subsets(reference, lengths, sizes, excluded_model=k) for k in range(len(held_out))]
+
+    rng = np.random.default_rng(seed)
+    os.makedirs(output_folder, exist_ok=True)
+    report = {'tolerance_elo': tolerance_elo, 'reference_battle_type': reference_battle_type, 'subsets': []}
+    print(f"\n{'size':>6}{'battle type':>34}{'max diff':>10}{'mean diff':>11}{'same rank':>11}{'ok':>5}{'random ok':>11}")
+    for size_index, (fraction, size) in enumerate(zip(subset_fractions, sizes)):
+        subset_report = {'fraction': fraction, 'size': size, 'battle_types': {}}
+        for battle_type, battles_of_type in battles_by_type.items():
+            played = battles_of_type[4]
+            # Each held-out model is checked on the subset chosen without it
+            rows = [row for row, model in enumerate(held_out) if model in played]
+            if not rows:
+                continue
+            positions = np.searchsorted(played, held_out[rows])
+            in_subsets = np.zeros((len(rows), n_ids), dtype=bool)
+            for i, row in enumerate(rows):
+                in_subsets[i, held_out_subsets[row][size_index]] = True
+            differences, same_rank = reproduced(full_ratings[battle_type], ratings_on_subsets(battles_of_type, in_subsets))
+            differences = differences[np.arange(len(rows)), positions]
+            same_rank = same_rank[np.arange(len(rows)), positions]
+            # How often a random subset of the same size keeps every model within tolerance
+            in_subsets = np.zeros((random_baseline_draws, n_ids), dtype=bool)
+            for draw in range(random_baseline_draws):
+                in_subsets[draw, rng.choice(n_ids, size=size, replace=False)] = True
+            random_differences, random_same_rank = reproduced(
+                full_ratings[battle_type], ratings_on_subsets(battles_of_type, in_subsets)
+            )
+            random_ok = ((random_differences <= tolerance_elo) & random_same_rank).all(axis=1).mean()
+            result = {
+                'held_out_models': len(rows),
+                'max_elo_difference': float(differences.max()),
+                'mean_elo_difference': float(differences.mean()),
+                'same_rank_rate': float(same_rank.mean()),
+                'within_tolerance': bool(((differences <= tolerance_elo) & same_rank).all()),
+                'random_within_tolerance_rate': float(random_ok)
+            }
+            subset_report['battle_types'][battle_type] = result
+            print(f"{size:>6}{battle_type:>34}{result['max_elo_difference']:>10.1f}{result['mean_elo_difference']:>11.1f}"
+                  f"{result['same_rank_rate']:>11.2f}{'yes' if result['within_tolerance'] else 'no':>5}{random_ok:>11.2f}")
+        report['subsets'].append(subset_report)
+
+        subset_file_path = os.path.join(output_folder, f"subset_{int(round(fraction * 100))}.json")
+        with open(subset_file_path, 'w') as f:
+            json.dump({'fraction': fraction, 'ids': battles.ids[ids[subsets[size_index]]].tolist()}, f, indent=2)
+
+    with open(os.path.join(output_folder, "subset_report.json"), 'w') as f:
+        json.dump(report, f, indent=2)
+    logging.info(f"Subsets and fidelity report saved to {output_folder}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,184 @@
+import os
+import json
+import shutil
+import sqlite3
+import logging
+import tempfile
+from typing import Callable, Iterable, List, Optional
+from jsonl_io import (
+    artifact_path, concat_artifacts, dumps, iter_jsonl, list_artifacts, loads,
+    read_jsonl_shards, records_to_frame, reference_texts, write_jsonl
+)
+
+logging.basicConfig(level=logging.INFO)
+
+# Checkpoints of the sharded stages, one folder per output file, removed once merged
+shards_folder = "./Data/Output/shards"
+# Rows per shard. Set SHARD_SIZE to run the stages sharded, in memory bounded by a
+# shard instead of the whole file, for corpora larger than RAM.
+default_shard_size = int(os.environ.get("SHARD_SIZE") or 0) or None
+
+
+def shard_folder(output_path) -> str:
+    return os.path.join(shards_folder, os.path.splitext(os.path.basename(str(output_path)))[0])
+
+
+def shard_path(output_path, k: int) -> str:
+    return os.path.join(shard_folder(output_path), f"shard_{k:05d}.jsonl")
+
+
+def _shards_key(input_paths: List[str], shard_size: int) -> dict:
+    key = {'inputs': [], 'shard_size': shard_size}
+    for input_path in input_paths:
+        stat = os.stat(artifact_path(input_path))
+        key['inputs'].append([str(input_path), stat.st_size, stat.st_mtime])
+    return key
+
+
+def shards_are_current(input_paths: List[str], output_path, shard_size: int) -> bool:
+    """Whether the checkpoints of output_path were written from the same, unchanged inputs in shards of the same size."""
+    state_file_path = os.path.join(shard_folder(output_path), "shards.json")
+    if not os.path.exists(state_file_path):
+        return False
+    with open(state_file_path, 'r') as f:
+        return json.load(f) == _shards_key(input_paths, shard_size)
+
+
+def prepare_shards(input_paths: List[str], output_path, shard_size: int) -> str:
+    """
+    The checkpoint folder of output_path. The checkpoints of an earlier run are kept if
+    it read the same, unchanged inputs in shards of the same size, and removed otherwise.
+    """
+    folder = shard_folder(output_path)
+    key = _shards_key(input_paths, shard_size)
+    if shards_are_current(input_paths, output_path, shard_size):
+        return folder
+    if os.path.isdir(folder):
+        logging.info(f"Removing stale shards in {folder}")
+        shutil.rmtree(folder)
+    os.makedirs(folder, exist_ok=True)
+    with open(os.path.join(folder, "shards.json"), 'w') as f:
+        json.dump(key, f, indent=2)
+    return folder
+
+
+def write_shard(path: str, rows):
+    """Checkpoint the rows of one shard, records or a DataFrame."""
+    write_jsonl(path, reference_texts(rows))
+
+
+def merge_shards(output_path) -> Optional[str]:
+    """
+    Stream the checkpoints of output_path, in order, into the output artifact and remove
+    them. Returns the path written, or None if the shards hold no rows.
+    """
+    folder = shard_folder(output_path)
+    shard_paths = [path for path, _ in list_artifacts(folder, "shard_")]
+    if not any(os.path.getsize(path) for path in shard_paths):
+        logging.warning(f"No data to save for {output_path}.")
+        written = None
+    else:
+        written = concat_artifacts(shard_paths, output_path)
+        logging.info(f"Merged {len(shard_paths)} shards into {written}")
+    shutil.rmtree(folder)
+    return written
+
+
+def _pending_shards(input_path: str, output_path, shard_size: int, columns: Optional[List[str]], extra_inputs: List[str]):
+    """(checkpoint path, DataFrame) of the shards of input_path without a checkpoint yet."""
+    prepare_shards([input_path] + extra_inputs, output_path, shard_size)
+    for k, df in enumerate(read_jsonl_shards(input_path, shard_size, columns)):
+        path = shard_path(output_path, k)
+        if os.path.exists(path):
+            continue
+        yield k, path, df
+
+
+def run_sharded(
+    input_path: str,
+    output_path,
+    process_shard: Callable,
+    shard_size: int,
+    columns: Optional[List[str]] = None,
+    extra_inputs: Optional[List[str]] = None
+) -> Optional[str]:
+    """
+    Run a stage over input_path shard_size rows at a time. process_shard takes the
+    DataFrame of one shard and returns its output rows, as a DataFrame or records; each
+    shard's output is checkpointed as soon as it is done, and the checkpoints are
+    streamed into output_path at the end. A rerun after an interruption skips the
+    checkpointed shards. extra_inputs are other files the stage reads, such as the
+    other side of a join; a change to any input discards the checkpoints.
+    """
+    for k, path, df in _pending_shards(input_path, output_path, shard_size, columns, extra_inputs or []):
+        write_shard(path, process_shard(df))
+        logging.info(f"{output_path}: shard {k} done ({len(df)} rows)")
+    return merge_shards(output_path)
+
+
+async def run_sharded_async(
+    input_path: str,
+    output_path,
+    process_shard: Callable,
+    shard_size: int,
+    columns: Optional[List[str]] = None,
+    extra_inputs: Optional[List[str]] = None
+) -> Optional[str]:
+    """run_sharded for a coroutine process_shard."""
+    for k, path, df in _pending_shards(input_path, output_path, shard_size, columns, extra_inputs or []):
+        write_shard(path, await process_shard(df))
+        logging.info(f"{output_path}: shard {k} done ({len(df)} rows)")
+    return merge_shards(output_path)
+
+
+def _batches(items: List, batch_size: int) -> Iterable[List]:
+    for start in range(0, len(items), batch_size):
+        yield items[start:start + batch_size]
+
+
+class RecordIndex:
+    """
+    The records of a file in a temporary SQLite table indexed by id, so that another
+    file can be joined with it shard by shard, with neither held in memory. merge()
+    gives the same rows, in the same order, as merging the shard with the whole file.
+    """
+
+    def __init__(self, file_path: str, columns: Optional[List[str]] = None):
+        os.makedirs(shards_folder, exist_ok=True)
+        self._directory = tempfile.mkdtemp(prefix="record_index_", dir=shards_folder)
+        self.connection = sqlite3.connect(os.path.join(self._directory, "records.sqlite"))
+        self.connection.execute("CREATE TABLE records (id, record BLOB NOT NULL)")
+        seen_columns = dict.fromkeys(columns or [])
+        rows = 0
+        for record in iter_jsonl(file_path, columns):
+            seen_columns.update(dict.fromkeys(record))
+            self.connection.execute("INSERT INTO records (id, record) VALUES (?, ?)", (record['id'], dumps(record)))
+            rows += 1
+        self.connection.execute("CREATE INDEX records_by_id ON records (id)")
+        self.connection.commit()
+        self.columns = list(seen_columns)
+        logging.info(f"Indexed {rows} rows of {file_path}")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def close(self):
+        self.connection.close()
+        shutil.rmtree(self._directory, ignore_errors=True)
+
+    def merge(self, df, how: str = 'inner', suffixes=('_x', '_y')):
+        """df.merge(<the indexed file>, on='id', how=how, suffixes=suffixes)."""
+        ids = list(dict.fromkeys(df['id'].tolist()))
+        records = []
+        # SQLite limits the number of parameters of one statement
+        for batch in _batches(ids, 500):
+            records.extend(loads(record) for (record,) in self.connection.execute(
+                f"SELECT record FROM records WHERE id IN ({','.join('?' * len(batch))}) ORDER BY rowid", batch
+            ))
+        right = records_to_frame(records, self.columns)
+        if right.empty:
+            right = right.astype({'id': df['id'].dtype})
+        return df.merge(right, on='id', how=how, suffixes=suffixes)
@@ -0,0 +1,219 @@
+import os
+import sqlite3
+import hashlib
+import logging
+from typing import Dict, Iterable, Iterator, List
+import numpy as np
+
+logging.basicConfig(level=logging.INFO)
+
+# Shared by every artifact in Data/Output; the artifacts only hold references into it
+text_store_file_path = "./Data/Output/texts.sqlite"
+# Strings at least this long are stored once and referenced; a reference is 38 characters
+min_text_length = 64
+# Marks a reference to a stored text; no text written by a stage starts with NUL
+TEXT_REFERENCE_PREFIX = "\x00text:"
+# Records resolved per query, and resolved chunks kept in memory by a store
+resolve_batch_size = 1000
+chunk_cache_size = 100_000
+# Set to expand every artifact back to full texts instead of deduplicating them
+expand_texts = False
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS chunks (
+    id INTEGER PRIMARY KEY,
+    hash BLOB NOT NULL UNIQUE,
+    text TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS texts (
+    hash BLOB PRIMARY KEY,
+    chunks BLOB NOT NULL
+) WITHOUT ROWID;
+"""
+
+
+def _digest(text: str) -> bytes:
+    return hashlib.sha256(text.encode('utf-8')).digest()[:16]
+
+
+def is_reference(value) -> bool:
+    return type(value) is str and value.startswith(TEXT_REFERENCE_PREFIX)
+
+
+def _is_long_text(value) -> bool:
+    return type(value) is str and len(value) >= min_text_length and not value.startswith(TEXT_REFERENCE_PREFIX)
+
+
+def _batches(items: Iterable, batch_size: int) -> Iterator[list]:
+    batch = []
+    for item in items:
+        batch.append(item)
+        if len(batch) == batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+class TextStore:
+    """
+    Content-addressed SQLite store of the long strings of the artifacts.
+
+    Translation, score and judgment files repeat the same texts: the source sentences
+    in every translation file, each translation in every judgment and consistency file
+    of its model, and both again inside the full prompts. A text is split into lines,
+    each distinct line is stored once in `chunks`, and a text is the list of its chunk
+    ids in `texts`, keyed by the text's hash. Artifacts hold the reference
+    TEXT_REFERENCE_PREFIX + hash instead of the text, so the store grows with the
+    distinct lines, and the prompts that combine the same translations pair by pair
+    cost a few bytes per line.
+    """
+
+    def __init__(self, db_path: str = text_store_file_path, timeout: float = 60.0):
+        self.db_path = db_path
+        directory = os.path.dirname(db_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        # Concurrent writers wait for each other's transaction instead of failing. Job
+        # workers on other machines resolve their tasks' texts from this file, so it uses
+        # the rollback journal, like job_queue.JobQueue: WAL needs shared memory on one host
+        self.connection = sqlite3.connect(db_path, timeout=timeout)
+        self.connection.execute("PRAGMA journal_mode=DELETE")
+        self.connection.executescript(SCHEMA)
+        self._chunk_ids: Dict[bytes, int] = {}
+        self._chunk_texts: Dict[int, str] = {}
+        self._known_texts = set()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def close(self):
+        self.connection.commit()
+        self.connection.close()
+
+    def _chunk_id(self, chunk: str) -> int:
+        digest = _digest(chunk)
+        chunk_id = self._chunk_ids.get(digest)
+        if chunk_id is None:
+            self.connection.execute("INSERT OR IGNORE INTO chunks (hash, text) VALUES (?, ?)", (digest, chunk))
+            chunk_id = self.connection.execute("SELECT id FROM chunks WHERE hash = ?", (digest,)).fetchone()[0]
+            self._chunk_ids[digest] = chunk_id
+        return chunk_id
+
+    def put(self, text: str) -> str:
+        """Store text unless it is stored already; returns its reference. Committed by commit() or close()."""
+        digest = _digest(text)
+        if digest not in self._known_texts:
+            if self.connection.execute("SELECT 1 FROM texts WHERE hash = ?", (digest,)).fetchone() is None:
+                chunk_ids = np.array([self._chunk_id(chunk) for chunk in text.split("\n")], dtype=np.int64)
+                self.connection.execute(
+                    "INSERT OR IGNORE INTO texts (hash, chunks) VALUES (?, ?)", (digest, chunk_ids.tobytes())
+                )
+            self._known_texts.add(digest)
+        return TEXT_REFERENCE_PREFIX + digest.hex()
+
+    def commit(self):
+        self.connection.commit()
+
+    def get_many(self, references: Iterable[str]) -> Dict[str, str]:
+        """The texts of references, by reference. Raises KeyError if one is not in the store."""
+        digests = {reference: bytes.fromhex(reference[len(TEXT_REFERENCE_PREFIX):]) for reference in references}
+        rows = {}
+        # SQLite limits the number of parameters of one statement
+        for batch in _batches(digests.values(), 500):
+            rows.update(self.connection.execute(
+                f"SELECT hash, chunks FROM texts WHERE hash IN ({','.join('?' * len(batch))})", batch
+            ))
+        missing = [reference for reference, digest in digests.items() if digest not in rows]
+        if missing:
+            raise KeyError(f"{len(missing)} referenced texts are missing from {self.db_path}, e.g. {missing[0]!r}")
+
+        chunk_ids = {digest: np.frombuffer(chunks, dtype=np.int64).tolist() for digest, chunks in rows.items()}
+        needed = {chunk_id for ids in chunk_ids.values() for chunk_id in ids if chunk_id not in self._chunk_texts}
+        if len(self._chunk_texts) + len(needed) > chunk_cache_size:
+            self._chunk_texts.clear()
+            needed = {chunk_id for ids in chunk_ids.values() for chunk_id in ids}
+        for batch in _batches(needed, 500):
+            self._chunk_texts.update(self.connection.execute(
+                f"SELECT id, text FROM chunks WHERE id IN ({','.join('?' * len(batch))})", batch
+            ))
+        return {
+            reference: "\n".join(self._chunk_texts[chunk_id] for chunk_id in chunk_ids[digest])
+            for reference, digest in digests.items()
+        }
+
+    def deduplicate(self, records: Iterable[dict]) -> Iterator[dict]:
+        """
+        The records with every string of at least min_text_length characters replaced by
+        its reference. The texts are committed once the records are exhausted, so a file
+        written from them is only renamed into place when its texts are in the store.
+        """
+        for record in records:
+            yield {column: self.put(value) if _is_long_text(value) else value for column, value in record.items()}
+        self.commit()
+
+    def resolve(self, records: List[dict]) -> List[dict]:
+        """Replace the references in records with their texts, in place."""
+        references = {value for record in records for value in record.values() if is_reference(value)}
+        if references:
+            texts = self.get_many(references)
+            for record in records:
+                for column, value in record.items():
+                    if is_reference(value):
+                        record[column] = texts[value]
+        return records
+
+
+def deduplicate_texts(records: Iterable[dict], db_path: str = text_store_file_path) -> Iterator[dict]:
+    """The records with their long strings stored in the text store at db_path and referenced."""
+    with TextStore(db_path) as store:
+        yield from store.deduplicate(records)
+
+
+def resolve_texts(records: Iterable[dict], db_path: str = text_store_file_path) -> Iterator[dict]:
+    """
+    The records with their references replaced by the texts. The store is opened at the
+    first reference, so records without any are passed through untouched.
+    """
+    store = None
+    try:
+        for batch in _batches(records, resolve_batch_size):
+            if store is None and any(is_reference(value) for record in batch for value in record.values()):
+                store = TextStore(db_path)
+            if store is not None:
+                store.resolve(batch)
+            yield from batch
+    finally:
+        if store is not None:
+            store.close()
+
+
+def main():
+    """Rewrite every artifact with its texts in the text store, or expanded back with expand_texts."""
+    from jsonl_io import export_folders, iter_jsonl, write_jsonl, write_parquet
+    for folder in export_folders:
+        if not os.path.isdir(folder):
+            continue
+        for filename in sorted(os.listdir(folder)):
+            file_path = os.path.join(folder, filename)
+            if not filename.endswith((".jsonl", ".parquet")):
+                continue
+            size = os.path.getsize(file_path)
+            records = iter_jsonl(file_path)
+            if not expand_texts:
+                records = deduplicate_texts(records)
+            # Each file keeps its format; the JSONL file is read while its replacement is written
+            if filename.endswith(".parquet"):
+                write_parquet(file_path, records)
+            else:
+                write_jsonl(file_path, records)
+            logging.info(f"{file_path}: {size / 2**20:.1f} MB -> {os.path.getsize(file_path) / 2**20:.1f} MB")
+    if os.path.exists(text_store_file_path):
+        logging.info(f"Text store {text_store_file_path}: {os.path.getsize(text_store_file_path) / 2**20:.1f} MB")
+
+
+if __name__ == "__main__":
+    main()
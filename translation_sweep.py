@@ -0,0 +1,251 @@
+import time
+import asyncio
+import inspect
+import logging
+import pandas as pd
+from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional
+from get_regular_translations import load_data, prepare_dataframe
+from call_stats import timed_call
+from jsonl_io import iter_jsonl, append_jsonl, appended_path, parquet_path, finish_appended_artifact, artifact_exists, read_jsonl_shards
+from sharded import prepare_shards, shard_path, merge_shards, default_shard_size
+from llm_services.get_gpt_4o_response import get_gpt_4o_response
+from llm_services.get_sonnet_3_point_5_response import get_sonnet_3_point_5_response
+from llm_services.get_o1_preview_response import get_o1_preview_response
+from llm_services.get_o1_mini_response import get_o1_mini_response
+from llm_services.get_aya_8b_response import get_aya_8b_response
+from llm_services.get_aya_32b_response import get_aya_32b_response
+from llm_services.get_llama_3_1_400b_response import get_llama_3_1_400b_response
+from llm_services.get_google_translate_response import get_google_translate_response
+from profiling import profiled
+
+logging.basicConfig(level=logging.INFO)
+
+# Requests in flight per provider, by llm_service.__name__
+provider_concurrency = {
+    "o1_preview": 4,
+    "o1_mini": 4,
+    "google_translate": 16
+}
+default_concurrency = 8
+
+sweep_llm_services = [
+    get_gpt_4o_response,
+    get_sonnet_3_point_5_response,
+    get_o1_preview_response,
+    get_o1_mini_response,
+    get_aya_8b_response,
+    get_aya_32b_response,
+    get_llama_3_1_400b_response,
+    get_google_translate_response
+]
+
+
+def _accepts_temperature(llm_service) -> bool:
+    parameters = inspect.signature(llm_service).parameters
+    return 'temperature' in parameters or any(p.kind == p.VAR_KEYWORD for p in parameters.values())
+
+
+def call_llm_service(llm_service, input_text: str, temperature: Optional[float]) -> str:
+    """
+    Call a response function from a worker thread. Most response functions are
+    coroutines around blocking clients, so each call gets its own event loop. The o1
+    models take no temperature; it is only passed to functions that accept it.
+    """
+    with timed_call(llm_service.__name__):
+        if temperature is None or not _accepts_temperature(llm_service):
+            return asyncio.run(llm_service(input_text))
+        return asyncio.run(llm_service(input_text, temperature=temperature))
+
+
+def translation_input(llm_service, row) -> str:
+    # Google Translate gets the conversation itself, the LLMs the full prompt
+    if llm_service == get_google_translate_response:
+        return row['joined_bemba_sentences']
+    return row['full_translation_prompt']
+
+
+def translation_file_name(output_directory: Path, name: str, t_number: int = None) -> Path:
+    if t_number is None:
+        return output_directory / f'big_c_conversations_test_{name}.jsonl'
+    return output_directory / f'big_c_conversations_test_{name}_t{t_number}.jsonl'
+
+
+def completed_ids(output_file_name: Path) -> set:
+    # The rows an earlier run finished, in either format, and those it appended before it stopped
+    ids = set()
+    for path in {output_file_name, Path(parquet_path(output_file_name)), Path(appended_path(output_file_name))}:
+        if path.exists():
+            ids.update(record['id'] for record in iter_jsonl(path, ['id']))
+    return ids
+
+
+class ProviderQueue:
+    """
+    The rows one provider still has to translate, worked off by `concurrency` workers.
+    Rows that are already in the output file are skipped, so an interrupted sweep
+    resumes where it stopped. output_file_name, if given, replaces the provider's
+    output file, e.g. with the checkpoint of a shard.
+    """
+
+    def __init__(self, llm_service, df: pd.DataFrame, output_directory: Path, t_number: int = None,
+                 temperature: float = .3, concurrency: Optional[int] = None, output_file_name: Optional[Path] = None):
+        self.llm_service = llm_service
+        self.name = llm_service.__name__
+        self.concurrency = concurrency or provider_concurrency.get(self.name, default_concurrency)
+        self.temperature = temperature
+        self.output_file_name = output_file_name or translation_file_name(output_directory, self.name, t_number)
+        if t_number is None:
+            self.column = f'{self.name}_translation'
+        else:
+            self.column = f'{self.name}_translation_t{t_number}'
+
+        done = completed_ids(self.output_file_name)
+        self.queue = asyncio.Queue()
+        for index, row in df.iterrows():
+            if row['id'] not in done:
+                self.queue.put_nowait((index, row))
+        self.total = self.queue.qsize()
+        self.completed = 0
+        self.failed = 0
+        self.elapsed = 0.0
+
+    async def _worker(self, executor: ThreadPoolExecutor):
+        loop = asyncio.get_running_loop()
+        while True:
+            try:
+                index, row = self.queue.get_nowait()
+            except asyncio.QueueEmpty:
+                return
+            try:
+                response = await loop.run_in_executor(
+                    executor, call_llm_service, self.llm_service, translation_input(self.llm_service, row), self.temperature
+                )
+                record = row.to_dict()
+                record[self.column] = response
+                # Save the response incrementally to avoid losing progress
+                append_jsonl(appended_path(self.output_file_name), [record])
+                self.completed += 1
+                if self.completed % 50 == 0:
+                    logging.info(f"{self.name}: {self.completed}/{self.total} translations")
+            except Exception as e:
+                self.failed += 1
+                logging.error(f"{self.name}: error processing index {index}: {e}")
+
+    async def run(self, executor: ThreadPoolExecutor):
+        start = time.perf_counter()
+        await asyncio.gather(*(self._worker(executor) for _ in range(self.concurrency)))
+        # Rows are appended as they finish; put them back in id order once the provider is done
+        finish_appended_artifact(self.output_file_name, sort_key=lambda record: record['id'])
+        self.elapsed = time.perf_counter() - start
+        logging.info(f"{self.name}: done in {self.elapsed:.1f}s ({self.completed} translated, {self.failed} failed)")
+
+
+@profiled
+async def sweep_translations(
+        df: pd.DataFrame,
+        llm_services: List,
+        output_directory: Path,
+        t_number: int = None,
+        temperature: float = .3,
+        concurrency: Optional[Dict[str, int]] = None
+) -> Dict[str, str]:
+    """
+    Translate df with every provider at once. Each provider has its own queue and
+    concurrency, so a slow provider only delays its own file and the sweep takes about
+    as long as the slowest provider rather than the sum of all of them.
+    Returns the output file of each provider, by name.
+    """
+    output_directory.mkdir(parents=True, exist_ok=True)
+    concurrency = concurrency or {}
+    queues = [
+        ProviderQueue(llm_service, df, output_directory, t_number, temperature, concurrency.get(llm_service.__name__))
+        for llm_service in llm_services
+    ]
+    for queue in queues:
+        logging.info(f"{queue.name}: {queue.total} rows to translate with {queue.concurrency} concurrent requests")
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=max(1, sum(queue.concurrency for queue in queues))) as executor:
+        await asyncio.gather(*(queue.run(executor) for queue in queues))
+    elapsed = time.perf_counter() - start
+
+    print(f"\n{'provider':<28}{'translated':>12}{'failed':>8}{'seconds':>10}")
+    for queue in queues:
+        print(f"{queue.name:<28}{queue.completed:>12}{queue.failed:>8}{queue.elapsed:>10.1f}")
+    print(f"{'sweep':<28}{sum(q.completed for q in queues):>12}{sum(q.failed for q in queues):>8}{elapsed:>10.1f}")
+    return {queue.name: str(queue.output_file_name) for queue in queues}
+
+
+@profiled
+async def sweep_translations_sharded(
+        input_file_path: Path,
+        llm_services: List,
+        output_directory: Path,
+        shard_size: int,
+        t_number: int = None,
+        temperature: float = .3,
+        concurrency: Optional[Dict[str, int]] = None
+) -> Dict[str, str]:
+    """
+    sweep_translations over input_file_path, shard_size rows at a time. Each provider
+    writes a shard's translations to its checkpoint, so a resumed sweep only calls the
+    providers for the rows that are not in a checkpoint yet. A provider's checkpoints
+    are merged into its output file once all of its rows are translated; until then a
+    rerun retries its failed rows, as it would in the output file of sweep_translations.
+    """
+    output_directory.mkdir(parents=True, exist_ok=True)
+    concurrency = concurrency or {}
+    output_files = {}
+    pending = []
+    for llm_service in llm_services:
+        output_file = translation_file_name(output_directory, llm_service.__name__, t_number)
+        output_files[llm_service.__name__] = str(output_file)
+        if artifact_exists(output_file):
+            logging.info(f"File {output_file} already exists. Skipping {llm_service.__name__}.")
+            continue
+        prepare_shards([str(input_file_path)], output_file, shard_size)
+        pending.append(llm_service)
+    if not pending:
+        return output_files
+
+    failed = dict.fromkeys((llm_service.__name__ for llm_service in pending), 0)
+    for k, df in enumerate(read_jsonl_shards(input_file_path, shard_size)):
+        df = prepare_dataframe(df)
+        logging.info(f"Shard {k}: {len(df)} rows")
+        queues = [
+            ProviderQueue(
+                llm_service, df, output_directory, t_number, temperature, concurrency.get(llm_service.__name__),
+                output_file_name=Path(shard_path(output_files[llm_service.__name__], k))
+            )
+            for llm_service in pending
+        ]
+        with ThreadPoolExecutor(max_workers=max(1, sum(queue.concurrency for queue in queues))) as executor:
+            await asyncio.gather(*(queue.run(executor) for queue in queues))
+        for queue in queues:
+            failed[queue.name] += queue.failed
+
+    for llm_service in pending:
+        name = llm_service.__name__
+        if failed[name]:
+            logging.warning(f"{name}: {failed[name]} rows failed; rerun the sweep to retry them before the shards are merged.")
+        else:
+            merge_shards(output_files[name])
+    return output_files
+
+
+async def sweep_regular_translations(llm_services: List, shard_size: Optional[int] = default_shard_size) -> Dict[str, str]:
+    """Regular translations of the test set for every provider, like get_regular_translations."""
+    if shard_size is not None:
+        output_files = await sweep_translations_sharded(
+            Path('./Data/Static/big_c_conversations_test.jsonl'), llm_services, Path('./Data/Output/translations'), shard_size
+        )
+        return {name: './' + path for name, path in output_files.items()}
+    df = prepare_dataframe(load_data(Path('./Data/Static'), 'big_c_conversations_test.jsonl'))
+    output_files = await sweep_translations(df, llm_services, Path('./Data/Output/translations'))
+    return {name: './' + path for name, path in output_files.items()}
+
+
+if __name__ == "__main__":
+    asyncio.run(sweep_regular_translations(sweep_llm_services))
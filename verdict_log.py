@@ -0,0 +1,57 @@
+import os
+import json
+from typing import List
+
+# Append-only log of the judges' battle verdicts, one JSON object per line:
+# {"battle_type", "id", "model_1", "model_2", "winner"} with winner a model name or 'tie'
+verdict_log_file_path = "./Data/Output/verdicts/verdicts.jsonl"
+
+
+def append_verdict(
+    battle_type: str,
+    id,
+    model_1: str,
+    model_2: str,
+    winner: str,
+    file_path: str = verdict_log_file_path
+):
+    """Append one verdict as a single line, so readers never see half of it."""
+    if winner not in (model_1, model_2):
+        # Same as compile_prepared_files: anything but a model name counts as a tie
+        winner = 'tie'
+    line = json.dumps({
+        'battle_type': battle_type,
+        'id': int(id),
+        'model_1': model_1,
+        'model_2': model_2,
+        'winner': winner
+    }) + "\n"
+    os.makedirs(os.path.dirname(file_path) or '.', exist_ok=True)
+    with open(file_path, 'a') as f:
+        f.write(line)
+
+
+class VerdictLogTail:
+    """
+    Follow the verdict log like `tail -f`: each read_new() returns the verdicts appended
+    since the previous call. A trailing line without its newline is kept for the next
+    call; if the log is truncated or replaced, it is read again from the start.
+    """
+
+    def __init__(self, file_path: str = verdict_log_file_path, from_start: bool = False):
+        self.file_path = file_path
+        self.offset = 0
+        if not from_start and os.path.exists(file_path):
+            self.offset = os.path.getsize(file_path)
+
+    def read_new(self) -> List[dict]:
+        if not os.path.exists(self.file_path):
+            return []
+        if os.path.getsize(self.file_path) < self.offset:
+            self.offset = 0
+        with open(self.file_path, 'rb') as f:
+            f.seek(self.offset)
+            data = f.read()
+        complete = data.rfind(b"\n") + 1
+        self.offset += complete
+        return [json.loads(line) for line in data[:complete].splitlines() if line.strip()]